@@ -0,0 +1,182 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+from docopt import docopt
+import logging
+import getpass
+import shutil
+import json
+import time
+import os
+from tableau_dr.env_manager import EnvironmentManager
+from tableau_dr.tab_server_connector import TableauServerConnector
+from tableau_dr.fake_winrm import FakeWinRMServer, TableauStandIn
+from tableau_dr.benchmark import run_benchmarks, run_connector_benchmarks, compare_results
+from validate_prepare_env import validate_remote_server
+import defaults as d
+
+CONNECTOR_USER = "tableau_dr"
+CONNECTOR_PASSWORD = "benchmark"
+CONNECTOR_DOMAIN = "LOGON"
+CONNECTOR_TABLEAU_VERSION = "10.0"
+CONNECTOR_APP_DATA_DIR = "C:\\ProgramData\\Tableau\\Tableau Server"
+
+
+# Target side of a switchover: everything execute_switchover runs on the target Tableau Server
+def switchover_target(connector):
+    connector.stop()
+    connector.restore_postgres()
+    connector.reindex()
+    connector.start()
+
+
+def benchmark_file_paths(args):
+    work_dir = os.path.abspath(args.get("--work_dir"))
+    if os.path.exists(work_dir) and len(os.listdir(work_dir)) > 0:
+        raise Exception("Work directory %s is not empty!" % work_dir)
+
+    env_manager = EnvironmentManager(rescue_user=getpass.getuser(),
+                                     is_sudoer=False,
+                                     pg_data_root_dir=None,
+                                     cluster_source_root_dir=os.path.join(work_dir, "clusters", "source"),
+                                     sync_root_dir=os.path.join(work_dir, "sync"),
+                                     cluster_target_root_dir=os.path.join(work_dir, "clusters", "target"),
+                                     tab_data_config_dir="config",
+                                     mount_dir=d.CLUSTER_SERVER_DIR,
+                                     pg_absolute_dir=args.get("--pg_dir"),
+                                     pg_database=d.BENCHMARK_PG_DATABASE,
+                                     pg_user=args.get("--pg_user"),
+                                     pg_password=None,
+                                     pg_port=int(args.get("--pg_port")),
+                                     cluster_source_pg_data_dir=None,
+                                     cluster_target_pg_data_dir=None,
+                                     backups_dir=os.path.join(work_dir, "backups"),
+                                     dr_unix_ip="127.0.0.1",
+                                     tdfs_enabled=False,
+                                     filestore_app_dir=None,
+                                     filestore_temp_mount_dir=None,
+                                     dataengine_dir=None,
+                                     is_reverse=False,
+                                     rescue_dir=work_dir)
+    # Comparing the extracts like TDFS does only needs the dataengine directory, the filestore is not started
+    env_manager.dataengine_dir = d.DATAENGINE_DIR
+
+    try:
+        return run_benchmarks(env_manager,
+                              extract_count=int(args.get("--extracts")),
+                              seed=int(args.get("--seed")),
+                              skip_postgres=args.get("--skip_postgres"))
+    finally:
+        if not args.get("--keep"):
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+# Run the connector's validate and switchover operations against local stand-ins of Tableau Servers
+def benchmark_connector(args):
+    server_connectors = []
+    for i in range(int(args.get("--connections"))):
+        stand_in = TableauStandIn(operation_duration_sec=float(args.get("--operation_sec")),
+                                  user=CONNECTOR_USER,
+                                  domain=CONNECTOR_DOMAIN)
+        server = FakeWinRMServer(handlers=stand_in.handlers(),
+                                 username="%s@%s" % (CONNECTOR_USER, CONNECTOR_DOMAIN),
+                                 password=CONNECTOR_PASSWORD,
+                                 latency_sec=float(args.get("--latency_ms")) / 1000,
+                                 failure_rate=float(args.get("--failure_rate")),
+                                 failure_mode=args.get("--failure_mode"),
+                                 seed=i)
+        connector = TableauServerConnector(host=server.start(),
+                                           user=CONNECTOR_USER,
+                                           password=CONNECTOR_PASSWORD,
+                                           domain=CONNECTOR_DOMAIN,
+                                           tableau_version=CONNECTOR_TABLEAU_VERSION,
+                                           tableau_app_data_dir=CONNECTOR_APP_DATA_DIR,
+                                           protocol="plaintext")
+        server_connectors.append((server, connector))
+
+    try:
+        return run_connector_benchmarks(server_connectors,
+                                        [("connect", lambda x: x.connect()),
+                                         ("test_connection", lambda x: x.test_connection()),
+                                         ("validate_remote_server", validate_remote_server),
+                                         ("status", lambda x: x.status()),
+                                         ("switchover_target", switchover_target)])
+    finally:
+        for server, connector in server_connectors:
+            server.stop()
+
+
+if __name__ == '__main__':
+
+    doc = """benchmark.py - Benchmark the replication, backup and dump paths of Tableau DR on synthetic Tableau Server data.
+
+    Every path runs on this machine: the source and target Tableau Servers are directories of the work directory
+    and the repository is a database of a local Postgres. Run it as a user that is not the rescue user of a
+    production rescue group, its replication cron jobs are added and removed while benchmarking.
+    With connector, the WinRM round trips of validation and switchover are measured against local stand-ins
+    of Tableau Servers instead.
+
+    Usage:
+        benchmark.py (-h | --help)
+        benchmark.py --work_dir=<work_dir> [--extracts=<extracts>] [--seed=<seed>] [--output=<output>] [--baseline=<baseline>] [--pg_dir=<pg_dir>] [--pg_port=<pg_port>] [--pg_user=<pg_user>] [--skip_postgres] [--keep]
+        benchmark.py connector [--connections=<connections>] [--latency_ms=<latency_ms>] [--operation_sec=<operation_sec>] [--failure_rate=<failure_rate>] [--failure_mode=<failure_mode>] [--output=<output>] [--baseline=<baseline>]
+
+    Options:
+        -h, --help                                          Show this screen.
+        --work_dir=<work_dir>                               REQUIRED: Absolute path of an empty directory to generate
+                                                            the data in.
+        --extracts=<extracts>                               Number of extracts to generate [default: 1000].
+        --seed=<seed>                                       Seed of the generated layout and sizes [default: 0].
+        --output=<output>                                   File to write the results to as JSON, by default a
+                                                            timestamped file in the current directory.
+        --baseline=<baseline>                               Results of an earlier run to compare the durations with.
+        --pg_dir=<pg_dir>                                   Postgres installation to dump with [default: /usr/local/tableau_dr_pgsql].
+        --pg_port=<pg_port>                                 Port of the local Postgres [default: 5432].
+        --pg_user=<pg_user>                                 Superuser of the local Postgres [default: postgres].
+        --skip_postgres                                     Only benchmark the file paths.
+        --keep                                              Keep the generated data.
+        --connections=<connections>                         Number of Tableau Servers to run the operations on
+                                                            at the same time [default: 2].
+        --latency_ms=<latency_ms>                           Delay of every WinRM request [default: 0].
+        --operation_sec=<operation_sec>                     Duration of tabadmin start, stop, restore and reindex
+                                                            [default: 0].
+        --failure_rate=<failure_rate>                       Share of WinRM requests to fail [default: 0].
+        --failure_mode=<failure_mode>                       How requests fail: http_error, auth, operation_timeout
+                                                            or hang [default: http_error].
+    """
+
+    args = docopt(doc, help=True, version=None)
+    logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(asctime)s - %(message)s')
+
+    if args.get("connector"):
+        results = benchmark_connector(args)
+    else:
+        results = benchmark_file_paths(args)
+
+    if args.get("--baseline"):
+        with open(args.get("--baseline"), "r") as f:
+            results["baseline_ratios"] = compare_results(results, json.load(f))
+        for name, ratio in sorted(results["baseline_ratios"].items()):
+            logging.info("%-32s %6.2fx of the baseline" % (name, ratio))
+
+    output_file_path = args.get("--output") or d.BENCHMARK_RESULTS_FILE.format(
+        timestamp=time.strftime(d.BACKUP_TIMESTAMP_FORMAT))
+    with open(output_file_path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    logging.info("Benchmark results have been written to %s." % output_file_path)
@@ -32,6 +32,11 @@ RESCUE_ENV_KEYS = ["rescue_user",
 RECOVERY_POSTGRES_KEYS = ["password"]
 
 REMOTE_PG_CONNECT_MAX_RETRIES = 5
+REMOTE_PG_CONNECT_INITIAL_WAIT_SEC = 2
+REMOTE_PG_CONNECT_MAX_WAIT_SEC = 30
+PG_POOL_MAX_CONNECTIONS = 2
+PG_CONNECT_TIMEOUT_SEC = 10
+REMOTE_COMMAND_MAX_WAIT_SEC = 120
 NET_SHARE_DATA_CMD = "net share tableau_data=\"{programdata_dir}\" /GRANT:{domain}\\{user},FULL"
 NET_SHARE_FILES_CMD = "net share tableau_data=\"{programfiles_dir}\" /GRANT:{domain}\\{user},READ"
 NET_SHARE_DELETE = "net share tableau_data /delete /Y"
@@ -60,11 +65,30 @@ PGPASS_FILE_CONTENT = "{host}:{port}:{database}:{user}:{pwd}"
 WORKGROUP_PG_DUMP_FILE = "workgroup.pg_dump"
 CMD_AS_PG_USER = "sudo LD_LIBRARY_PATH={pg_dir}/lib -i -H -u postgresql bash -c '{cmd}'"
 CMD_ROOT_AS_PG_USER = "export LD_LIBRARY_PATH=$LD_LIBRARY_PATH:{pg_dir}/lib"
-MANAGE_PG_COMMAND = "{pg_dir}/bin/pg_ctl {operation} -D {pg_data_dir} -l {pg_dir}/logs/postgresql_{pg_data_dir_short}.log"
+MANAGE_PG_COMMAND = "{pg_dir}/bin/pg_ctl {operation} -D {pg_data_dir} -o \"-p {pg_port}\" -l {pg_dir}/logs/postgresql_{pg_data_dir_short}.log"
 PG_BASEBACKUP_CMD = "{pg_dir}/bin/pg_basebackup -h {host} -p {pg_port} -D {pg_data_dir} -U {pg_user} --no-password"
+PG_BASEBACKUP_WAL_METHODS = ["stream", "fetch"]
+PG_BASEBACKUP_DEFAULT_WAL_METHOD = "stream"
+PROGRESS_LOG_INTERVAL_SEC = 10
 BACKUP_SQL_FILE = 'backup.sql'
-PG_DUMP_COMMAND = "{pg_dir}/bin/pg_dump -h localhost -U {user} -d {database} -F {dump_format} -Z 0 -c -C"
-PG_DUMPALL_COMMAND = "{pg_dir}/bin/pg_dumpall -h localhost -U {user} --roles-only"
+PG_DUMP_COMMAND = "{pg_dir}/bin/pg_dump -h localhost -p {port} -U {user} -d {database} -F {dump_format} -Z 0 -c -C"
+PG_DUMPALL_COMMAND = "{pg_dir}/bin/pg_dumpall -h localhost -p {port} -U {user} --roles-only"
+PG_RESTORE_LIST_COMMAND = "{pg_dir}/bin/pg_restore --list {dump_file_path}"
+PG_RESTORE_TABLE_DATA_COMMAND = "{pg_dir}/bin/pg_restore --data-only --table={table} -f - {dump_file_path}"
+PSQL_QUERY_COMMAND = "{pg_dir}/bin/psql -h {host} -p {port} -U {user} {database} --no-password -v ON_ERROR_STOP=1 -A -t -q"
+PG_ARCHIVE_BASEBACKUP_CMD = "{pg_dir}/bin/pg_basebackup -h {host} -p {pg_port} -D {base_backup_dir} -U {pg_user} -F t -z --no-password"
+WAL_RECEIVER_TEMPLATE = "/usr/bin/flock -n {archive_dir}/receiver.lock env LD_LIBRARY_PATH={pg_dir}/lib PGPASSFILE={archive_dir}/.pgpass {pg_dir}/bin/pg_receivexlog -h {host} -p {port} -U {user} -D {wal_dir} --no-password"
+PG_START_BACKUP_QUERY = "SELECT pg_start_backup('tableau_dr_resync', true);"
+PG_STOP_BACKUP_QUERY = "SELECT pg_stop_backup();"
+# Files that are either local to the replica or recreated by Postgres are not copied by an incremental resync
+PG_RESYNC_CMD = "sudo rsync -rlt --delete --stats --exclude=/postmaster.pid --exclude=/postmaster.opts " \
+                "--exclude=/recovery.conf --exclude=/recovery.done --exclude=/postgresql.conf " \
+                "--exclude=/pg_xlog/* --exclude=/pg_replslot/* --exclude=/pg_stat_tmp/* " \
+                "{source_pg_data_dir} {pg_data_dir}"
+TABLEAU_PG_DATA_DIR = "data/tabsvc/pgsql/data"
+PG_RESYNC_MODES = ["incremental", "full"]
+REMOTE_PG_PORT = 8060
+REMOTE_PG_USER = "tableau"
 # Postgres commands on windows
 START_PG_PS = "start-Process -FilePath '{tab_install_dir}\\{tab_version}\\pgsql\\bin\\pg_ctl.exe' " \
               "-ArgumentList 'start -D \"{tableau_app_data}/data/tabsvc/pgsql/data\" " \
@@ -82,6 +106,14 @@ primary_conninfo = 'host={host} port={port} user={user} password={password}'
 trigger_file = '/this/should/never/exist'
 """
 
+# pg_receivexlog keeps the segment it is writing as %f.partial, it holds the newest WAL
+RESTORE_COMMAND_CONF = "restore_command = 'cp {wal_dir}/%f %p || cp {wal_dir}/%f.partial %p'"
+
+PITR_RECOVERY_CONF_CONTENT = """restore_command = 'cp {wal_dir}/%f %p || cp {wal_dir}/%f.partial %p'
+recovery_target_time = '{target_time}'
+recovery_target_action = 'promote'
+"""
+
 POSTGRESQL_CONF_CONTENT = """hot_standby = on
 max_connections = 258
 max_locks_per_transaction = 128
@@ -94,13 +126,27 @@ REPLICATION_DIRS = ["data/tabsvc/httpd/htdocs/webdataconnectors",
 SYNC_ONLY_REPLICATION_DIRS = ["config"]
 
 #RSYNC_TEMPLATE = "sh -c '/usr/bin/flock -w 1 {rescue_dir}/cron.lock{uuid} rsync -a -v --delete {source_path} {destination_path} | pv -l -s $(rsync -a -v --delete {source_path} {destination_path} --dry-run | wc -l) > /dev/null'"
-RSYNC_TEMPLATE = "/usr/bin/flock -w 1 {rescue_dir}/cron.lock{uuid} rsync -a -v --delete {source_path} {destination_path}"
+# The bandwidth limit is read from a file on every run so that the replication scheduler can throttle the cron jobs
+RSYNC_TEMPLATE = "/usr/bin/flock -w 1 {rescue_dir}/cron.lock{uuid} rsync -a -v --delete --bwlimit=$(cat {rescue_dir}/bwlimit{uuid} 2>/dev/null || echo 0) {source_path} {destination_path}"
+RSYNC_BWLIMIT_FILE = "bwlimit{uuid}"
+RSYNC_LOCK_FILE = "cron.lock{uuid}"
 
 MOUNT_CIFS_CMD_DATA = "sudo mount.cifs -v //{server_host}/tableau_data {mount_abs_path} -o credentials={cred_file_path},uid={rescue_user},gid={rescue_user},{rights}"
 MOUNT_CIFS_CMD_FILES = "sudo mount.cifs -v //{server_host}/tableau_files {mount_abs_path} -o credentials={cred_file_path},uid={rescue_user},gid={rescue_user},{rights}"
 UMOUNT_CMD = "sudo umount {mount_abs_path}"
+UMOUNT_LAZY_CMD = "sudo umount -f -l {mount_abs_path}"
+MOUNT_PROBE_TIMEOUT_SEC = 10
+MOUNT_PROBE_INTERVAL_SEC = 60
+MOUNT_MAX_REMOUNT_ATTEMPTS = 2
+# Additional CIFS mount options by profile. SMB 2.1 is the newest version every Windows Server
+# supported by Tableau Server 10 speaks.
+CIFS_MOUNT_PROFILES = {"default": "",
+                       "bulk-copy": "vers=2.1,rsize=4194304,wsize=4194304,cache=strict,actimeo=1",
+                       "metadata-heavy": "vers=2.1,rsize=1048576,wsize=1048576,cache=strict,actimeo=30"}
+SMB_VERSIONS = ["1.0", "2.0", "2.1", "3.0", "3.02", "3.1.1"]
+MOUNT_BENCHMARK_TIME_LIMIT_SEC = 30
+MOUNT_BENCHMARK_MAX_READ_BYTES = 512 * 1048576
 
-# TODO: Handle different Tableau versions!
 PG_BUILD_PROCEDURE = [
     "./configure --prefix={prefix} --disable-rpath --enable-thread-safety --enable-integer-datetimes --enable-nls --with-ldap --with-openssl --with-libxml --with-libxslt --with-tcl --with-perl --with-python --enable-float8-byval",
      "make",
@@ -137,8 +183,14 @@ TABLEAU_VERSION_LIMIT_UPPER = 10.2
 TEST_PATH_PS_CMD = "$PathExists = Test-Path \"{path}\"\n" \
                    "If ($FileExists -eq $False) {{ exit 1 }} Else {{ exit 0 }}"
 
-PG_SOURCE_URL = "https://ftp.postgresql.org/pub/source/v9.5.3/postgresql-9.5.3.tar.bz2"
+PG_SOURCE_URL = "https://ftp.postgresql.org/pub/source/v{version}/postgresql-{version}.tar.bz2"
 PG_VERSION = "9.5.3"
+# Postgres version to build for the Postgres bundled with each Tableau Server version
+PG_VERSION_MATRIX = {"10.0": "9.5.3",
+                     "10.1": "9.5.3",
+                     "10.2": "9.5.3"}
+PG_BUNDLE_DIRS = ["bin", "include", "lib", "share"]
+PG_BUNDLE_DIR = "pg_bundles"
 
 SMB_CREDENTIALS_CONTENT = """username={user}
 password={password}
@@ -149,3 +201,128 @@ REPLACE_FILE_CONTENT_CMD = "(Get-Content \"{file_name}\") | ForEach-Object " \
                            "{{ $_ -creplace \"{replace_from}\", \"{replace_to}\"}} | Set-Content \"{file_name}\""
 
 MIN_ALLOWED_WINRM_SHELL_MEMORY = 4096
+
+# Service mode
+SERVICE_SOCKET_PATH = "~/tableau_dr/tableau_dr.sock"
+SERVICE_MAX_PARALLEL_OPERATIONS = 2
+SERVICE_VALIDATE_INTERVAL_SEC = 900
+VALIDATION_FRESHNESS_SEC = 300
+SERVICE_COMMANDS = ["status",
+                    "validate",
+                    "backup",
+                    "switchover",
+                    "archive",
+                    "resync",
+                    "preseed",
+                    "shutdown"]
+
+# Validation cache
+VALIDATION_CACHE_FILE = "validation_cache.json"
+VALIDATION_CACHE_DEFAULT_TTL_SEC = 600
+VALIDATION_CACHE_TTL_SEC = {"os": 86400,
+                            "user": 86400,
+                            "rescue_dir": 3600,
+                            "paths": 3600,
+                            "mountdir": 300,
+                            "replication": 300,
+                            "postgres": 60,
+                            "source_server": 1800,
+                            "target_server": 1800}
+
+# Replication scheduler
+REPLICATION_THROTTLE_INTERVAL_SEC = 30
+REPLICATION_MIN_BWLIMIT_KBPS = 512
+REPLICATION_MAX_SOURCE_LATENCY_MS = 200
+REPLICATION_PAIRS = ["source_sync",
+                     "sync_target",
+                     "target_sync",
+                     "sync_source"]
+WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+# Replica monitor
+REPLICA_LAG_HISTORY_FILE = "replica_lag.jsonl"
+REPLICA_LAG_MAX_SAMPLES = 10080
+REPLICA_MONITOR_INTERVAL_SEC = 60
+REPLICA_LAG_WARNING_RATIO = 0.8
+WAL_SEGMENT_SIZE_BYTES = 16 * 1024 * 1024
+
+# WAL archive
+WAL_ARCHIVE_DIR = "wal_archive"
+WAL_ARCHIVE_RETENTION_SEC = 3 * 24 * 3600
+WAL_ARCHIVE_BASE_BACKUP_INTERVAL_SEC = 24 * 3600
+WAL_ARCHIVE_MAX_RECEIVER_DELAY_SEC = 300
+PITR_RECOVERY_TIMEOUT_SEC = 3600
+PITR_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Storage layout
+DATA_DIR = "data"
+BACKUPS_DIR = "backups"
+BACKUP_STAGING_DIR = "backup_staging"
+BACKUP_TEMP_DIR_PREFIX = "tableau_dr_backup_"  # Directories a backup is staged in, inside the staging directory
+SNAPSHOT_METHODS = ["auto", "reflink", "hardlink", "copy"]
+SNAPSHOT_DEFAULT_METHOD = "auto"
+
+# Backup coordinator
+BACKUP_FENCE_TIMEOUT_SEC = 600
+PG_REPLAY_PAUSE_QUERY = "SELECT pg_xlog_replay_pause();"
+PG_REPLAY_RESUME_QUERY = "SELECT pg_xlog_replay_resume();"
+PG_REPLAY_LOCATION_QUERY = "SELECT pg_is_in_recovery(), pg_last_xlog_replay_location();"
+
+# Backup retention
+BACKUP_FILE_TEMPLATE = "backup-{timestamp}.tsbak"
+BACKUP_TIMESTAMP_FORMAT = "%Y%m%d%H%M%S"
+BACKUP_INDEX_FILE = "backup_index.json"
+BACKUP_RETENTION_TIERS = ["hourly", "daily", "weekly", "monthly"]
+BACKUP_SIZE_MARGIN = 1.2
+
+# Backup verification
+BACKUP_MANIFEST_FILE = "manifest.yml"
+BACKUP_REQUIRED_FILES = ["manifest.yml", "config.yml", "workgroup.pg_dump", "backup.sql"]
+BACKUP_REQUIRED_DUMP_TABLES = ["workbooks", "datasources", "extracts", "users", "sites"]
+BACKUP_EXTRACTS_TABLE = "extracts"
+BACKUP_READ_CHUNK_BYTES = 1048576
+
+# Backup sinks
+BACKUP_SINK_TYPES = ["local", "s3"]
+BACKUP_SINK_PART_SIZE_BYTES = 64 * 1048576
+BACKUP_SINK_MIN_PART_SIZE_BYTES = 5 * 1048576
+BACKUP_SINK_MAX_PARALLEL_UPLOADS = 4
+BACKUP_SINK_PART_RETRIES = 3
+
+# Pre-seeding the target's extracts
+PRESEED_RSYNC_CMD = "rsync -a --files-from={file_list_path} {source_path} {destination_path}"
+PRESEED_INDEX_FILE = "target_file_state.json"
+
+# Benchmark suite
+BENCHMARK_EXTRACT_COUNT = 1000
+BENCHMARK_EXTRACT_MEDIAN_BYTES = 256 * 1024
+BENCHMARK_EXTRACT_SIZE_SIGMA = 1.5  # Spread of the lognormal extract sizes, most are small, a few are very large
+BENCHMARK_EXTRACT_MAX_BYTES = 256 * 1048576
+BENCHMARK_WEBDATACONNECTOR_COUNT = 20
+BENCHMARK_CHANGED_FRACTION = 0.05
+BENCHMARK_PG_DATABASE = "tableau_dr_benchmark"
+BENCHMARK_PG_ROWS_PER_EXTRACT = 200  # Rows of the http_requests table per extract, the largest table of a repository
+BENCHMARK_RESULTS_FILE = "benchmark-{timestamp}.json"
+
+# Profiling
+PROFILE_ENV_VAR = "tableau_dr_PROFILE"
+PROFILE_SAMPLE_INTERVAL_SEC = 0.01
+PROFILE_MAX_TRACE_EVENTS = 500000  # Spans beyond this are counted but not recorded, e.g. in a long-running service
+PROFILE_TRACE_FILE = "trace-{timestamp}-{pid}.json"
+PROFILE_STACKS_FILE = "profile-{timestamp}-{pid}.folded"
+
+# Logging
+LOG_FILE = "tableau_dr.log"
+LOG_FORMAT_ENV_VAR = "tableau_dr_LOG_FORMAT"  # json (default) or text, the format of the log file
+LOG_SYSLOG_ENV_VAR = "tableau_dr_SYSLOG"  # Also send the log to syslog at e.g. /dev/log (journald) or host:514
+LOG_MAX_BYTES = 52428800  # Size of the log file before it is rotated, 50 MB
+LOG_BACKUP_COUNT = 5
+LOG_MAX_MESSAGE_CHARS = 16384  # Longer messages, e.g. with the output of a command, keep their start and end only
+LOG_QUEUE_SIZE = 10000  # Records beyond this are dropped instead of blocking the logging thread
+
+# Command output
+CMD_OUTPUT_CAPTURE_BYTES = 65536  # Output kept of a verbose command, the rest is counted only
+CMD_ERROR_OUTPUT_BYTES = 8192  # Output of a failed command in its error message, per stream
+CMD_OUTPUT_ENV_VAR = "tableau_dr_CAPTURE_OUTPUT"  # Also write the complete output of every command to a file
+CMD_OUTPUT_DIR = "~/tableau_dr/logs/commands"
+CMD_OUTPUT_FILE = "{timestamp}-{pid}-{sequence}-{name}.{stream}"
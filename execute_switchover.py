@@ -19,6 +19,27 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import logging
 import shutil
 import os
+from tableau_dr.concurrency import run_concurrently
+
+
+# Dump the source's Postgres replica onto the target's share and turn the replica off
+def dump_and_stop_source_replica(env_manager):
+    logging.info("Executing Tableau Postgres Repository dump...")
+    pgdump_files_destination_dir = env_manager.cluster_target_mount_full_path
+    env_manager.execute_source_pgdump(destination_dir=pgdump_files_destination_dir)
+    logging.info("Executing Tableau Postgres Repository dump has been successful!")
+
+    logging.info("Turning off source machine's Postgres replica on Rescue Unix...")
+    env_manager.stop_source_postgres()
+    logging.info("Source machine's Postgres replica has been successfully turned off!")
+
+
+# Stop the target Tableau Server while the repository is being dumped on Rescue Unix
+def dump_source_and_stop_target(env_manager, target_server):
+    logging.info("Stopping Tableau Server on the target machine...")
+    run_concurrently([("pgdump", lambda: dump_and_stop_source_replica(env_manager)),
+                      ("stop_target", target_server.stop)])
+
 
 def execute_switchover(env_manager, source_server, target_server):
     if target_server is None:
@@ -37,19 +58,10 @@ def execute_switchover(env_manager, source_server, target_server):
     #source_server.stop()
     #logging.info("Tableau Server has been successfully stopped on the source server (%s)" % source_server.host)
 
-    logging.info("Executing Tableau Postgres Repository dump...")
-    pgdump_files_destination_dir = env_manager.cluster_target_mount_full_path
-    env_manager.execute_source_pgdump(destination_dir=pgdump_files_destination_dir)
-    logging.info("Executing Tableau Postgres Repository dump has been successful!")
-
-    logging.info("Turning off source machine's Postgres replica on Rescue Unix...")
-    env_manager.stop_source_postgres()
-    logging.info("Source machine's Postgres replica has been successfully turned off!")
+    # Dump the replica and stop the target server concurrently
+    dump_source_and_stop_target(env_manager, target_server)
 
     # Target server
-    logging.info("Stopping Tableau Server on the target machine...")
-    # Making sure that the target server is in fact stopped
-    target_server.stop()
     logging.info("Restoring Tableau Postgres Repository on the target machine...")
     target_server.restore_postgres()
     logging.info("Reindexing the target machine's Tableau Server...")
@@ -105,19 +117,10 @@ def execute_switchover_test(env_manager, source_server, target_server, tsbak_url
     logging.info("Tableau File Store Repository sync has been successfully disabled!")
 
     # Source server
-    logging.info("Executing Tableau Postgres Repository dump...")
-    pgdump_files_destination_dir = env_manager.cluster_target_mount_full_path
-    env_manager.execute_source_pgdump(destination_dir=pgdump_files_destination_dir)
-    logging.info("Executing Tableau Postgres Repository dump has been successful!")
-
-    logging.info("Turning off source machine's Postgres replica on Rescue Unix...")
-    env_manager.stop_source_postgres()
-    logging.info("Source machine's Postgres replica has been successfully turned off!")
+    # Dump the replica and stop the target server concurrently
+    dump_source_and_stop_target(env_manager, target_server)
 
     # Target server
-    logging.info("Stopping Tableau Server on the target machine...")
-    # Making sure that the target server is in fact stopped
-    target_server.stop()
     logging.info("Restoring Tableau Postgres Repository on the target machine...")
     target_server.restore_postgres()
     logging.info("Reindexing the target machine's Tableau Server...")
@@ -0,0 +1,440 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import threading
+import time
+import os
+from validate_prepare_env import validate_tableau_dr, prepare_tableau_dr, uninstall_tableau_dr
+from execute_switchover import execute_switchover, execute_switchover_test
+from tableau_dr.env_manager import EnvironmentManager
+from tableau_dr.config_parser_class import ConfigParser
+from tableau_dr.validation_cache import ValidationCache, config_file_fingerprint, mounts_fingerprint, \
+    crontab_fingerprint
+from tableau_dr.replication_scheduler import ReplicationScheduler
+from tableau_dr.replica_monitor import ReplicaMonitor
+from tableau_dr.wal_archive import WalArchive
+from tableau_dr.mount_manager import MountManager
+from tableau_dr.mount_benchmark import benchmark_mount
+from tableau_dr.backup_catalog import BackupCatalog
+import tableau_dr.backup_verifier as backup_verifier
+from tableau_dr.backup_sink import create_sinks
+from tableau_dr.extract_seeder import ExtractSeeder
+import tableau_dr.profiler as profiler
+import tableau_dr.utils as utils
+import defaults as d
+
+
+# Custom exception
+class RescueGroupException(Exception):
+    pass
+
+
+# Get config data from file
+def get_config_data(config_file_path, cluster_name, reverse=False, tdfs_enabled=False):
+    config_data = utils.parse_config_file(config_file_path)
+    logging.debug("Successfully parsed configuration data!")
+    cluster_data = config_data.get(cluster_name)
+    if cluster_data is None:
+        raise Exception("The provided cluster name (%s) is not included in the configuration file!" % cluster_name)
+    if reverse:
+        cluster_data["reverse"] = True
+    if tdfs_enabled:
+        cluster_data["rescue_env"]["tdfs"] = True
+
+    return cluster_data
+
+
+# A rescue group with its parsed configuration, server connections and environment manager kept in memory
+class RescueGroup:
+
+    name = None
+    config_file_path = None
+    config_object = None
+    source_server = None
+    target_server = None
+    env_manager = None
+    dr_ip = None
+    validation_cache = None
+    replication_scheduler = None
+    replica_monitor = None
+    wal_archive = None
+    mount_manager = None
+
+    # Constructor
+    def __init__(self, name, config_file_path, reverse=False, tdfs_enabled=False):
+        logging.debug("Rescue group %s is being initialized!" % name)
+        self.name = name
+        self.config_file_path = config_file_path
+        self.lock = threading.RLock()  # Only one operation may run on a rescue group at a time
+        self.verification_lock = threading.RLock()  # Backups are verified and uploaded one at a time
+        self.verifying_file_names = set()  # Backups waiting for or under verification, retention keeps them
+        self.last_operation = None
+        self.last_error = None
+        self.last_validation_time = None
+
+        cluster_data = get_config_data(config_file_path=config_file_path,
+                                       cluster_name=name,
+                                       reverse=reverse,
+                                       tdfs_enabled=tdfs_enabled)
+
+        # Obtain configuration data
+        self.config_object = ConfigParser(cluster_data=cluster_data)
+        self.source_server = self.config_object.get_source_server()
+        self.target_server = self.config_object.get_target_server()
+        rescue_user, is_sudoer, cluster_a_root_dir, cluster_b_root_dir, cluster_sync_root_dir, mount_dir, \
+            backups_dir, tdfs_enabled, filestore_app_dir, filestore_temp_mount_dir, tab_data_config_dir, \
+            dataengine_dir = self.config_object.recovery_data()
+        pg_absolute_dir, pg_port, pg_user, pg_password, pg_database, pg_data_root_dir, pg_data_cluster_a_dir, \
+            pg_data_cluster_b_dir = self.config_object.postgres_data()
+        self.dr_ip = self.config_object.obtain_ip()
+        basebackup_max_rate, basebackup_wal_method, basebackup_staging = self.config_object.basebackup_data()
+        rescue_dir, backup_staging_dir, snapshot_method = self.config_object.storage_data()
+
+        # Obtain Environment Manager object
+        self.env_manager = EnvironmentManager(rescue_user=rescue_user,
+                                              is_sudoer=is_sudoer,
+                                              pg_data_root_dir=pg_data_root_dir,
+                                              cluster_source_root_dir=cluster_a_root_dir,
+                                              sync_root_dir=cluster_sync_root_dir,
+                                              cluster_target_root_dir=cluster_b_root_dir,
+                                              tab_data_config_dir=tab_data_config_dir,
+                                              mount_dir=mount_dir,
+                                              pg_absolute_dir=pg_absolute_dir,
+                                              pg_database=pg_database,
+                                              pg_user=pg_user,
+                                              pg_port=pg_port,
+                                              pg_password=pg_password,
+                                              cluster_source_pg_data_dir=pg_data_cluster_a_dir,
+                                              cluster_target_pg_data_dir=pg_data_cluster_b_dir,
+                                              backups_dir=backups_dir,
+                                              dr_unix_ip=self.dr_ip,
+                                              tdfs_enabled=tdfs_enabled,
+                                              filestore_app_dir=filestore_app_dir,
+                                              filestore_temp_mount_dir=filestore_temp_mount_dir,
+                                              dataengine_dir=dataengine_dir,
+                                              is_reverse=self.config_object.reverse,
+                                              basebackup_max_rate=basebackup_max_rate,
+                                              basebackup_wal_method=basebackup_wal_method,
+                                              basebackup_staging=basebackup_staging,
+                                              pg_bundle_dir=self.config_object.postgres_bundle_dir(),
+                                              pg_version=self.config_object.postgres_version(),
+                                              mount_options=self.config_object.mount_options(),
+                                              rescue_dir=rescue_dir,
+                                              backup_staging_dir=backup_staging_dir,
+                                              snapshot_method=snapshot_method)
+
+        cache_enabled, ttl_sec_by_check, default_ttl_sec = self.config_object.validation_cache_data()
+        if cache_enabled:
+            env_manager = self.env_manager
+            mount_paths = filter(lambda x: x is not None, [env_manager.cluster_source_mount_full_path,
+                                                           env_manager.cluster_target_mount_full_path])
+            trigger_functions = {"config": lambda: config_file_fingerprint(config_file_path),
+                                 "mounts": lambda: mounts_fingerprint(mount_paths),
+                                 "crontab": lambda: crontab_fingerprint(rescue_user)}
+            cache_file_path = os.path.join(rescue_dir, d.VALIDATION_CACHE_FILE)
+            self.validation_cache = ValidationCache(cache_file_path=cache_file_path,
+                                                    ttl_sec_by_check=ttl_sec_by_check,
+                                                    default_ttl_sec=default_ttl_sec,
+                                                    trigger_functions=trigger_functions)
+
+        retention_policy, max_total_bytes = self.config_object.backup_retention_data()
+        self.backup_catalog = BackupCatalog(backups_dir=backups_dir,
+                                            policy=retention_policy,
+                                            max_total_bytes=max_total_bytes)
+
+        # Sinks are created on upload, so that a sink missing its client library only fails the upload
+        self.backup_sinks_data = self.config_object.backup_sinks_data()
+
+        self.extract_seeder = ExtractSeeder(env_manager=self.env_manager,
+                                            index_file_path=os.path.join(rescue_dir, d.PRESEED_INDEX_FILE))
+
+        self.mount_manager = MountManager(mounts=self.env_manager.get_share_mounts(),
+                                          remount_function=lambda mount_path: self.env_manager.remount_share(
+                                              mount_path=mount_path,
+                                              source_server=self.source_server,
+                                              target_server=self.target_server))
+
+        throttle_enabled, throttle_windows, max_source_latency_ms = self.config_object.replication_throttle_data()
+        self.replication_scheduler = ReplicationScheduler(env_manager=self.env_manager,
+                                                          enabled=throttle_enabled,
+                                                          throttle_windows=throttle_windows,
+                                                          max_source_latency_ms=max_source_latency_ms,
+                                                          mount_manager=self.mount_manager)
+
+        archive_enabled, archive_retention_sec, base_backup_interval_sec = self.config_object.wal_archive_data()
+        if archive_enabled:
+            self.wal_archive = WalArchive(env_manager=self.env_manager,
+                                          source_host=self.source_server.host,
+                                          archive_root_dir=os.path.join(rescue_dir,
+                                                                        d.WAL_ARCHIVE_DIR),
+                                          retention_sec=archive_retention_sec,
+                                          base_backup_interval_sec=base_backup_interval_sec)
+
+        self.replica_monitor = ReplicaMonitor(env_manager=self.env_manager,
+                                              source_server=self.source_server,
+                                              history_file_path=os.path.join(rescue_dir,
+                                                                             d.REPLICA_LAG_HISTORY_FILE),
+                                              wal_archive=self.wal_archive)
+
+    def prepare(self):
+        self.__invalidate_validation()
+        prepare_tableau_dr(env_manager=self.env_manager,
+                           source_server=self.source_server,
+                           target_server=self.target_server,
+                           dr_ip=self.dr_ip,
+                           incremental_resync=self.config_object.postgres_resync_mode() == "incremental")
+        self.replication_scheduler.apply_budgets()
+        if self.wal_archive is not None:
+            self.wal_archive.enable()
+            self.wal_archive.maintain()
+
+    # Run every validation check, refreshing the cached results
+    def validate(self, force=True):
+        self.last_validation_time = None
+        self.mount_manager.ensure_healthy()
+        validate_tableau_dr(env_manager=self.env_manager,
+                            source_server=self.source_server,
+                            target_server=self.target_server,
+                            validation_cache=self.validation_cache,
+                            force=force,
+                            replica_monitor=self.replica_monitor)
+        self.last_validation_time = time.time()
+
+    # Validate the environment unless it has been successfully validated within the freshness window.
+    # Otherwise only the checks whose cached results have expired or whose inputs have changed are run.
+    def ensure_validated(self):
+        validation_freshness_sec = self.config_object.validation_freshness_sec()
+        if self.last_validation_time is not None:
+            validation_age_sec = time.time() - self.last_validation_time
+            if validation_age_sec <= validation_freshness_sec:
+                logging.info("The environment has been validated %d seconds ago, skipping validation."
+                             % validation_age_sec)
+                return
+        self.validate(force=False)
+
+    def switchover(self):
+        with self.replication_scheduler.urgent("switchover"):
+            self.mount_manager.ensure_healthy()  # Fail fast instead of hanging on a dead share
+            self.ensure_validated()
+            execute_switchover(env_manager=self.env_manager,
+                               source_server=self.source_server,
+                               target_server=self.target_server)
+            self.__invalidate_validation()  # Replication has been changed, the environment needs to be revalidated
+
+    # Create a backup of the current state, or of an earlier state recovered from the WAL archive
+    def backup(self, point_in_time=None):
+        if point_in_time is not None and self.wal_archive is None:
+            raise RescueGroupException("Point in time backups need the WAL archive to be enabled!")
+        with self.replication_scheduler.urgent("backup"):
+            self.mount_manager.ensure_healthy()  # Fail fast instead of hanging on a dead share
+            self.ensure_validated()
+            # Expired backups are deleted first, the space they free may be needed for this one
+            self.backup_catalog.apply_retention(keep_file_names=self.verifying_file_names)
+            self.backup_catalog.ensure_free_space(data_bytes_function=self.env_manager.sync_data_bytes)
+            start_time = time.time()
+            backup_file_path, replay_location = self.env_manager.create_backup(point_in_time=point_in_time,
+                                                                               wal_archive=self.wal_archive)
+            self.backup_catalog.add(backup_file_path,
+                                    duration_sec=round(time.time() - start_time, 1),
+                                    point_in_time=point_in_time,
+                                    replay_location=replay_location)
+            self.backup_catalog.apply_retention(keep_file_names=self.verifying_file_names)
+            self.verifying_file_names.add(os.path.basename(backup_file_path))
+
+        # Replication goes on while the backup is verified and uploaded
+        verification_thread = threading.Thread(target=self.__verify_in_background,
+                                               args=(backup_file_path,),
+                                               name="verify-%s" % self.name)
+        verification_thread.start()
+
+    # Verify that a backup file, the latest one by default, can be restored and record the result in the index
+    def verify_backup(self, backup_file=None):
+        backup_file_path = self.__get_backup_file_path(backup_file)
+        with self.verification_lock:
+            result = backup_verifier.verify_backup(file_path=backup_file_path,
+                                                   work_dir=self.env_manager.backup_staging_dir,
+                                                   list_dump_function=self.env_manager.list_pg_dump,
+                                                   table_data_function=self.env_manager.dump_table_data)
+            self.backup_catalog.add(backup_file_path, verification=result)
+        if not result["verified"]:
+            raise RescueGroupException("Backup %s is not restorable: %s" % (backup_file_path,
+                                                                           " ".join(result["errors"])))
+        return result
+
+    # Upload a backup file, the latest one by default, to every backup sink and record where it has been stored
+    def upload_backup(self, backup_file=None):
+        if len(self.backup_sinks_data) == 0:
+            raise RescueGroupException("No backup sinks are configured for rescue group %s!" % self.name)
+        backup_file_path = self.__get_backup_file_path(backup_file)
+        backup_sinks = create_sinks(self.backup_sinks_data)
+        with self.verification_lock:
+            catalog_entries = filter(lambda x: x["file_name"] == os.path.basename(backup_file_path),
+                                     self.backup_catalog.backups())
+            if len(catalog_entries) == 0:
+                raise RescueGroupException("%s is not a backup of rescue group %s!" % (backup_file_path, self.name))
+            uploads = dict(catalog_entries[0].get("uploads") or {})
+            failed_sinks = []
+            for sink in backup_sinks:
+                logging.info("Uploading %s to backup sink %s..." % (backup_file_path, sink.name))
+                start_time = time.time()
+                try:
+                    uploads[sink.name] = sink.upload(backup_file_path)
+                except Exception, e:
+                    logging.error("Uploading %s to backup sink %s has failed: %s" % (backup_file_path, sink.name, e))
+                    failed_sinks.append(sink.name)
+                    continue
+                uploads[sink.name]["uploaded_at"] = time.time()
+                logging.info("%s has been uploaded to %s in %.1f seconds!" % (backup_file_path,
+                                                                              uploads[sink.name]["location"],
+                                                                              time.time() - start_time))
+            self.backup_catalog.add(backup_file_path, uploads=uploads)
+            if len(failed_sinks) > 0:
+                raise RescueGroupException("Backup %s could not be uploaded to: %s" % (backup_file_path,
+                                                                                      ", ".join(failed_sinks)))
+        return uploads
+
+    # Backups of the rescue group from the backup index, ordered by age
+    def list_backups(self):
+        backups = self.backup_catalog.backups()
+        for backup in backups:
+            verification = backup.get("verification")
+            logging.info("%s  %s  %8.1f MB  %s%s" % (backup["file_name"],
+                                                    time.strftime(d.PITR_TIME_FORMAT,
+                                                                  time.localtime(backup["created"])),
+                                                    backup["size_bytes"] / 1048576.0,
+                                                    "not verified" if verification is None
+                                                    else "verified" if verification["verified"] else "FAILED",
+                                                    "  as of %s" % time.strftime(d.PITR_TIME_FORMAT,
+                                                                                 time.localtime(
+                                                                                     backup["point_in_time"]))
+                                                    if backup.get("point_in_time") else ""))
+        logging.info("%s backups, %.1f MB in total." % (len(backups),
+                                                       sum([x["size_bytes"] for x in backups]) / 1048576.0))
+        return backups
+
+    # Copy the extracts that differ from the sync directory to the target Tableau Server ahead of a switchover
+    def preseed(self, dry_run=False, trust_index=False):
+        if self.target_server is None:
+            raise RescueGroupException("Rescue group %s does not have a target Tableau Server!" % self.name)
+        if not dry_run:
+            self.mount_manager.ensure_healthy()  # Fail fast instead of hanging on a dead share
+        return self.extract_seeder.seed(dry_run=dry_run, trust_index=trust_index)
+
+    # Rebuild the Postgres replica, copying only changed files unless a full resync is configured
+    def resync(self):
+        self.__invalidate_validation()
+        self.env_manager.resync_source_postgres(
+            source_server=self.source_server,
+            incremental=self.config_object.postgres_resync_mode() == "incremental")
+
+    # Take a base backup for the WAL archive if due and apply its retention.
+    # The service takes the base backup itself, without holding the rescue group's lock.
+    def archive(self, take_base_backup=True):
+        if self.wal_archive is None:
+            raise RescueGroupException("The WAL archive is not enabled for rescue group %s!" % self.name)
+        self.wal_archive.enable()
+        if take_base_backup:
+            self.wal_archive.maintain()
+        else:
+            self.wal_archive.apply_retention()
+
+    # Measure the speed of every share and recommend a mount profile for it
+    def benchmark_mounts(self):
+        self.mount_manager.ensure_healthy()
+        results = {}
+        for share_name, mount_path in sorted(self.mount_manager.mounts.items()):
+            results[share_name] = benchmark_mount(mount_path)
+            logging.info("Share %s: %s entries scanned per second, %s MB/s sequential read. "
+                         "Recommended mount profile: %s (current options: %s)"
+                         % (share_name, results[share_name]["entries_per_sec"], results[share_name]["read_mbps"],
+                            results[share_name]["recommended_profile"],
+                            self.env_manager.mount_options.get(share_name) or "none"))
+        return results
+
+    def uninstall(self):
+        self.__invalidate_validation()
+        with self.verification_lock:  # The backups are deleted as well
+            uninstall_tableau_dr(env_manager=self.env_manager,
+                                 source_server=self.source_server,
+                                 target_server=self.target_server)
+
+    def tests(self, tsbak_url):
+        self.validate()
+        execute_switchover_test(env_manager=self.env_manager,
+                                source_server=self.source_server,
+                                target_server=self.target_server,
+                                tsbak_url=tsbak_url)
+        self.__invalidate_validation()
+
+    # Run an operation by name while holding the rescue group's lock
+    def run_command(self, command, **kwargs):
+        operation = getattr(self, command, None)
+        if command.startswith("_") or operation is None:
+            raise RescueGroupException("Unknown operation (%s) for rescue group %s!" % (command, self.name))
+
+        with self.lock:
+            self.last_operation = command
+            try:
+                with profiler.span(command, rescue_group=self.name):
+                    result = operation(**kwargs)
+                self.last_error = None
+                return result
+            except Exception, e:
+                self.last_error = str(e)
+                raise
+
+    # Verify a new backup and upload it to the backup sinks once it has passed
+    def __verify_in_background(self, backup_file_path):
+        try:
+            with self.verification_lock:
+                self.verify_backup(backup_file=backup_file_path)
+                if len(self.backup_sinks_data) > 0:
+                    self.upload_backup(backup_file=backup_file_path)
+        except Exception, e:
+            logging.error("Verification or upload of backup %s has failed: %s" % (backup_file_path, e))
+        finally:
+            self.verifying_file_names.discard(os.path.basename(backup_file_path))
+
+    def __get_backup_file_path(self, backup_file):
+        if backup_file is None:
+            backups = self.backup_catalog.backups()
+            if len(backups) == 0:
+                raise RescueGroupException("Rescue group %s does not have any backups!" % self.name)
+            backup_file = backups[-1]["file_name"]
+        backup_file_path = os.path.join(self.backup_catalog.backups_dir, os.path.basename(backup_file))
+        if not os.path.exists(backup_file_path):
+            raise RescueGroupException("Backup file %s does not exist!" % backup_file_path)
+        return backup_file_path
+
+    def __invalidate_validation(self):
+        self.last_validation_time = None
+        if self.validation_cache is not None:
+            self.validation_cache.invalidate()
+
+    # Summary of the rescue group's in-memory state
+    def status(self):
+        return {"rescue_group": self.name,
+                "source_host": self.source_server.host,
+                "target_host": self.target_server.host if self.target_server is not None else None,
+                "last_operation": self.last_operation,
+                "last_error": self.last_error,
+                "last_validation_time": self.last_validation_time,
+                "replica_lag": self.replica_monitor.history.latest(),
+                "mounts": self.mount_manager.health(),
+                "last_backup": (self.backup_catalog.backups() or [None])[-1]}
@@ -0,0 +1,321 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import threading
+import collections
+import SocketServer
+import socket
+import json
+import time
+import os
+import defaults as d
+import tableau_dr.utils as utils
+import tableau_dr.structured_logging as structured_logging
+from rescue_group import RescueGroup
+
+
+# Custom exception
+class RescueServiceException(Exception):
+    pass
+
+
+# Send a command to a running Tableau DR service and wait for its result
+def send_service_command(command, rescue_group=None, socket_path=d.SERVICE_SOCKET_PATH, arguments=None):
+    socket_path = os.path.expanduser(socket_path)
+    logging.debug("Sending %s to the Tableau DR service at %s..." % (command, socket_path))
+    client_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            client_socket.connect(socket_path)
+        except socket.error, e:
+            raise RescueServiceException("Was not able to connect to the Tableau DR service at %s! "
+                                         "Is it running? Error: %s" % (socket_path, e))
+        request = {"command": command,
+                   "rescue_group": rescue_group,
+                   "arguments": arguments}
+        client_socket.sendall(json.dumps(request) + "\n")
+        response = client_socket.makefile("r").readline()
+    finally:
+        client_socket.close()
+
+    if not response:
+        raise RescueServiceException("The Tableau DR service closed the connection without a response!")
+    response = json.loads(response)
+    if response.get("status") != "ok":
+        raise RescueServiceException("The Tableau DR service was not able to execute %s: %s"
+                                     % (command, response.get("error")))
+    return response.get("result")
+
+
+# Semaphore handing out slots in the order they were requested, so that no rescue group starves the others
+class FairOperationSlots:
+
+    def __init__(self, max_parallel_operations):
+        self.__free_slots = max_parallel_operations
+        self.__waiting = collections.deque()
+        self.__condition = threading.Condition()
+
+    def acquire(self):
+        ticket = object()
+        with self.__condition:
+            self.__waiting.append(ticket)
+            while self.__waiting[0] is not ticket or self.__free_slots == 0:
+                self.__condition.wait()
+            self.__waiting.popleft()
+            self.__free_slots -= 1
+            self.__condition.notify_all()
+
+    def release(self):
+        with self.__condition:
+            self.__free_slots += 1
+            self.__condition.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+# Handler for a single request received on the service's Unix socket
+class ServiceRequestHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            result = self.server.rescue_service.handle_request(request)
+            response = {"status": "ok",
+                        "result": result}
+        except Exception, e:
+            logging.error("Service request failed: %s" % e)
+            response = {"status": "error",
+                        "error": str(e)}
+        self.wfile.write(json.dumps(response) + "\n")
+
+
+class ServiceSocketServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+# Long-running service managing every rescue group of a configuration file from one process
+class RescueService:
+
+    # Constructor
+    def __init__(self, config_file_path, socket_path=d.SERVICE_SOCKET_PATH,
+                 max_parallel_operations=d.SERVICE_MAX_PARALLEL_OPERATIONS):
+        logging.debug("Tableau DR service is being initialized!")
+        self.config_file_path = config_file_path
+        self.socket_path = os.path.expanduser(socket_path)
+        self.operation_slots = FairOperationSlots(max_parallel_operations)
+        logging.debug("At most %s operations are allowed to run in parallel." % max_parallel_operations)
+        self.stop_event = threading.Event()
+        self.socket_server = None
+
+        config_data = utils.parse_config_file(config_file_path)
+        if not config_data:
+            raise RescueServiceException("There are no rescue groups defined in %s!" % config_file_path)
+
+        self.rescue_groups = {}
+        for group_name in sorted(config_data.keys()):
+            logging.info("Loading rescue group %s..." % group_name)
+            self.rescue_groups[group_name] = RescueGroup(name=group_name,
+                                                         config_file_path=config_file_path)
+        self.__validate_group_isolation()
+
+    # Execute an operation on a rescue group, waiting for a free operation slot
+    def run_operation(self, group_name, command, **kwargs):
+        rescue_group = self.__get_rescue_group(group_name)
+        with rescue_group.lock:
+            with self.operation_slots:
+                with structured_logging.operation("[%s] %s" % (group_name, command),
+                                                  rescue_group=group_name,
+                                                  command=command):
+                    logging.info("[%s] Executing %s..." % (group_name, command))
+                    rescue_group.run_command(command, **kwargs)
+        return rescue_group.status()
+
+    # Process a request received through the socket
+    def handle_request(self, request):
+        command = request.get("command")
+        if command not in d.SERVICE_COMMANDS:
+            raise RescueServiceException("Unknown command: %s! Possible options: %s"
+                                         % (command, ", ".join(d.SERVICE_COMMANDS)))
+
+        if command == "shutdown":
+            threading.Thread(target=self.stop).start()
+            return None
+
+        group_name = request.get("rescue_group")
+        if command == "status":
+            if group_name is None:
+                return [self.rescue_groups[name].status() for name in sorted(self.rescue_groups.keys())]
+            return self.__get_rescue_group(group_name).status()
+
+        arguments = dict([(str(k), v) for k, v in (request.get("arguments") or {}).items()])
+        return self.run_operation(group_name, command, **arguments)
+
+    def serve(self):
+        for group_name in sorted(self.rescue_groups.keys()):
+            scheduler_thread = threading.Thread(target=self.__schedule_rescue_group,
+                                                args=(self.rescue_groups[group_name],),
+                                                name=group_name)
+            scheduler_thread.daemon = True
+            scheduler_thread.start()
+            monitor_thread = threading.Thread(target=self.__monitor_replica,
+                                              args=(self.rescue_groups[group_name],),
+                                              name="%s-replica" % group_name)
+            monitor_thread.daemon = True
+            monitor_thread.start()
+            mount_thread = threading.Thread(target=self.__supervise_mounts,
+                                            args=(self.rescue_groups[group_name],),
+                                            name="%s-mounts" % group_name)
+            mount_thread.daemon = True
+            mount_thread.start()
+            if self.rescue_groups[group_name].replication_scheduler.enabled:
+                throttle_thread = threading.Thread(target=self.__throttle_replication,
+                                                   args=(self.rescue_groups[group_name],),
+                                                   name="%s-throttle" % group_name)
+                throttle_thread.daemon = True
+                throttle_thread.start()
+
+        if os.path.exists(self.socket_path):
+            logging.debug("Removing stale socket %s..." % self.socket_path)
+            os.remove(self.socket_path)
+        socket_dir = os.path.split(self.socket_path)[0]
+        if not os.path.exists(socket_dir):
+            os.makedirs(socket_dir)
+
+        self.socket_server = ServiceSocketServer(self.socket_path, ServiceRequestHandler)
+        self.socket_server.rescue_service = self
+        os.chmod(self.socket_path, 0600)
+        logging.info("Tableau DR service is listening on %s" % self.socket_path)
+        try:
+            self.socket_server.serve_forever()
+        finally:
+            self.socket_server.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+        logging.info("Tableau DR service has been stopped.")
+
+    def stop(self):
+        logging.info("Stopping Tableau DR service...")
+        self.stop_event.set()
+        if self.socket_server is not None:
+            self.socket_server.shutdown()
+
+    # Periodically run the scheduled operations of a rescue group
+    def __schedule_rescue_group(self, rescue_group):
+        validate_interval_sec, backup_interval_sec = rescue_group.config_object.schedule_data()
+        logging.debug("[%s] Validation interval: %s sec, backup interval: %s sec"
+                      % (rescue_group.name, validate_interval_sec, backup_interval_sec))
+        next_validation = time.time()
+        next_backup = time.time() + backup_interval_sec if backup_interval_sec is not None else None
+
+        while not self.stop_event.is_set():
+            now = time.time()
+            if next_backup is not None and now >= next_backup:
+                next_backup = now + backup_interval_sec
+                next_validation = now + validate_interval_sec  # Backup validates the environment as well
+                self.__run_scheduled_operation(rescue_group, "backup")
+            elif now >= next_validation:
+                next_validation = now + validate_interval_sec
+                self.__run_scheduled_operation(rescue_group, "validate")
+                if rescue_group.wal_archive is not None:
+                    self.__run_scheduled_operation(rescue_group, "archive", take_base_backup=False)
+                    self.__take_base_backup(rescue_group)
+            self.stop_event.wait(1)
+
+    # Periodically adapt the replication bandwidth limits of a rescue group
+    def __throttle_replication(self, rescue_group):
+        while not self.stop_event.is_set():
+            try:
+                rescue_group.replication_scheduler.adjust()
+            except Exception, e:
+                logging.error("[%s] Adjusting replication bandwidth limits has failed: %s" % (rescue_group.name, e))
+            self.stop_event.wait(d.REPLICATION_THROTTLE_INTERVAL_SEC)
+
+    # Periodically probe the shares of a rescue group and remount those that do not respond.
+    # The rescue group's lock is not taken, as an operation blocked on a dead share would hold it.
+    def __supervise_mounts(self, rescue_group):
+        while not self.stop_event.is_set():
+            try:
+                rescue_group.mount_manager.ensure_healthy()
+            except Exception, e:
+                logging.error("[%s] Shares are not healthy: %s" % (rescue_group.name, e))
+            self.stop_event.wait(d.MOUNT_PROBE_INTERVAL_SEC)
+
+    # Periodically sample the replication lag of a rescue group's Postgres replica
+    def __monitor_replica(self, rescue_group):
+        interval_sec = rescue_group.config_object.replica_monitor_interval_sec()
+        while not self.stop_event.is_set():
+            try:
+                rescue_group.replica_monitor.sample()
+            except Exception, e:
+                logging.error("[%s] Sampling replication lag has failed: %s" % (rescue_group.name, e))
+            self.stop_event.wait(interval_sec)
+
+    def __run_scheduled_operation(self, rescue_group, command, **kwargs):
+        try:
+            self.run_operation(rescue_group.name, command, **kwargs)
+        except Exception, e:
+            logging.error("[%s] Scheduled %s has failed: %s" % (rescue_group.name, command, e))
+
+    # Take a due base backup for the WAL archive of a rescue group.
+    # The rescue group's lock is not taken, so that a switchover does not wait for a base backup to finish.
+    def __take_base_backup(self, rescue_group):
+        try:
+            if not rescue_group.wal_archive.is_base_backup_due():
+                return
+            with structured_logging.operation("[%s] base backup" % rescue_group.name,
+                                              rescue_group=rescue_group.name,
+                                              command="base_backup"):
+                rescue_group.wal_archive.take_base_backup()
+        except Exception, e:
+            logging.error("[%s] Scheduled base backup has failed: %s" % (rescue_group.name, e))
+
+    def __get_rescue_group(self, group_name):
+        rescue_group = self.rescue_groups.get(group_name)
+        if rescue_group is None:
+            raise RescueServiceException("The provided rescue group (%s) is not managed by this service!"
+                                         % group_name)
+        return rescue_group
+
+    # Ensure that rescue groups do not share directories or Postgres ports
+    def __validate_group_isolation(self):
+        logging.debug("Validating that rescue groups are isolated from each other...")
+        used_values = {}
+        for group_name, rescue_group in self.rescue_groups.items():
+            env_manager = rescue_group.env_manager
+            group_values = [("rescue directory", env_manager.rescue_dir),
+                            ("Postgres port", env_manager.pg_port),
+                            ("Postgres data directory", env_manager.cluster_source_pg_data_dir),
+                            ("Postgres data directory", env_manager.cluster_target_pg_data_dir),
+                            ("sync directory", env_manager.sync_full_path),
+                            ("backups directory", env_manager.backups_dir),
+                            ("backup staging directory", env_manager.backup_staging_dir)]
+            for value_name, value in group_values:
+                if value is None:
+                    continue
+                other_group_name = used_values.get((value_name, value))
+                if other_group_name is not None:
+                    raise RescueServiceException("Rescue groups %s and %s use the same %s (%s)! "
+                                                 "Each rescue group needs its own."
+                                                 % (other_group_name, group_name, value_name, value))
+                used_values[(value_name, value)] = group_name
+        logging.debug("Rescue groups are isolated!")
@@ -19,37 +19,26 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 from docopt import docopt
 import logging
 import yaml
-from validate_prepare_env import validate_tableau_dr, prepare_tableau_dr, uninstall_tableau_dr
-from execute_switchover import execute_switchover, execute_switchover_test
-from tableau_dr.env_manager import EnvironmentManager
-from tableau_dr.config_parser_class import ConfigParser
+from rescue_group import RescueGroup
+from rescue_service import RescueService, send_service_command
+import tableau_dr.profiler as profiler
+import tableau_dr.structured_logging as structured_logging
+import defaults as d
 import os
-import tableau_dr.utils as utils
+import sys
+import time
 
 LOG_FORMAT = '[%(levelname)s] %(asctime)s - %(message)s'
+SERVICE_LOG_FORMAT = '[%(levelname)s] %(asctime)s - %(threadName)s - %(message)s'
 
 
-# Get config data from file
-def get_config_data(config_file_path, cluster_name, reverse=False, tdfs_enabled=False):
-    config_data = utils.parse_config_file(config_file_path)
-    logging.debug("Successfully parsed configuration data!")
-    cluster_data = config_data.get(cluster_name)
-    if cluster_data is None:
-        raise Exception("The provided cluster name (%s) is not included in the configuration file!" % cluster_name)
-    if reverse:
-        cluster_data["reverse"] = True
-    if tdfs_enabled:
-        cluster_data["rescue_env"]["tdfs"] = True
-        cluster_data["rescue_env"]["tdfs"] = True
-
-    return cluster_data
-
-
-def initialize_logger(config_file_path, cluster_name):
+def initialize_logger(config_file_path, cluster_name=None, log_format=LOG_FORMAT):
     rescue_dir_path = ''
     with open(config_file_path, 'r') as stream:
         try:
-            rescue_dir_path = yaml.load(stream).get(cluster_name).get('rescue_env').get('rescue_dir')
+            config_data = yaml.load(stream)
+            if cluster_name is not None:
+                rescue_dir_path = config_data.get(cluster_name).get('rescue_env').get('rescue_dir')
         except Exception:
             raise Exception('Malformed config file or wrong cluster name ({cluster_name}) detected '.format(
                 cluster_name=cluster_name
@@ -65,29 +54,23 @@ def initialize_logger(config_file_path, cluster_name):
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    logger = logging.getLogger()
-    logger.setLevel(logging.DEBUG)
-
-    # create console handler and set level to info
-    handler = logging.StreamHandler()
-    handler.setLevel(logging.INFO if not os.environ.get('tableau_dr_DEBUG') else logging.DEBUG)
-    formatter = logging.Formatter(LOG_FORMAT)
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-
-    # create debug file handler and set level to debug
-    handler = logging.FileHandler(os.path.join(output_dir, "tableau_dr.log"),
-                                  "a")
-    handler.setLevel(logging.DEBUG)
-    formatter = logging.Formatter(LOG_FORMAT)
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
+    # Console, rotated JSON log file and optionally syslog, written from a background thread
+    structured_logging.configure_logging(output_dir=output_dir,
+                                         console_level=logging.INFO if not os.environ.get('tableau_dr_DEBUG')
+                                         else logging.DEBUG,
+                                         console_format=log_format,
+                                         file_format=os.environ.get(d.LOG_FORMAT_ENV_VAR) or "json",
+                                         syslog_address=os.environ.get(d.LOG_SYSLOG_ENV_VAR))
 
     # Surpress logs
     logging.getLogger("urllib3").setLevel(logging.CRITICAL)  # Surpress logs from urrlib3
     logging.getLogger("requests").setLevel(logging.CRITICAL)  # Surpress logs from requests
     logging.getLogger("requests_kerberos").setLevel(logging.CRITICAL)  # Surpress logs from requests_kerberos
 
+    # Opt-in profiling, the span trace and sampled stacks are written to the logs directory on exit
+    if os.environ.get(d.PROFILE_ENV_VAR):
+        profiler.start(output_dir)
+
 
 if __name__ == '__main__':
 
@@ -95,11 +78,19 @@ if __name__ == '__main__':
 
     Usage:
         tableau_dr.py (-h | --help)
-        tableau_dr.py validate --rescue_group=<rescue_group> --config_file=<config_file> [--tdfs]
-        tableau_dr.py switchover --rescue_group=<rescue_group> --config_file=<config_file> [--tdfs]
-        tableau_dr.py backup --rescue_group=<rescue_group> --config_file=<config_file> [--tdfs]
+        tableau_dr.py validate --rescue_group=<rescue_group> --config_file=<config_file> [--tdfs] [--socket=<socket>]
+        tableau_dr.py switchover --rescue_group=<rescue_group> --config_file=<config_file> [--tdfs] [--socket=<socket>]
+        tableau_dr.py backup --rescue_group=<rescue_group> --config_file=<config_file> [--tdfs] [--socket=<socket>] [--point_in_time=<point_in_time>]
+        tableau_dr.py archive --rescue_group=<rescue_group> --config_file=<config_file> [--socket=<socket>]
+        tableau_dr.py resync --rescue_group=<rescue_group> --config_file=<config_file> [--socket=<socket>]
+        tableau_dr.py benchmark_mounts --rescue_group=<rescue_group> --config_file=<config_file>
+        tableau_dr.py list_backups --rescue_group=<rescue_group> --config_file=<config_file>
+        tableau_dr.py verify_backup --rescue_group=<rescue_group> --config_file=<config_file> [--backup_file=<backup_file>]
+        tableau_dr.py upload_backup --rescue_group=<rescue_group> --config_file=<config_file> [--backup_file=<backup_file>]
+        tableau_dr.py preseed --rescue_group=<rescue_group> --config_file=<config_file> [--dry_run] [--trust_index] [--socket=<socket>]
         tableau_dr.py uninstall --rescue_group=<rescue_group> --config_file=<config_file>
         tableau_dr.py prepare --rescue_group=<rescue_group> --config_file=<config_file> [--tdfs]
+        tableau_dr.py serve --config_file=<config_file> [--socket=<socket>] [--max_parallel=<max_parallel>]
 
 
     Options:
@@ -109,6 +100,16 @@ if __name__ == '__main__':
         --config_file=<config_file>                         REQUIRED: Absolute path to the configuration file.
         --tsbak_url=<tsbak_url>                             REQUIRED: URL to the tsbak file to execute tests with.
         --tdfs                                              Use TDFS based file replication (experimental)
+        --socket=<socket>                                   Path of the Tableau DR service's Unix socket. If provided,
+                                                            the command is executed by the running service.
+        --max_parallel=<max_parallel>                       Maximum number of operations the service runs at once.
+        --point_in_time=<point_in_time>                     Create the backup as of this local time
+                                                            (YYYY-MM-DD HH:MM:SS) from the WAL archive.
+        --backup_file=<backup_file>                         Name of the backup file to verify or upload,
+                                                            the latest one by default.
+        --dry_run                                           Only report the files that would be copied and deleted.
+        --trust_index                                       Take the state of the target from the file state index
+                                                            instead of scanning it.
     """
 
     #--reverse                                           Indicates whether to reverse switchover direction (DR->Prod)
@@ -121,95 +122,105 @@ if __name__ == '__main__':
     config_file_path = args.get("--config_file")
     reverse = True if args.get("--reverse") else False
     tdfs_enabled = True if args.get("--tdfs") else False
+    point_in_time = None
+    if args.get("--point_in_time"):
+        point_in_time = time.mktime(time.strptime(args.get("--point_in_time"), d.PITR_TIME_FORMAT))
+
+    # Run every rescue group of the configuration file from a single long-running process
+    if args.get("serve"):
+        initialize_logger(config_file_path=config_file_path,
+                          log_format=SERVICE_LOG_FORMAT)
+        logging.info("Tableau DR service is starting...")
+        socket_path = args.get("--socket") or d.SERVICE_SOCKET_PATH
+        max_parallel = int(args.get("--max_parallel") or d.SERVICE_MAX_PARALLEL_OPERATIONS)
+        rescue_service = RescueService(config_file_path=config_file_path,
+                                       socket_path=socket_path,
+                                       max_parallel_operations=max_parallel)
+        rescue_service.serve()
+        sys.exit(0)
 
     initialize_logger(config_file_path=config_file_path,
                       cluster_name=cluster_name)
 
-    cluster_data = get_config_data(config_file_path=config_file_path,
-                                   cluster_name=cluster_name,
-                                   reverse=reverse,
-                                   tdfs_enabled=tdfs_enabled)
+    # Let the running service execute the command with its warm state
+    if args.get("--socket"):
+        service_command = filter(lambda x: args.get(x), ["validate", "switchover", "backup", "archive",
+                                                         "resync", "preseed"])[0]
+        service_arguments = {}
+        if point_in_time:
+            service_arguments["point_in_time"] = point_in_time
+        if service_command == "preseed":
+            service_arguments.update({"dry_run": args.get("--dry_run"), "trust_index": args.get("--trust_index")})
+        logging.info("Executing %s through the Tableau DR service..." % service_command)
+        status = send_service_command(command=service_command,
+                                      rescue_group=cluster_name,
+                                      socket_path=args.get("--socket"),
+                                      arguments=service_arguments or None)
+        logging.info("The Tableau DR service has successfully executed %s!" % service_command)
+        logging.debug("Rescue group status: %s" % status)
+        sys.exit(0)
 
     logging.info("Tableau DR is starting...")
     logging.debug("Received the following arguments:")
     [logging.debug("%s:%s" % (k, v)) for k, v in args.iteritems()]
 
-    # Obtain configuration data
-    config_object = ConfigParser(cluster_data=cluster_data)
-    source_server = config_object.get_source_server()
-    target_server = config_object.get_target_server()
-    rescue_user, is_sudoer, cluster_a_root_dir, cluster_b_root_dir, cluster_sync_root_dir, mount_dir, backups_dir, tdfs_enabled, \
-        filestore_app_dir, filestore_temp_mount_dir, tab_data_config_dir, dataengine_dir = config_object.recovery_data()
-    pg_absolute_dir, pg_port, pg_user, pg_password, pg_database, pg_data_root_dir, pg_data_cluster_a_dir, pg_data_cluster_b_dir =\
-        config_object.postgres_data()
-    dr_ip = config_object.obtain_ip()
-
-    # Obtain Environment Manager object
-    env_manager = EnvironmentManager(rescue_user=rescue_user,
-                                     is_sudoer = is_sudoer,
-                                     pg_data_root_dir = pg_data_root_dir,
-                                     cluster_source_root_dir=cluster_a_root_dir,
-                                     sync_root_dir=cluster_sync_root_dir,
-                                     cluster_target_root_dir=cluster_b_root_dir,
-                                     tab_data_config_dir=tab_data_config_dir,
-                                     mount_dir=mount_dir,
-                                     pg_absolute_dir=pg_absolute_dir,
-                                     pg_database=pg_database,
-                                     pg_user=pg_user,
-                                     pg_port=pg_port,
-                                     pg_password=pg_password,
-                                     cluster_source_pg_data_dir=pg_data_cluster_a_dir,
-                                     cluster_target_pg_data_dir=pg_data_cluster_b_dir,
-                                     backups_dir=backups_dir,
-                                     dr_unix_ip=dr_ip,
-                                     tdfs_enabled=tdfs_enabled,
-                                     filestore_app_dir=filestore_app_dir,
-                                     filestore_temp_mount_dir=filestore_temp_mount_dir,
-                                     dataengine_dir=dataengine_dir,
-                                     is_reverse=config_object.reverse)
-
-    # Prepare the environment
-    if args.get("prepare"):
-        prepare_tableau_dr(env_manager=env_manager,
-                               source_server=source_server,
-                               target_server=target_server,
-                               dr_ip=dr_ip)
-
-    # Validate the environment
-    elif args.get("validate"):
-        validate_tableau_dr(env_manager=env_manager,
-                                source_server=source_server,
-                                target_server=target_server)
-
-    # Execute switchover
-    elif args.get("switchover"):
-        validate_tableau_dr(env_manager=env_manager,
-                                source_server=source_server,
-                                target_server=target_server)
-        execute_switchover(env_manager=env_manager,
-                           source_server=source_server,
-                           target_server=target_server)
-
-    # Create backup
-    elif args.get("backup"):
-        validate_tableau_dr(env_manager=env_manager,
-                                source_server=source_server,
-                                target_server=target_server)
-        env_manager.create_backup()
-
-    # Uninstall
-    elif args.get("uninstall"):
-        uninstall_tableau_dr(env_manager=env_manager,
-                                 source_server=source_server,
-                                 target_server=target_server)
-
-    # Execute switchover tests
-    elif args.get("tests"):
-        tsbak_url = args.get("--tsbak_url")
-        validate_tableau_dr(env_manager=env_manager,
-                                source_server=source_server,
-                                target_server=target_server)
-        execute_switchover_test(env_manager=env_manager,
-                                source_server=source_server,
-                                target_server=target_server,
-                                tsbak_url=tsbak_url)
+    # The records of the command share a correlation id, its duration is logged when it is finished
+    command = filter(lambda x: not x.startswith("-") and args.get(x) is True, args.keys())[0]
+    with structured_logging.operation(command, rescue_group=cluster_name):
+        # Obtain configuration data, server connections and the Environment Manager object
+        rescue_group = RescueGroup(name=cluster_name,
+                                   config_file_path=config_file_path,
+                                   reverse=reverse,
+                                   tdfs_enabled=tdfs_enabled)
+
+        # Prepare the environment
+        if args.get("prepare"):
+            rescue_group.prepare()
+
+        # Validate the environment
+        elif args.get("validate"):
+            rescue_group.validate()
+
+        # Execute switchover
+        elif args.get("switchover"):
+            rescue_group.switchover()
+
+        # Create backup
+        elif args.get("backup"):
+            rescue_group.backup(point_in_time=point_in_time)
+
+        # Maintain the WAL archive
+        elif args.get("archive"):
+            rescue_group.archive()
+
+        # Resynchronize the Postgres replica
+        elif args.get("resync"):
+            rescue_group.resync()
+
+        # Measure the speed of the mounted shares
+        elif args.get("benchmark_mounts"):
+            rescue_group.benchmark_mounts()
+
+        # List the backup files
+        elif args.get("list_backups"):
+            rescue_group.list_backups()
+
+        # Verify a backup file
+        elif args.get("verify_backup"):
+            rescue_group.verify_backup(backup_file=args.get("--backup_file"))
+
+        # Upload a backup file to the backup sinks
+        elif args.get("upload_backup"):
+            rescue_group.upload_backup(backup_file=args.get("--backup_file"))
+
+        # Copy the extracts that differ to the target Tableau Server
+        elif args.get("preseed"):
+            rescue_group.preseed(dry_run=args.get("--dry_run"), trust_index=args.get("--trust_index"))
+
+        # Uninstall
+        elif args.get("uninstall"):
+            rescue_group.uninstall()
+
+        # Execute switchover tests
+        elif args.get("tests"):
+            rescue_group.tests(tsbak_url=args.get("--tsbak_url"))
@@ -0,0 +1,197 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import logging
+import contextlib
+import datetime
+import fcntl
+import json
+import time
+import re
+import os
+import defaults as d
+
+BACKUP_FILE_PATTERN = re.compile(r"^backup-(\d{14})\.tsbak$")
+
+
+# Custom exception
+class BackupCatalogException(Exception):
+    pass
+
+
+# Period a backup falls into for a retention tier, backups of the same period replace each other
+def retention_period(tier, timestamp):
+    local_time = time.localtime(timestamp)
+    if tier == "hourly":
+        return time.strftime("%Y%m%d%H", local_time)
+    if tier == "daily":
+        return time.strftime("%Y%m%d", local_time)
+    if tier == "weekly":
+        iso_year, iso_week, iso_weekday = datetime.date.fromtimestamp(timestamp).isocalendar()
+        return "%04d-W%02d" % (iso_year, iso_week)
+    if tier == "monthly":
+        return time.strftime("%Y%m", local_time)
+    raise BackupCatalogException("Unknown retention tier: %s" % tier)
+
+
+# Backups to delete under a grandfather-father-son policy: each tier keeps the newest backup of each of its
+# last periods, e.g. {"daily": 7} keeps the last backup of the last 7 days that have one. The newest backup
+# is always kept. Without any tier every backup is kept, then the oldest ones are deleted while the total
+# size is above max_total_bytes.
+def expired_backups(backups, policy, max_total_bytes=None):
+    backups = sorted(backups, key=lambda x: x["created"], reverse=True)
+    if len(backups) == 0:
+        return []
+
+    if len(policy) > 0:
+        kept_file_names = set([backups[0]["file_name"]])
+        for tier in d.BACKUP_RETENTION_TIERS:
+            periods = []
+            for backup in backups:
+                period = retention_period(tier, backup["created"])
+                if period in periods:
+                    continue
+                if len(periods) >= policy.get(tier, 0):
+                    break
+                periods.append(period)
+                kept_file_names.add(backup["file_name"])
+        kept_backups = filter(lambda x: x["file_name"] in kept_file_names, backups)
+    else:
+        kept_backups = list(backups)
+
+    if max_total_bytes is not None:
+        while len(kept_backups) > 1 and sum([x["size_bytes"] for x in kept_backups]) > max_total_bytes:
+            kept_backups.pop()
+
+    return sorted(filter(lambda x: x not in kept_backups, backups), key=lambda x: x["created"])
+
+
+# Space a new backup needs: the largest of the last backups with a margin, as extracts and the repository only
+# grow slowly. Without an earlier backup it is estimated from the size of the data it is made of.
+def estimate_backup_bytes(backups, data_bytes=None):
+    recent_backups = sorted(backups, key=lambda x: x["created"])[-3:]
+    if len(recent_backups) > 0:
+        return int(max([x["size_bytes"] for x in recent_backups]) * d.BACKUP_SIZE_MARGIN)
+    if data_bytes is not None:
+        return int(data_bytes * d.BACKUP_SIZE_MARGIN)
+    return None
+
+
+def free_bytes(dir_path):
+    stat = os.statvfs(dir_path)
+    return stat.f_bavail * stat.f_frsize
+
+
+# Backup files of a rescue group with an index of their metadata, so that listing them does not need to open
+# every archive, and their retention
+class BackupCatalog:
+
+    # Constructor
+    def __init__(self, backups_dir, policy=None, max_total_bytes=None):
+        self.backups_dir = backups_dir
+        self.policy = policy or {}
+        self.max_total_bytes = max_total_bytes
+        self.index_file_path = os.path.join(backups_dir, d.BACKUP_INDEX_FILE)
+
+    # Backups ordered by age. The index is reconciled with the directory: files deleted by hand are dropped,
+    # files without an entry, e.g. created before the index existed, are added.
+    def backups(self):
+        with self.__locked_index() as index:
+            return sorted(index.values(), key=lambda x: x["created"])
+
+    # Add a created backup with additional metadata to the index
+    def add(self, file_path, **metadata):
+        with self.__locked_index() as index:
+            file_name = os.path.basename(file_path)
+            if file_name not in index:
+                raise BackupCatalogException("%s is not a backup file in %s!" % (file_path, self.backups_dir))
+            index[file_name].update(metadata)
+            return index[file_name]
+
+    # Delete the backups that have expired under the retention policy, except those in keep_file_names,
+    # e.g. backups that are being verified. They are deleted by a later run.
+    def apply_retention(self, keep_file_names=()):
+        with self.__locked_index() as index:
+            for backup in expired_backups(index.values(), self.policy, self.max_total_bytes):
+                if backup["file_name"] in keep_file_names:
+                    logging.debug("Backup %s has expired, but it is in use." % backup["file_name"])
+                    continue
+                logging.info("Deleting backup %s, it has expired under the retention policy..." % backup["file_name"])
+                # The entry is removed first, a file left behind by a crash is added again and deleted next time
+                del index[backup["file_name"]]
+                self.__write_index(index)
+                os.remove(os.path.join(self.backups_dir, backup["file_name"]))
+
+    # Fail before a backup is started if it would not fit into the free space of the backups directory.
+    # data_bytes_function gives the size of the data to back up, it is only called if there is no earlier backup.
+    def ensure_free_space(self, data_bytes_function=None):
+        backups = self.backups()
+        data_bytes = data_bytes_function() if len(backups) == 0 and data_bytes_function is not None else None
+        estimated_bytes = estimate_backup_bytes(backups, data_bytes)
+        if estimated_bytes is None:
+            return
+        available_bytes = free_bytes(self.backups_dir)
+        if available_bytes < estimated_bytes:
+            raise BackupCatalogException("Not enough free space for a backup in %s: %.1f MB are available, "
+                                         "the backup is estimated to need %.1f MB!"
+                                         % (self.backups_dir, available_bytes / 1048576.0,
+                                            estimated_bytes / 1048576.0))
+        logging.debug("%.1f MB are available for a backup estimated to need %.1f MB." % (available_bytes / 1048576.0,
+                                                                                        estimated_bytes / 1048576.0))
+
+    # Index read and written back under a lock shared by every Tableau DR process
+    @contextlib.contextmanager
+    def __locked_index(self):
+        if not os.path.exists(self.backups_dir):
+            os.makedirs(self.backups_dir)
+        with open(self.index_file_path + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                index = self.__read_index()
+                yield index
+                self.__write_index(index)
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def __read_index(self):
+        index = {}
+        if os.path.exists(self.index_file_path):
+            try:
+                with open(self.index_file_path, "r") as f:
+                    index = json.load(f)
+            except ValueError:
+                logging.warning("Backup index %s is corrupt, rebuilding it..." % self.index_file_path)
+
+        file_names = filter(lambda x: BACKUP_FILE_PATTERN.match(x), os.listdir(self.backups_dir))
+        for file_name in index.keys():
+            if file_name not in file_names:
+                del index[file_name]
+        for file_name in file_names:
+            if file_name not in index:
+                timestamp = BACKUP_FILE_PATTERN.match(file_name).group(1)
+                index[file_name] = {"file_name": file_name,
+                                    "created": time.mktime(time.strptime(timestamp, d.BACKUP_TIMESTAMP_FORMAT)),
+                                    "size_bytes": os.path.getsize(os.path.join(self.backups_dir, file_name))}
+        return index
+
+    def __write_index(self, index):
+        temp_file_path = self.index_file_path + ".tmp"
+        with open(temp_file_path, "w") as f:
+            json.dump(index, f, indent=2, sort_keys=True)
+        os.rename(temp_file_path, self.index_file_path)
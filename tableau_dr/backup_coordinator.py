@@ -0,0 +1,126 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import logging
+import fcntl
+import sys
+import time
+import defaults as d
+
+
+# Custom exception
+class BackupCoordinatorException(Exception):
+    pass
+
+
+# Holds the lock files of replication cron jobs. The jobs run under flock with a timeout of one second,
+# so while the fence is held a running job is waited for and new runs give up until the next minute.
+class ReplicationFence:
+
+    # Constructor
+    def __init__(self, lock_file_paths, timeout_sec):
+        self.lock_file_paths = lock_file_paths
+        self.timeout_sec = timeout_sec
+        self.__lock_files = []
+
+    def acquire(self):
+        deadline = time.time() + self.timeout_sec
+        for lock_file_path in self.lock_file_paths:
+            lock_file = open(lock_file_path, "a")
+            while True:
+                try:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except IOError:
+                    if time.time() >= deadline:
+                        lock_file.close()
+                        self.release()
+                        raise BackupCoordinatorException("Replication job holding %s has not finished within "
+                                                         "%s seconds!" % (lock_file_path, self.timeout_sec))
+                    time.sleep(0.5)
+            self.__lock_files.append(lock_file)
+
+    def release(self):
+        for lock_file in self.__lock_files:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            lock_file.close()
+        self.__lock_files = []
+
+
+# Takes the extracts and the repository of a backup at the same point: replication into the sync
+# directory is fenced only while the extracts are captured, and replay on the Postgres replica is paused
+# until the repository has been dumped at the WAL location the extracts belong to.
+class BackupCoordinator:
+
+    # Constructor
+    def __init__(self, env_manager, fence_timeout_sec=d.BACKUP_FENCE_TIMEOUT_SEC):
+        self.env_manager = env_manager
+        self.fence_timeout_sec = fence_timeout_sec
+
+    # Run capture_function while replication into the sync directory is fenced, then dump_function.
+    # Returns the WAL location the replica has been paused at, None if replay has not been paused.
+    def run(self, capture_function, dump_function, pause_replay=True):
+        fence = ReplicationFence(self.env_manager.replication_lock_file_paths(self.env_manager.sync_full_path),
+                                 self.fence_timeout_sec)
+        logging.debug("Fencing replication into the sync directory...")
+        fence.acquire()
+        fence_start_time = time.time()
+        replay_location = None
+        try:
+            try:
+                if pause_replay:
+                    replay_location = self.__pause_replay()
+                capture_function()
+            finally:
+                fence.release()
+                logging.info("Replication into the sync directory has been fenced for %.1f seconds."
+                             % (time.time() - fence_start_time))
+            dump_function()
+        except Exception:
+            # The failure of the backup is reported, not a failure to resume replay after it
+            exc_info = sys.exc_info()
+            if replay_location is not None:
+                try:
+                    self.__resume_replay()
+                except Exception:
+                    pass  # Has been logged
+            raise exc_info[0], exc_info[1], exc_info[2]
+        if replay_location is not None:
+            self.__resume_replay()
+        return replay_location
+
+    def __pause_replay(self):
+        in_recovery, replay_location = self.env_manager.run_pg_query(d.PG_REPLAY_LOCATION_QUERY)[0]
+        if in_recovery != "t":
+            logging.debug("The Postgres replica is not in recovery, its replay is not paused.")
+            return None
+        self.env_manager.run_pg_query(d.PG_REPLAY_PAUSE_QUERY)
+        # Replay stops after the record it is applying, so the location is read once it is paused
+        in_recovery, replay_location = self.env_manager.run_pg_query(d.PG_REPLAY_LOCATION_QUERY)[0]
+        logging.info("Replay of the Postgres replica has been paused at %s." % replay_location)
+        return replay_location
+
+    def __resume_replay(self):
+        try:
+            self.env_manager.run_pg_query(d.PG_REPLAY_RESUME_QUERY)
+            logging.info("Replay of the Postgres replica has been resumed.")
+        except Exception, e:
+            logging.error("Was not able to resume replay of the Postgres replica, run %s on it! Error: %s"
+                          % (d.PG_REPLAY_RESUME_QUERY, e))
+            raise
@@ -0,0 +1,231 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import logging
+import hashlib
+import base64
+import Queue
+import shutil
+import os
+import defaults as d
+from concurrency import run_concurrently, retry_with_backoff
+import profiler
+
+try:
+    import boto3
+except ImportError:
+    boto3 = None  # The S3 sink is not available
+
+
+# Custom exception
+class BackupSinkException(Exception):
+    pass
+
+
+# Read the parts of a file once: the MD5 of every part, for the upload and its resumption, and the SHA-256
+# of the whole file
+def file_checksums(file_path, part_size_bytes):
+    file_sha256 = hashlib.sha256()
+    part_md5s = []
+    with open(file_path, "rb") as f:
+        while True:
+            part_md5 = hashlib.md5()
+            part_read_bytes = 0
+            while part_read_bytes < part_size_bytes:
+                chunk = f.read(min(d.BACKUP_READ_CHUNK_BYTES, part_size_bytes - part_read_bytes))
+                if not chunk:
+                    break
+                part_md5.update(chunk)
+                file_sha256.update(chunk)
+                part_read_bytes += len(chunk)
+            if part_read_bytes == 0 and len(part_md5s) > 0:
+                break
+            part_md5s.append(part_md5.digest())
+            if part_read_bytes < part_size_bytes:
+                break
+    return file_sha256.hexdigest(), part_md5s
+
+
+# ETag S3 gives an object uploaded in parts: the MD5 of the MD5s of its parts and the number of parts
+def multipart_etag(part_md5s):
+    return "%s-%d" % (hashlib.md5("".join(part_md5s)).hexdigest(), len(part_md5s))
+
+
+def read_part(file_path, part_number, part_size_bytes):
+    with open(file_path, "rb") as f:
+        f.seek((part_number - 1) * part_size_bytes)
+        return f.read(part_size_bytes)
+
+
+# Copies backups into a directory, e.g. on an NFS share of another site
+class LocalDirectorySink:
+
+    # Constructor
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+
+    # Copy a backup file and return where it has been stored. An interrupted copy is resumed.
+    def upload(self, file_path):
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        target_path = os.path.join(self.path, os.path.basename(file_path))
+        partial_path = target_path + ".partial"
+        file_sha256 = file_checksums(file_path, d.BACKUP_SINK_PART_SIZE_BYTES)[0]
+
+        copied_bytes = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+        if copied_bytes > os.path.getsize(file_path):
+            copied_bytes = 0
+        if copied_bytes > 0:
+            logging.info("Resuming the copy of %s to %s at %.1f MB..." % (file_path, self.path,
+                                                                        copied_bytes / 1048576.0))
+        with open(file_path, "rb") as source_file:
+            with open(partial_path, "r+b" if copied_bytes > 0 else "wb") as target_file:
+                source_file.seek(copied_bytes)
+                target_file.seek(copied_bytes)
+                target_file.truncate()
+                with profiler.span("copy_file", path=file_path):
+                    shutil.copyfileobj(source_file, target_file, d.BACKUP_READ_CHUNK_BYTES)
+                target_file.flush()
+                os.fsync(target_file.fileno())
+
+        if file_checksums(partial_path, d.BACKUP_SINK_PART_SIZE_BYTES)[0] != file_sha256:
+            os.remove(partial_path)
+            raise BackupSinkException("Checksum of the copy of %s in %s does not match, it has been deleted!"
+                                      % (file_path, self.path))
+        os.rename(partial_path, target_path)
+        return {"location": target_path, "sha256": file_sha256}
+
+
+# Uploads backups to an S3 compatible object store in parts, several of them in parallel.
+# Every part is sent with its MD5, so the store rejects a corrupted part. An interrupted upload is resumed:
+# parts the store already has with a matching checksum are not sent again.
+class S3Sink:
+
+    # Constructor
+    def __init__(self, name, bucket, prefix="", endpoint_url=None, access_key=None, secret_key=None, region=None,
+                 part_size_bytes=d.BACKUP_SINK_PART_SIZE_BYTES,
+                 max_parallel_uploads=d.BACKUP_SINK_MAX_PARALLEL_UPLOADS,
+                 client=None):
+        self.name = name
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.part_size_bytes = part_size_bytes
+        self.max_parallel_uploads = max_parallel_uploads
+        if client is None:
+            if boto3 is None:
+                raise BackupSinkException("Backup sink %s needs boto3, install it with pip install boto3!" % name)
+            client = boto3.client("s3",
+                                  endpoint_url=endpoint_url,
+                                  aws_access_key_id=access_key,
+                                  aws_secret_access_key=secret_key,
+                                  region_name=region)
+        self.client = client
+
+    # Upload a backup file and return where it has been stored
+    def upload(self, file_path):
+        key = "/".join(filter(lambda x: x, [self.prefix, os.path.basename(file_path)]))
+        file_sha256, part_md5s = file_checksums(file_path, self.part_size_bytes)
+        upload_id, uploaded_etags = self.__find_upload(key)
+        if upload_id is None:
+            upload_id = self.client.create_multipart_upload(Bucket=self.bucket,
+                                                            Key=key,
+                                                            Metadata={"sha256": file_sha256})["UploadId"]
+        else:
+            logging.info("Resuming the upload of %s to s3://%s/%s, %d of %d parts have been uploaded before..."
+                         % (file_path, self.bucket, key, len(uploaded_etags), len(part_md5s)))
+
+        parts_queue = Queue.Queue()
+        for part_number, part_md5 in enumerate(part_md5s, 1):
+            if uploaded_etags.get(part_number) != part_md5.encode("hex"):
+                parts_queue.put(part_number)
+        logging.debug("Uploading %d parts of %s to s3://%s/%s..." % (parts_queue.qsize(), file_path,
+                                                                     self.bucket, key))
+
+        def upload_parts():
+            while True:
+                try:
+                    part_number = parts_queue.get_nowait()
+                except Queue.Empty:
+                    return
+                retry_with_backoff(lambda: self.__upload_part(file_path, key, upload_id, part_number,
+                                                              part_md5s[part_number - 1]),
+                                   retries=d.BACKUP_SINK_PART_RETRIES)
+
+        worker_count = max(1, min(self.max_parallel_uploads, parts_queue.qsize()))
+        run_concurrently([("upload-part-%d" % i, upload_parts) for i in range(worker_count)])
+
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": [{"PartNumber": part_number, "ETag": '"%s"' % part_md5.encode("hex")}
+                                       for part_number, part_md5 in enumerate(part_md5s, 1)]})
+
+        etag = self.client.head_object(Bucket=self.bucket, Key=key)["ETag"].strip('"')
+        if etag != multipart_etag(part_md5s):
+            raise BackupSinkException("Checksum of s3://%s/%s (%s) does not match the one of %s (%s)!"
+                                      % (self.bucket, key, etag, file_path, multipart_etag(part_md5s)))
+        return {"location": "s3://%s/%s" % (self.bucket, key), "sha256": file_sha256, "etag": etag}
+
+    # Unfinished upload of a key and the ETags of its parts by part number
+    def __find_upload(self, key):
+        uploads = self.client.list_multipart_uploads(Bucket=self.bucket, Prefix=key).get("Uploads", [])
+        uploads = sorted(filter(lambda x: x["Key"] == key, uploads), key=lambda x: x["Initiated"])
+        if len(uploads) == 0:
+            return None, {}
+        upload_id = uploads[-1]["UploadId"]
+        uploaded_etags = {}
+        part_number_marker = 0
+        while True:
+            response = self.client.list_parts(Bucket=self.bucket, Key=key, UploadId=upload_id,
+                                              PartNumberMarker=part_number_marker)
+            for part in response.get("Parts", []):
+                uploaded_etags[part["PartNumber"]] = part["ETag"].strip('"')
+            if not response.get("IsTruncated"):
+                break
+            part_number_marker = response["NextPartNumberMarker"]
+        return upload_id, uploaded_etags
+
+    def __upload_part(self, file_path, key, upload_id, part_number, part_md5):
+        part_data = read_part(file_path, part_number, self.part_size_bytes)
+        response = self.client.upload_part(Bucket=self.bucket,
+                                           Key=key,
+                                           UploadId=upload_id,
+                                           PartNumber=part_number,
+                                           Body=part_data,
+                                           ContentMD5=base64.b64encode(part_md5))
+        if response["ETag"].strip('"') != part_md5.encode("hex"):
+            raise BackupSinkException("Part %d of %s has been corrupted during the upload!" % (part_number,
+                                                                                               file_path))
+
+
+# Create the sinks backups are uploaded to from their configuration
+def create_sinks(sinks_data):
+    sinks = []
+    for sink_data in sinks_data:
+        sink_data = dict(sink_data)
+        sink_type = sink_data.pop("type")
+        if sink_type == "local":
+            sinks.append(LocalDirectorySink(**sink_data))
+        elif sink_type == "s3":
+            sinks.append(S3Sink(**sink_data))
+        else:
+            raise BackupSinkException("Unknown backup sink type: %s" % sink_type)
+    return sinks
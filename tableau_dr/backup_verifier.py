@@ -0,0 +1,218 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import logging
+import tempfile
+import zipfile
+import zlib
+import time
+import yaml
+import re
+import os
+import defaults as d
+
+# Entry of the table of contents printed by pg_restore --list, e.g. "2230; 0 16386 TABLE DATA public extracts rails"
+TOC_ENTRY_PATTERN = re.compile(r"^\d+; \d+ \d+ (.+) (\S+) (\S+) (\S+)$")
+COPY_PATTERN = re.compile(r"^COPY (\S+) \((.*)\) FROM stdin;$")
+COPY_ESCAPES = {"\\": "\\", "t": "\t", "n": "\n", "r": "\r", "b": "\b", "f": "\f", "v": "\v"}
+
+
+# Custom exception
+class BackupVerifierException(Exception):
+    pass
+
+
+# Entries of a pg_restore --list output as (description, schema, name)
+def parse_dump_toc(toc_text):
+    toc_entries = []
+    for line in toc_text.splitlines():
+        match = TOC_ENTRY_PATTERN.match(line.strip())
+        if match is not None:
+            toc_entries.append(match.groups()[:3])
+    return toc_entries
+
+
+def unescape_copy_value(value):
+    if value == "\\N":
+        return None
+    return re.sub(r"\\(.)", lambda x: COPY_ESCAPES.get(x.group(1), x.group(1)), value)
+
+
+# Columns and rows of the data of one table in COPY format, as printed by pg_restore --data-only
+def parse_copy_data(copy_text):
+    columns = None
+    rows = []
+    for line in copy_text.splitlines():
+        if columns is None:
+            match = COPY_PATTERN.match(line)
+            if match is not None:
+                columns = [x.strip().strip('"') for x in match.group(2).split(",")]
+        elif line == "\\.":
+            break
+        else:
+            rows.append([unescape_copy_value(x) for x in line.split("\t")])
+    return columns, rows
+
+
+# Extracts referenced by the repository that are not in the archive. Descriptors are relative to the extract
+# directory of the dataengine, which is archived under dataengine/extract.
+def missing_extracts(descriptors, archived_paths):
+    normalized_paths = set()
+    for archived_path in archived_paths:
+        archived_path = archived_path.lower()
+        for prefix in ["dataengine/extract/", "dataengine/"]:
+            if archived_path.startswith(prefix):
+                normalized_paths.add(archived_path[len(prefix):].rstrip("/"))
+    missing = []
+    for descriptor in descriptors:
+        normalized_descriptor = descriptor.replace("\\", "/").strip("/").lower()
+        if normalized_descriptor not in normalized_paths:
+            missing.append(descriptor)
+    return missing
+
+
+# Directories and files of an archive, directories are only implied by the paths of their files in some archives
+def archived_paths(entry_names):
+    paths = set()
+    for entry_name in entry_names:
+        path_parts = entry_name.rstrip("/").split("/")
+        for i in range(1, len(path_parts) + 1):
+            paths.add("/".join(path_parts[:i]))
+    return paths
+
+
+# Check that a backup file can be restored without restoring it: every entry is read once to verify its CRC,
+# the manifest is parsed, the table of contents of the repository dump is listed, and the extracts referenced
+# by the repository are looked up in the archive. list_dump_function and table_data_function run pg_restore.
+def verify_backup(file_path, work_dir, list_dump_function, table_data_function):
+    result = {"verified": False,
+              "verified_at": time.time(),
+              "errors": [],
+              "entries": 0,
+              "bytes": 0,
+              "extracts_referenced": None,
+              "extracts_missing": None}
+    logging.info("Verifying backup %s..." % file_path)
+    dump_file_path = None
+    try:
+        try:
+            manifest_text, entry_names, dump_file_path = read_archive(file_path, work_dir, result)
+        except (zipfile.BadZipfile, zlib.error, IOError, EOFError), e:
+            result["errors"].append("The archive is not readable: %s" % e)
+            return result
+
+        for required_file in d.BACKUP_REQUIRED_FILES:
+            if required_file not in entry_names:
+                result["errors"].append("%s is missing from the archive." % required_file)
+
+        if manifest_text is not None:
+            try:
+                manifest = yaml.safe_load(manifest_text)
+            except yaml.YAMLError, e:
+                manifest = None
+                result["errors"].append("The manifest is not valid YAML: %s" % e)
+            if manifest is not None and (not isinstance(manifest, dict) or ":version" not in manifest):
+                result["errors"].append("The manifest does not contain a version.")
+
+        if dump_file_path is not None:
+            verify_dump(dump_file_path, entry_names, list_dump_function, table_data_function, result)
+    finally:
+        if dump_file_path is not None and os.path.exists(dump_file_path):
+            os.remove(dump_file_path)
+        result["verified"] = len(result["errors"]) == 0
+        result["duration_sec"] = round(time.time() - result["verified_at"], 1)
+
+    if result["verified"]:
+        logging.info("Backup %s has been verified: %d entries, %.1f MB, %s extracts referenced by the repository."
+                     % (file_path, result["entries"], result["bytes"] / 1048576.0, result["extracts_referenced"]))
+    else:
+        logging.error("Verification of backup %s has failed: %s" % (file_path, " ".join(result["errors"])))
+    return result
+
+
+# Read every entry of the archive once. The CRC of an entry is checked when it has been read to its end.
+# The manifest is kept in memory and the repository dump is written to work_dir for pg_restore.
+def read_archive(file_path, work_dir, result):
+    manifest_text = None
+    dump_file_path = None
+    entry_names = []
+    archive = zipfile.ZipFile(file_path, "r")
+    try:
+        for entry in archive.infolist():
+            entry_names.append(entry.filename)
+            dump_file = None
+            if entry.filename == d.WORKGROUP_PG_DUMP_FILE:
+                dump_fd, dump_file_path = tempfile.mkstemp(prefix="tableau_dr_verify_", dir=work_dir)
+                dump_file = os.fdopen(dump_fd, "wb")
+            entry_file = archive.open(entry)
+            try:
+                while True:
+                    chunk = entry_file.read(d.BACKUP_READ_CHUNK_BYTES)
+                    if not chunk:
+                        break
+                    result["bytes"] += len(chunk)
+                    if dump_file is not None:
+                        dump_file.write(chunk)
+                    elif entry.filename == d.BACKUP_MANIFEST_FILE:
+                        manifest_text = (manifest_text or "") + chunk
+            finally:
+                entry_file.close()
+                if dump_file is not None:
+                    dump_file.close()
+            result["entries"] += 1
+    except Exception:
+        if dump_file_path is not None and os.path.exists(dump_file_path):
+            os.remove(dump_file_path)
+        raise
+    finally:
+        archive.close()
+    return manifest_text, archived_paths(entry_names), dump_file_path
+
+
+# Check that the repository dump contains the tables a restore needs and the extracts it references
+def verify_dump(dump_file_path, entry_names, list_dump_function, table_data_function, result):
+    try:
+        toc_entries = parse_dump_toc(list_dump_function(dump_file_path))
+    except Exception, e:
+        result["errors"].append("The table of contents of the repository dump cannot be listed: %s" % e)
+        return
+    dumped_tables = set([x[2] for x in toc_entries if x[0] == "TABLE"])
+    for table in d.BACKUP_REQUIRED_DUMP_TABLES:
+        if table not in dumped_tables:
+            result["errors"].append("Table %s is missing from the repository dump." % table)
+    if d.BACKUP_EXTRACTS_TABLE not in dumped_tables:
+        return
+
+    try:
+        columns, rows = parse_copy_data(table_data_function(dump_file_path, d.BACKUP_EXTRACTS_TABLE))
+    except Exception, e:
+        result["errors"].append("The extracts cannot be read from the repository dump: %s" % e)
+        return
+    if columns is None or "descriptor" not in columns:
+        logging.debug("The extracts table of the repository dump has no descriptor column, "
+                      "extracts are not cross-checked.")
+        return
+    descriptors = filter(lambda x: x, [row[columns.index("descriptor")] for row in rows
+                                       if len(row) == len(columns)])
+    missing = missing_extracts(descriptors, entry_names)
+    result["extracts_referenced"] = len(descriptors)
+    result["extracts_missing"] = len(missing)
+    if len(missing) > 0:
+        result["errors"].append("%d of %d extracts referenced by the repository are missing from the archive, "
+                                "e.g. %s." % (len(missing), len(descriptors), ", ".join(missing[:3])))
@@ -0,0 +1,309 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import subprocess
+import platform
+import logging
+import random
+import shutil
+import json
+import uuid
+import time
+import os
+import defaults as d
+from concurrency import run_concurrently
+
+SYNTHETIC_BLOCK_BYTES = 65536
+
+# Repository tables a backup depends on, filled with generated rows in proportion to the number of extracts
+WORKGROUP_SCHEMA_SQL = """
+CREATE TABLE sites (id serial PRIMARY KEY, name varchar(255), url_namespace varchar(255));
+CREATE TABLE users (id serial PRIMARY KEY, name varchar(255), site_id integer, created_at timestamp);
+CREATE TABLE workbooks (id serial PRIMARY KEY, name varchar(255), site_id integer, owner_id integer, size bigint,
+                        updated_at timestamp);
+CREATE TABLE datasources (id serial PRIMARY KEY, name varchar(255), site_id integer, owner_id integer, size bigint,
+                          updated_at timestamp);
+CREATE TABLE extracts (id serial PRIMARY KEY, workbook_id integer, datasource_id integer, descriptor varchar(255),
+                       created_at timestamp DEFAULT now());
+CREATE TABLE views (id serial PRIMARY KEY, name varchar(255), workbook_id integer, sheet_id varchar(255));
+CREATE TABLE http_requests (id bigserial PRIMARY KEY, controller varchar(255), action varchar(255),
+                            http_user_agent text, session_id varchar(255), status integer,
+                            created_at timestamp, completed_at timestamp);
+INSERT INTO sites (name, url_namespace) SELECT 'Site ' || i, 'site' || i FROM generate_series(1, 10) i;
+INSERT INTO users (name, site_id, created_at)
+    SELECT 'user' || i, 1 + i % 10, now() - i * interval '1 hour' FROM generate_series(1, {user_count}) i;
+INSERT INTO workbooks (name, site_id, owner_id, size, updated_at)
+    SELECT 'Workbook ' || i, 1 + i % 10, 1 + i % {user_count}, i * 1024, now() - i * interval '1 minute'
+    FROM generate_series(1, {workbook_count}) i;
+INSERT INTO datasources (name, site_id, owner_id, size, updated_at)
+    SELECT 'Datasource ' || i, 1 + i % 10, 1 + i % {user_count}, i * 1024, now() - i * interval '1 minute'
+    FROM generate_series(1, {datasource_count}) i;
+INSERT INTO views (name, workbook_id, sheet_id)
+    SELECT 'View ' || i, 1 + i % {workbook_count}, 'Sheet' || i FROM generate_series(1, {workbook_count} * 5) i;
+INSERT INTO http_requests (controller, action, http_user_agent, session_id, status, created_at, completed_at)
+    SELECT 'views', 'show', 'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36', md5(i::text), 200,
+           now() - i * interval '1 second', now() - i * interval '1 second' + interval '200 milliseconds'
+    FROM generate_series(1, {http_request_count}) i;
+"""
+
+
+# Custom exception
+class BenchmarkException(Exception):
+    pass
+
+
+# Size of an extract: extracts of a Tableau Server are mostly small, with a long tail of very large ones
+def extract_size(rng, median_bytes, sigma, max_bytes):
+    return min(int(rng.lognormvariate(0, sigma) * median_bytes), max_bytes)
+
+
+# Write a file of synthetic data that compresses about as well as an extract: half of it is random
+def write_synthetic_file(file_path, size_bytes, random_block):
+    if not os.path.exists(os.path.dirname(file_path)):
+        os.makedirs(os.path.dirname(file_path))
+    zero_block = "\0" * len(random_block)
+    with open(file_path, "wb") as f:
+        written_bytes = 0
+        while written_bytes < size_bytes:
+            block = random_block if (written_bytes / len(random_block)) % 2 == 0 else zero_block
+            chunk = block[:min(len(block), size_bytes - written_bytes)]
+            f.write(chunk)
+            written_bytes += len(chunk)
+
+
+# Generate the directories of a Tableau Server that are replicated: extracts laid out like the dataengine
+# directory, web data connectors and the configuration. The layout and the sizes only depend on the seed.
+def generate_tree(root_path, extract_count, seed=0,
+                  median_bytes=d.BENCHMARK_EXTRACT_MEDIAN_BYTES,
+                  sigma=d.BENCHMARK_EXTRACT_SIZE_SIGMA,
+                  max_bytes=d.BENCHMARK_EXTRACT_MAX_BYTES,
+                  webdataconnector_count=d.BENCHMARK_WEBDATACONNECTOR_COUNT):
+    rng = random.Random(seed)
+    random_block = os.urandom(SYNTHETIC_BLOCK_BYTES)
+    tree = {"extracts": [], "descriptors": [], "bytes": 0}
+    for i in range(extract_count):
+        extract_guid = "{%s}" % str(uuid.UUID(int=rng.getrandbits(128))).upper()
+        descriptor = "/".join([extract_guid[1:3].lower(), extract_guid[3:5].lower(), extract_guid,
+                               "Extract%d.tde" % i])
+        extract_path = os.path.join(d.DATAENGINE_DIR, "extract", descriptor)
+        size_bytes = extract_size(rng, median_bytes, sigma, max_bytes)
+        write_synthetic_file(os.path.join(root_path, extract_path), size_bytes, random_block)
+        tree["extracts"].append(extract_path)
+        tree["descriptors"].append(descriptor)
+        tree["bytes"] += size_bytes
+
+    for i in range(webdataconnector_count):
+        connector_path = os.path.join(root_path, d.WEBDATACONNECTORS_DIR, "connector%d" % i, "index.html")
+        write_synthetic_file(connector_path, rng.randint(1024, 65536), random_block)
+
+    config_dir = os.path.join(root_path, "config")
+    if not os.path.exists(config_dir):
+        os.makedirs(config_dir)
+    with open(os.path.join(config_dir, "tabsvc.yml"), "w") as f:
+        f.write("--- \nservice.jmx_enabled: true\nworker.hosts: localhost\npgsql.port: %s\n" % d.PG_PORT)
+    with open(os.path.join(config_dir, "tabsvc-customization.yml"), "w") as f:
+        f.write("--- \nwgserver.domain.fqdn: localhost\n")
+    return tree
+
+
+# Rewrite a fraction of the extracts, like refreshes between two replication runs. Returns the bytes rewritten.
+def mutate_tree(root_path, extract_paths, fraction, seed=0, random_block=None):
+    rng = random.Random(seed)
+    random_block = random_block or os.urandom(SYNTHETIC_BLOCK_BYTES)
+    changed_bytes = 0
+    for extract_path in rng.sample(extract_paths, int(len(extract_paths) * fraction)):
+        file_path = os.path.join(root_path, extract_path)
+        file_stat = os.stat(file_path)
+        size_bytes = max(file_stat.st_size + rng.randint(-4096, 4096), 0)
+        write_synthetic_file(file_path, size_bytes, random_block)
+        # Replication compares sizes and modification times, a refresh within the same second must still differ
+        os.utime(file_path, (file_stat.st_atime, file_stat.st_mtime + 2))
+        changed_bytes += size_bytes
+    return changed_bytes
+
+
+# Time a step of the benchmark and record its duration with the details it returns. A failed step is
+# recorded with its error, so that one missing tool does not stop the others from being measured.
+def run_step(results, name, function):
+    logging.info("Benchmarking %s..." % name)
+    start_time = time.time()
+    try:
+        details = function() or {}
+    except Exception, e:
+        logging.error("Benchmark step %s has failed: %s" % (name, e))
+        results[name] = {"duration_sec": None, "error": str(e)}
+        return False
+    results[name] = dict(details, duration_sec=round(time.time() - start_time, 3))
+    logging.info("%s took %.3f seconds." % (name, results[name]["duration_sec"]))
+    return True
+
+
+# Duration of every step relative to a baseline run, above 1 is slower
+def compare_results(results, baseline):
+    ratios = {}
+    for name, result in results["steps"].items():
+        baseline_result = baseline.get("steps", {}).get(name)
+        if baseline_result is None or not result["duration_sec"] or not baseline_result["duration_sec"]:
+            continue
+        ratios[name] = round(result["duration_sec"] / baseline_result["duration_sec"], 3)
+    return ratios
+
+
+# Run the replication jobs once, into the sync directory first and then out of it, as cron would
+def run_replication_cycle(env_manager, replication_jobs):
+    ordered_jobs = sorted(replication_jobs, key=lambda x: x["source_path"].startswith(env_manager.sync_full_path))
+    for job in ordered_jobs:
+        job_cmd = d.RSYNC_TEMPLATE.format(rescue_dir=env_manager.rescue_dir,
+                                          uuid=job["uuid"],
+                                          source_path=job["source_path"],
+                                          destination_path=job["destination_path"])
+        p = subprocess.Popen(["sh", "-c", job_cmd], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = p.communicate()
+        if p.returncode != 0:
+            raise BenchmarkException("Replication job has failed: %s\nSTDERR: %s" % (job_cmd, stderr))
+    return {"jobs": len(ordered_jobs)}
+
+
+# Create the synthetic repository database with psql, dropping it first if it exists
+def create_workgroup_database(env_manager, descriptors):
+    workbook_count = max(len(descriptors) / 2, 1)
+    datasource_count = max(len(descriptors) - workbook_count, 1)
+    extract_rows = ["(%s, %s, '%s')" % ((i % workbook_count) + 1 if i < workbook_count else "NULL",
+                                        "NULL" if i < workbook_count else (i % datasource_count) + 1,
+                                        descriptor)
+                    for i, descriptor in enumerate(descriptors)]
+    schema_sql = WORKGROUP_SCHEMA_SQL.format(user_count=max(len(descriptors) / 10, 1),
+                                             workbook_count=workbook_count,
+                                             datasource_count=datasource_count,
+                                             http_request_count=len(descriptors) * d.BENCHMARK_PG_ROWS_PER_EXTRACT)
+    if len(extract_rows) > 0:
+        schema_sql += "INSERT INTO extracts (workbook_id, datasource_id, descriptor) VALUES %s;\n" \
+                      % ",\n".join(extract_rows)
+    for database, sql in [("postgres", "DROP DATABASE IF EXISTS %s;\nCREATE DATABASE %s;\n"
+                           % (env_manager.pg_database, env_manager.pg_database)),
+                          (env_manager.pg_database, schema_sql)]:
+        psql_cmd = d.PSQL_QUERY_COMMAND.format(pg_dir=env_manager.pg_absolute_dir,
+                                               host="localhost",
+                                               port=env_manager.pg_port,
+                                               user=env_manager.pg_user,
+                                               database=database)
+        p = subprocess.Popen(psql_cmd.split(), stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             env=dict(os.environ, LD_LIBRARY_PATH=os.path.join(env_manager.pg_absolute_dir, "lib")))
+        stdout, stderr = p.communicate(input=sql)
+        if p.returncode != 0:
+            raise BenchmarkException("Was not able to create the synthetic repository database: %s" % stderr)
+    return {"extracts": len(descriptors), "http_requests": len(descriptors) * d.BENCHMARK_PG_ROWS_PER_EXTRACT}
+
+
+def directory_bytes(dir_path):
+    return sum([os.path.getsize(os.path.join(x[0], file_name)) for x in os.walk(dir_path) for file_name in x[2]])
+
+
+# Generate a Tableau Server's data in the source directory of env_manager and time the replication, filestore
+# sync, cron, dump and backup paths on it. Cron jobs of the benchmark are removed at the end.
+def run_benchmarks(env_manager, extract_count=d.BENCHMARK_EXTRACT_COUNT, seed=0,
+                   changed_fraction=d.BENCHMARK_CHANGED_FRACTION, skip_postgres=False):
+    steps = {}
+    results = {"started": time.time(),
+               "host": platform.node(),
+               "parameters": {"extract_count": extract_count,
+                              "seed": seed,
+                              "changed_fraction": changed_fraction,
+                              "skip_postgres": skip_postgres,
+                              "snapshot_method": env_manager.snapshot_method},
+               "steps": steps}
+    source_path = env_manager.cluster_source_mount_full_path
+    env_manager.create_directory_tree()
+
+    tree = {}
+    run_step(steps, "generate_tree", lambda: tree.update(generate_tree(source_path, extract_count, seed=seed)) or
+             {"extracts": extract_count, "bytes": tree["bytes"]})
+    results["parameters"]["data_bytes"] = tree.get("bytes")
+
+    try:
+        # Adding the jobs runs each of them once, which is the initial full replication
+        run_step(steps, "cron_add_initial_jobs", env_manager.add_initial_rsync_jobs)
+        replication_jobs = env_manager.get_replication_jobs()
+        run_step(steps, "cron_disable_jobs", env_manager.disable_rsync)
+
+        run_step(steps, "replication_unchanged_cycle",
+                 lambda: run_replication_cycle(env_manager, replication_jobs))
+        changed = {}
+        run_step(steps, "mutate_tree",
+                 lambda: changed.update(bytes=mutate_tree(source_path, tree["extracts"], changed_fraction, seed=seed)))
+        run_step(steps, "replication_incremental_cycle",
+                 lambda: dict(run_replication_cycle(env_manager, replication_jobs), changed_bytes=changed.get("bytes")))
+        run_step(steps, "sync_filestore", lambda: env_manager.sync_filestore(is_switchover=False))
+
+        if not skip_postgres:
+            if run_step(steps, "create_workgroup_database",
+                        lambda: create_workgroup_database(env_manager, tree["descriptors"])):
+                dump_dir = os.path.join(env_manager.backup_staging_dir, "benchmark_dump")
+                if not os.path.exists(dump_dir):
+                    os.makedirs(dump_dir)
+                run_step(steps, "execute_source_pgdump",
+                         lambda: env_manager.execute_source_pgdump(destination_dir=dump_dir, dump_format="t") or
+                         {"bytes": directory_bytes(dump_dir)})
+                shutil.rmtree(dump_dir)
+
+                backup_file = {}
+                run_step(steps, "create_backup",
+                         lambda: backup_file.update(path=env_manager.create_backup()[0]) or
+                         {"bytes": os.path.getsize(backup_file["path"])})
+    finally:
+        run_step(steps, "cron_remove_jobs", env_manager.remove_relevant_cron_jobs)
+    results["duration_sec"] = round(time.time() - results["started"], 3)
+    return results
+
+
+# Run operations of a TableauServerConnector on every (server, connector) pair at the same time, and time
+# them with the WinRM round trips they take. A failed operation is counted, so that the behavior under
+# injected failures can be compared as well.
+def run_connector_benchmarks(server_connectors, operations):
+    steps = {}
+    results = {"started": time.time(),
+               "host": platform.node(),
+               "parameters": {"connections": len(server_connectors),
+                              "latency_sec": server_connectors[0][0].latency_sec,
+                              "failure_rate": server_connectors[0][0].failure_rate,
+                              "failure_mode": server_connectors[0][0].failure_mode},
+               "steps": steps}
+
+    def run_operation(operation, connector):
+        try:
+            operation(connector)
+        except Exception, e:
+            return str(e)
+        return None
+
+    for name, operation in operations:
+        for server, connector in server_connectors:
+            server.reset_stats()
+        errors = []
+        run_step(steps, name, lambda: errors.extend(filter(None, run_concurrently(
+            [("%s-%s" % (name, i), lambda connector=connector: run_operation(operation, connector))
+             for i, (server, connector) in enumerate(server_connectors)]))))
+        stats = [server.stats() for server, connector in server_connectors]
+        steps[name].update({"round_trips": sum([x["requests"] for x in stats]) / float(len(stats)),
+                            "commands": sum([len(x["commands"]) for x in stats]) / float(len(stats)),
+                            "failures_injected": sum([x["failures_injected"] for x in stats]),
+                            "failed": len(errors),
+                            "errors": errors[:5]})
+    results["duration_sec"] = round(time.time() - results["started"], 3)
+    return results
@@ -0,0 +1,162 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import collections
+import itertools
+import select
+import errno
+import time
+import os
+import defaults as d
+
+READ_CHUNK_BYTES = 65536
+MAX_LINE_BYTES = 65536  # A longer line is passed to the line handler in parts
+
+capture_sequence = itertools.count(1)  # Numbers the capture files of commands started in the same second
+
+
+# Output of a command stream: only the last max_bytes are kept, all of it is counted. Every line is passed
+# to line_handler while the command is running, and everything is written to file_obj if one is given.
+# Without max_bytes the complete output is kept.
+class OutputBuffer:
+
+    # Constructor
+    def __init__(self, max_bytes=None, line_handler=None, file_obj=None):
+        self.max_bytes = max_bytes
+        self.line_handler = line_handler
+        self.file_obj = file_obj
+        self.total_bytes = 0
+        self.line_count = 0
+        self.__chunks = collections.deque()
+        self.__kept_bytes = 0
+        self.__pending_line = ""
+        self.__last_char = "\n"
+
+    def write(self, data):
+        if len(data) == 0:
+            return
+        self.total_bytes += len(data)
+        self.line_count += data.count("\n")
+        self.__last_char = data[-1]
+        if self.file_obj is not None:
+            self.file_obj.write(data)
+        if self.line_handler is not None:
+            self.__handle_lines(data)
+        self.__chunks.append(data)
+        self.__kept_bytes += len(data)
+        while self.max_bytes is not None and self.__kept_bytes - len(self.__chunks[0]) >= self.max_bytes:
+            self.__kept_bytes -= len(self.__chunks.popleft())
+
+    # Pass the last line to the line handler even if it does not end with a newline
+    def close(self):
+        if self.line_handler is not None and len(self.__pending_line.strip()) > 0:
+            self.line_handler(self.__pending_line)
+        self.__pending_line = ""
+
+    # Lines including the last one without a newline
+    def lines(self):
+        return self.line_count + (1 if self.__last_char != "\n" else 0)
+
+    def truncated(self):
+        return self.max_bytes is not None and self.total_bytes > self.max_bytes
+
+    # Output that has been kept
+    def getvalue(self):
+        data = "".join(self.__chunks)
+        if self.max_bytes is not None and len(data) > self.max_bytes:
+            data = data[-self.max_bytes:]
+        return data
+
+    # End of the output for an error message, with a note of how much has been left out
+    def tail(self, max_bytes):
+        data = self.getvalue()
+        if len(data) > max_bytes:
+            data = data[-max_bytes:]
+        if len(data) < self.total_bytes:
+            return "[%d lines, only the last %d of %d bytes are shown]\n%s" % (self.lines(),
+                                                                               len(data),
+                                                                               self.total_bytes,
+                                                                               data)
+        return data
+
+    def __handle_lines(self, data):
+        # Progress is redrawn with carriage returns
+        parts = (self.__pending_line + data).replace("\r", "\n").split("\n")
+        self.__pending_line = parts.pop()
+        if len(self.__pending_line) > MAX_LINE_BYTES:
+            parts.append(self.__pending_line)
+            self.__pending_line = ""
+        for line in parts:
+            if len(line.strip()) > 0:
+                self.line_handler(line)
+
+
+# Feed stdin to a process and pass its output to the buffers while it is running, like Popen.communicate()
+# without holding the output in memory. Returns the return code of the process.
+def communicate(p, stdin, stdout_buffer, stderr_buffer):
+    buffers = {p.stdout.fileno(): stdout_buffer,
+               p.stderr.fileno(): stderr_buffer}
+    pipes = {p.stdout.fileno(): p.stdout,
+             p.stderr.fileno(): p.stderr}
+    stdin_fd = p.stdin.fileno()
+    stdin_offset = 0
+    if not stdin:
+        p.stdin.close()
+        stdin_fd = None
+
+    while len(buffers) > 0 or stdin_fd is not None:
+        readable, writable, _ = select.select(buffers.keys(), [stdin_fd] if stdin_fd is not None else [], [])
+        if stdin_fd in writable:
+            try:
+                stdin_offset += os.write(stdin_fd, stdin[stdin_offset:stdin_offset + select.PIPE_BUF])
+            except OSError, e:
+                if e.errno != errno.EPIPE:
+                    raise
+                stdin_offset = len(stdin)  # The process does not read its input
+            if stdin_offset >= len(stdin):
+                p.stdin.close()
+                stdin_fd = None
+        for fd in readable:
+            data = os.read(fd, READ_CHUNK_BYTES)
+            if data:
+                buffers[fd].write(data)
+            else:
+                del buffers[fd]
+                pipes[fd].close()
+
+    for output_buffer in [stdout_buffer, stderr_buffer]:
+        output_buffer.close()
+    return p.wait()
+
+
+# Files the complete stdout and stderr of a command are written to when output capture is enabled
+def open_capture_files(output_dir, name):
+    output_dir = os.path.expanduser(output_dir)
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    sequence = next(capture_sequence)
+    capture_files = {}
+    for stream in ["out", "err"]:
+        file_path = os.path.join(output_dir, d.CMD_OUTPUT_FILE.format(timestamp=time.strftime("%Y%m%d%H%M%S"),
+                                                                      pid=os.getpid(),
+                                                                      sequence=sequence,
+                                                                      name=name,
+                                                                      stream=stream))
+        capture_files[stream] = open(file_path, "wb")
+    return capture_files
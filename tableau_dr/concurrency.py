@@ -0,0 +1,93 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import threading
+import Queue
+import random
+import time
+import sys
+
+
+# Run independent operations in parallel threads and wait for all of them.
+# tasks is a list of (name, function) tuples, the results are returned in the same order.
+# If any of the operations fails, the first failure is re-raised after every operation has finished.
+def run_concurrently(tasks):
+    if len(tasks) == 1:
+        task_name, task_function = tasks[0]
+        return [task_function()]
+
+    results_queue = Queue.Queue()
+
+    def run_task(task_index, task_name, task_function):
+        try:
+            results_queue.put((task_index, task_name, task_function(), None))
+        except Exception:
+            results_queue.put((task_index, task_name, None, sys.exc_info()))
+
+    threads = []
+    for task_index, (task_name, task_function) in enumerate(tasks):
+        logging.debug("Starting %s in parallel..." % task_name)
+        thread = threading.Thread(target=run_task,
+                                  args=(task_index, task_name, task_function),
+                                  name="%s-%s" % (threading.current_thread().name, task_name))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    for thread in threads:
+        thread.join()
+
+    results = [None] * len(tasks)
+    failures = []
+    while not results_queue.empty():
+        task_index, task_name, result, exc_info = results_queue.get()
+        results[task_index] = result
+        if exc_info is not None:
+            logging.debug("%s has failed: %s" % (task_name, exc_info[1]))
+            failures.append((task_index, task_name, exc_info))
+
+    if len(failures) > 0:
+        failures.sort(key=lambda x: x[0])
+        for task_index, task_name, exc_info in failures[1:]:
+            logging.error("%s has failed: %s" % (task_name, exc_info[1]))
+        task_index, task_name, exc_info = failures[0]
+        raise exc_info[0], exc_info[1], exc_info[2]
+
+    return results
+
+
+# Wait time before the given retry with exponential backoff and jitter
+def backoff_wait_sec(retry_number, initial_wait_sec, max_wait_sec):
+    wait_sec = min(max_wait_sec, initial_wait_sec * (2 ** max(retry_number - 1, 0)))
+    return wait_sec * random.uniform(0.5, 1.0)
+
+
+# Call a function until it succeeds, waiting with exponential backoff between attempts
+def retry_with_backoff(function, retries, initial_wait_sec=1, max_wait_sec=60, retry_on=(Exception,)):
+    for retry_number in range(retries + 1):
+        if retry_number > 0:
+            wait_sec = backoff_wait_sec(retry_number, initial_wait_sec, max_wait_sec)
+            logging.debug("Retrying in %.1f seconds (%s/%s)..." % (wait_sec, retry_number, retries))
+            time.sleep(wait_sec)
+        try:
+            return function()
+        except retry_on, e:
+            if retry_number == retries:
+                raise
+            logging.debug("Attempt failed: %s" % e)
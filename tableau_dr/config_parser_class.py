@@ -18,9 +18,11 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
 from tab_server_connector import TableauServerConnector
+from pg_bundle import postgres_version_for_tableau, postgres_major_version, PgBundleException
 import defaults
 import socket
 import os
+import re
 
 
 # Custom exception
@@ -167,6 +169,312 @@ class ConfigParser:
         else:
             return absolute_dir, port, user, password, database, rescue_dir_pgsql_root_dir, data_a_dir, data_b_dir
 
+    # Obtain the intervals of operations scheduled by the Tableau DR service
+    def schedule_data(self):
+        rescue_env = self.cluster_data.get("rescue_env")
+        schedule_data = rescue_env.get("schedule")
+        if schedule_data is None:
+            schedule_data = {}
+        validate_interval_sec = self.__get_interval_sec(schedule_data, "validate_interval_min",
+                                                        defaults.SERVICE_VALIDATE_INTERVAL_SEC)
+        backup_interval_sec = self.__get_interval_sec(schedule_data, "backup_interval_min", None)
+        return validate_interval_sec, backup_interval_sec
+
+    # Obtain the interval of sampling the Postgres replica's lag in service mode
+    def replica_monitor_interval_sec(self):
+        rescue_env = self.cluster_data.get("rescue_env")
+        schedule_data = rescue_env.get("schedule")
+        if schedule_data is None:
+            schedule_data = {}
+        return self.__get_interval_sec(schedule_data, "replica_monitor_interval_min",
+                                       defaults.REPLICA_MONITOR_INTERVAL_SEC)
+
+    # Obtain whether WAL is archived on the rescue box, how long it is kept and how often base backups are taken
+    def wal_archive_data(self):
+        rescue_env = self.cluster_data.get("rescue_env")
+        archive_data = rescue_env.get("wal_archive")
+        if archive_data is None:
+            return False, defaults.WAL_ARCHIVE_RETENTION_SEC, defaults.WAL_ARCHIVE_BASE_BACKUP_INTERVAL_SEC
+        enabled = archive_data.get("enabled") is not False
+        retention_sec = self.__get_interval_sec(archive_data, "retention_hours",
+                                                defaults.WAL_ARCHIVE_RETENTION_SEC, unit_sec=3600)
+        base_backup_interval_sec = self.__get_interval_sec(archive_data, "base_backup_interval_hours",
+                                                           defaults.WAL_ARCHIVE_BASE_BACKUP_INTERVAL_SEC,
+                                                           unit_sec=3600)
+        return enabled, retention_sec, base_backup_interval_sec
+
+    # Obtain how many backups each retention tier keeps and the size budget of the backups directory
+    def backup_retention_data(self):
+        rescue_env = self.cluster_data.get("rescue_env")
+        retention_data = rescue_env.get("backup_retention") or {}
+        policy = {}
+        for tier in defaults.BACKUP_RETENTION_TIERS:
+            count = retention_data.get(tier)
+            if count is None:
+                continue
+            if not isinstance(count, int) or isinstance(count, bool) or count < 0:
+                raise ConfigParserException("The number of %s backups to keep (%s) in the configuration file "
+                                            "needs to be a non-negative integer!" % (tier, count))
+            policy[tier] = count
+
+        max_total_bytes = None
+        if retention_data.get("max_total_gb") is not None:
+            max_total_bytes = self.__get_size_bytes(retention_data, "max_total_gb", None, unit_bytes=1024 ** 3)
+        return policy, max_total_bytes
+
+    # Obtain the sinks backups are uploaded to, as keyword arguments of their classes with their type
+    def backup_sinks_data(self):
+        rescue_env = self.cluster_data.get("rescue_env")
+        sinks_data = []
+        for index, sink_data in enumerate(rescue_env.get("backup_sinks") or []):
+            sink_type = sink_data.get("type")
+            if sink_type not in defaults.BACKUP_SINK_TYPES:
+                raise ConfigParserException("Unknown backup sink type (%s) in the configuration file! "
+                                            "Possible options: %s" % (sink_type, ", ".join(defaults.BACKUP_SINK_TYPES)))
+            sink_name = str(sink_data.get("name", "%s%d" % (sink_type, index + 1)))
+            if sink_type == "local":
+                path = sink_data.get("path")
+                if path is None or not os.path.isabs(str(path)):
+                    raise ConfigParserException("Backup sink %s needs an absolute path in the configuration file!"
+                                                % sink_name)
+                sinks_data.append({"type": sink_type, "name": sink_name, "path": str(path)})
+            else:
+                if sink_data.get("bucket") is None:
+                    raise ConfigParserException("Backup sink %s needs a bucket in the configuration file!" % sink_name)
+                part_size_bytes = self.__get_size_bytes(sink_data, "part_size_mb",
+                                                        defaults.BACKUP_SINK_PART_SIZE_BYTES, unit_bytes=1048576)
+                if part_size_bytes < defaults.BACKUP_SINK_MIN_PART_SIZE_BYTES:
+                    raise ConfigParserException("The part size of backup sink %s needs to be at least %d MB!"
+                                                % (sink_name, defaults.BACKUP_SINK_MIN_PART_SIZE_BYTES / 1048576))
+                max_parallel_uploads = int(sink_data.get("max_parallel_uploads",
+                                                         defaults.BACKUP_SINK_MAX_PARALLEL_UPLOADS))
+                sinks_data.append({"type": sink_type,
+                                   "name": sink_name,
+                                   "bucket": str(sink_data.get("bucket")),
+                                   "prefix": str(sink_data.get("prefix", "")),
+                                   "endpoint_url": sink_data.get("endpoint_url"),
+                                   "access_key": sink_data.get("access_key"),
+                                   "secret_key": sink_data.get("secret_key"),
+                                   "region": sink_data.get("region"),
+                                   "part_size_bytes": part_size_bytes,
+                                   "max_parallel_uploads": max_parallel_uploads})
+        return sinks_data
+
+    # Obtain whether an existing Postgres replica is resynchronized incrementally or by a full basebackup
+    def postgres_resync_mode(self):
+        rescue_env = self.cluster_data.get("rescue_env")
+        postgres_data = rescue_env.get("postgres") or {}
+        resync_mode = postgres_data.get("resync", "incremental")
+        if resync_mode not in defaults.PG_RESYNC_MODES:
+            raise ConfigParserException("Unknown Postgres resync mode (%s) in the configuration file! "
+                                        "Possible options: %s" % (resync_mode, ", ".join(defaults.PG_RESYNC_MODES)))
+        return resync_mode
+
+    # Obtain the Postgres version of the replica: the one bundled with the source Tableau Server's version,
+    # unless it is set in the configuration file
+    def postgres_version(self):
+        rescue_env = self.cluster_data.get("rescue_env")
+        postgres_data = rescue_env.get("postgres") or {}
+        pg_version = postgres_data.get("version")
+        if pg_version is not None:
+            return str(pg_version)
+
+        servers_block = self.cluster_data.get("servers")
+        tableau_versions = [servers_block.get(x).get("tableau").get("version")
+                            for x in ["source", "target"] if servers_block.get(x) is not None]
+        if self.reverse:
+            tableau_versions.reverse()
+        try:
+            pg_versions = [postgres_version_for_tableau(x, defaults.PG_VERSION_MATRIX) for x in tableau_versions]
+        except PgBundleException, e:
+            raise ConfigParserException("%s Please set the Postgres version in the configuration file!" % e)
+
+        if len(set(map(postgres_major_version, pg_versions))) > 1:
+            logging.warning("The source and target Tableau Servers bundle different major versions of Postgres "
+                            "(%s)! After a switchover the Postgres replica needs to be rebuilt with "
+                            "the matching version." % ", ".join(pg_versions))
+        return pg_versions[0]
+
+    # Obtain the additional CIFS mount options of each share from its mount profile
+    def mount_options(self):
+        rescue_env = self.cluster_data.get("rescue_env")
+        mounts_data = rescue_env.get("mounts") or {}
+        mount_profiles = dict(defaults.CIFS_MOUNT_PROFILES)
+        mount_profiles.update(mounts_data.get("profiles") or {})
+        default_profile = mounts_data.get("profile", "default")
+        share_profiles = mounts_data.get("share_profiles") or {}
+
+        smb_version = mounts_data.get("smb_version")
+        if smb_version is not None and str(smb_version) not in defaults.SMB_VERSIONS:
+            raise ConfigParserException("Unknown SMB version (%s) in the configuration file! Possible options: %s"
+                                        % (smb_version, ", ".join(defaults.SMB_VERSIONS)))
+
+        mount_options = {}
+        for share_name in ["source", "target", "filestore_temp"]:
+            profile_name = share_profiles.get(share_name, default_profile)
+            if profile_name not in mount_profiles:
+                raise ConfigParserException("Unknown mount profile (%s) for the %s share in the configuration file! "
+                                            "Possible options: %s" % (profile_name, share_name,
+                                                                      ", ".join(sorted(mount_profiles.keys()))))
+            options = filter(lambda x: len(x) > 0, str(mount_profiles[profile_name] or "").split(","))
+            if smb_version is not None:
+                options = filter(lambda x: not x.startswith("vers="), options) + ["vers=%s" % smb_version]
+            mount_options[share_name] = ",".join(options)
+        return mount_options
+
+    # Obtain the rescue directory, the staging directory of backups and how the sync tree is snapshotted for them
+    def storage_data(self):
+        rescue_env = self.cluster_data.get("rescue_env")
+        storage_data = rescue_env.get("storage") or {}
+        rescue_dir = rescue_env.get("rescue_dir")
+        rescue_user, is_sudoer, cluster_a_root_dir, cluster_b_root_dir, cluster_sync_root_dir, mount_dir, backups_dir, \
+            tdfs_enabled, filestore_bin_dir, filestore_temp_mount_dir, tab_data_config_dir, dataengine_dir = \
+            self.__get_rescue_env_data(rescue_env)
+        # Snapshots can only be hardlinked or reflinked on the volume of the sync tree
+        staging_dir = self.__get_storage_dir(storage_data, "staging_dir",
+                                             os.path.join(cluster_sync_root_dir, defaults.BACKUP_STAGING_DIR))
+
+        snapshot_method = storage_data.get("snapshot", defaults.SNAPSHOT_DEFAULT_METHOD)
+        if snapshot_method not in defaults.SNAPSHOT_METHODS:
+            raise ConfigParserException("Unknown storage snapshot method (%s) in the configuration file! "
+                                        "Possible options: %s" % (snapshot_method,
+                                                                  ", ".join(defaults.SNAPSHOT_METHODS)))
+        return rescue_dir, staging_dir, snapshot_method
+
+    # Obtain the directory of packaged Postgres builds
+    def postgres_bundle_dir(self):
+        rescue_env = self.cluster_data.get("rescue_env")
+        postgres_data = rescue_env.get("postgres") or {}
+        bundle_dir = postgres_data.get("bundle_dir")
+        if bundle_dir is None:
+            bundle_dir = os.path.join(rescue_env.get("rescue_dir"), defaults.PG_BUNDLE_DIR)
+        return bundle_dir
+
+    # Obtain the rate limit, WAL method and staging switch of Postgres basebackups
+    def basebackup_data(self):
+        rescue_env = self.cluster_data.get("rescue_env")
+        postgres_data = rescue_env.get("postgres") or {}
+        basebackup_data = postgres_data.get("basebackup") or {}
+
+        max_rate = basebackup_data.get("max_rate")
+        if max_rate is not None:
+            max_rate = str(max_rate)
+            if re.match(r"^\d+[kM]?$", max_rate) is None:
+                raise ConfigParserException("Invalid basebackup max_rate (%s) in the configuration file! "
+                                            "Use kilobytes per second, optionally with a k or M suffix, "
+                                            "e.g. 20M." % max_rate)
+
+        wal_method = basebackup_data.get("wal_method", defaults.PG_BASEBACKUP_DEFAULT_WAL_METHOD)
+        if wal_method not in defaults.PG_BASEBACKUP_WAL_METHODS:
+            raise ConfigParserException("Unknown basebackup wal_method (%s) in the configuration file! "
+                                        "Possible options: %s" % (wal_method,
+                                                                  ", ".join(defaults.PG_BASEBACKUP_WAL_METHODS)))
+
+        staging = basebackup_data.get("staging", False)
+        if not isinstance(staging, bool):
+            raise ConfigParserException("Basebackup staging needs to be true or false in the configuration file!")
+        return max_rate, wal_method, staging
+
+    # Obtain how long a successful validation is trusted before switchover or backup
+    def validation_freshness_sec(self):
+        rescue_env = self.cluster_data.get("rescue_env")
+        schedule_data = rescue_env.get("schedule")
+        if schedule_data is None:
+            schedule_data = {}
+        return self.__get_interval_sec(schedule_data, "validation_freshness_min",
+                                       defaults.VALIDATION_FRESHNESS_SEC)
+
+    # Obtain whether validation results are cached and for how long each check's result is trusted
+    def validation_cache_data(self):
+        rescue_env = self.cluster_data.get("rescue_env")
+        cache_data = rescue_env.get("validation_cache")
+        if cache_data is None:
+            cache_data = {}
+        enabled = cache_data.get("enabled") is not False
+        ttl_sec_by_check = dict(defaults.VALIDATION_CACHE_TTL_SEC)
+        ttl_min_data = cache_data.get("ttl_min")
+        if ttl_min_data is None:
+            ttl_min_data = {}
+        for check_name in ttl_min_data.keys():
+            ttl_sec_by_check[check_name] = self.__get_interval_sec(ttl_min_data, check_name, None)
+        return enabled, ttl_sec_by_check, defaults.VALIDATION_CACHE_DEFAULT_TTL_SEC
+
+    # Obtain whether replication is throttled, the bandwidth budgets by time of day and the allowed source latency
+    def replication_throttle_data(self):
+        rescue_env = self.cluster_data.get("rescue_env")
+        throttle_data = rescue_env.get("replication_throttle")
+        if throttle_data is None:
+            return False, [], defaults.REPLICATION_MAX_SOURCE_LATENCY_MS
+
+        max_source_latency_ms = throttle_data.get("max_source_latency_ms", defaults.REPLICATION_MAX_SOURCE_LATENCY_MS)
+        if not isinstance(max_source_latency_ms, (int, float)) or max_source_latency_ms <= 0:
+            raise ConfigParserException("The value of max_source_latency_ms in the configuration file "
+                                        "must be a positive number!")
+
+        throttle_windows = []
+        for window_data in throttle_data.get("windows") or []:
+            days = map(lambda x: str(x).lower()[:3], window_data.get("days", defaults.WEEKDAYS))
+            for day in days:
+                if day not in defaults.WEEKDAYS:
+                    raise ConfigParserException("Unknown day (%s) in a replication throttle window! Possible options: %s"
+                                                % (day, ", ".join(defaults.WEEKDAYS)))
+
+            bandwidth_limit_data = window_data.get("bandwidth_limit_kbps")
+            if not isinstance(bandwidth_limit_data, dict):
+                bandwidth_limit_data = dict([(pair, bandwidth_limit_data) for pair in defaults.REPLICATION_PAIRS])
+            bandwidth_limit_kbps = {}
+            for pair, limit_kbps in bandwidth_limit_data.items():
+                if pair not in defaults.REPLICATION_PAIRS:
+                    raise ConfigParserException("Unknown replication pair (%s) in a replication throttle window! "
+                                                "Possible options: %s" % (pair, ", ".join(defaults.REPLICATION_PAIRS)))
+                if not isinstance(limit_kbps, int) or limit_kbps < 0:
+                    raise ConfigParserException("The bandwidth limit of %s in a replication throttle window "
+                                                "must be a non-negative integer!" % pair)
+                bandwidth_limit_kbps[pair] = limit_kbps
+
+            throttle_windows.append({"days": days,
+                                     "from_min": self.__get_time_of_day_min(window_data, "from"),
+                                     "to_min": self.__get_time_of_day_min(window_data, "to"),
+                                     "bandwidth_limit_kbps": bandwidth_limit_kbps})
+        return True, throttle_windows, max_source_latency_ms
+
+    def __get_time_of_day_min(self, window_data, key):
+        time_of_day = window_data.get(key)
+        # YAML reads unquoted times like 18:00 as base 60 integers, which is exactly the minute of the day
+        if isinstance(time_of_day, int):
+            time_of_day = "%d:%02d" % (time_of_day / 60, time_of_day % 60)
+        match = re.match(r"^(\d{1,2}):(\d{2})$", str(time_of_day))
+        if match is None or int(match.group(1)) > 24 or int(match.group(2)) > 59:
+            raise ConfigParserException("The value of %s (%s) in a replication throttle window is not a valid "
+                                        "time of day (HH:MM)!" % (key, time_of_day))
+        return min(int(match.group(1)) * 60 + int(match.group(2)), 24 * 60)
+
+    def __get_interval_sec(self, schedule_data, key, default_value, unit_sec=60):
+        interval = schedule_data.get(key)
+        if interval is None:
+            return default_value
+        try:
+            interval_sec = int(float(interval) * unit_sec)
+        except ValueError:
+            raise ConfigParserException("The value of %s (%s) in the configuration file is not a number!"
+                                        % (key, interval))
+        if interval_sec <= 0:
+            raise ConfigParserException("The value of %s in the configuration file must be positive!" % key)
+        return interval_sec
+
+    def __get_size_bytes(self, size_data, key, default_value, unit_bytes):
+        size = size_data.get(key)
+        if size is None:
+            return default_value
+        try:
+            size_bytes = int(float(size) * unit_bytes)
+        except (TypeError, ValueError):
+            raise ConfigParserException("The value of %s (%s) in the configuration file is not a number!"
+                                        % (key, size))
+        if size_bytes <= 0:
+            raise ConfigParserException("The value of %s in the configuration file must be positive!" % key)
+        return size_bytes
+
     def __get_servers_block(self, cluster_data):
         servers_block = cluster_data.get("servers")
         return servers_block
@@ -192,12 +500,13 @@ class ConfigParser:
         rescue_user = rescue_env_data.get("rescue_user")
         is_sudoer = (rescue_env_data.get("is_sudoer") == True)
         rescue_dir = rescue_env_data.get("rescue_dir")
-        data_root_dir = os.path.join(rescue_dir, "data")
+        storage_data = rescue_env_data.get("storage") or {}
+        data_root_dir = os.path.join(rescue_dir, defaults.DATA_DIR)
         cluster_a_root_dir = os.path.join(data_root_dir, "prod")
         cluster_b_root_dir = os.path.join(data_root_dir, "dr")
-        cluster_sync_root_dir = os.path.join(data_root_dir, "sync")
+        cluster_sync_root_dir = self.__get_storage_dir(storage_data, "sync_dir", os.path.join(data_root_dir, "sync"))
         mount_dir = defaults.CLUSTER_SERVER_DIR
-        backups_dir = os.path.join(rescue_dir, "backups")
+        backups_dir = self.__get_storage_dir(storage_data, "backups_dir", os.path.join(rescue_dir, defaults.BACKUPS_DIR))
         # TODO: TDFS-specific variables need to be enforced/validated!
         tdfs_enabled = rescue_env_data.get("tdfs")
         if not tdfs_enabled:
@@ -217,6 +526,16 @@ class ConfigParser:
         return rescue_user, is_sudoer, cluster_a_root_dir, cluster_b_root_dir, cluster_sync_root_dir, mount_dir, backups_dir, \
             tdfs_enabled, filestore_bin_dir, filestore_temp_mount_dir, tab_data_config_dir, dataengine_dir
 
+    # Get a directory of the storage block, it may be on another volume than the rescue directory
+    def __get_storage_dir(self, storage_data, key, default_dir):
+        storage_dir = storage_data.get(key)
+        if storage_dir is None:
+            return default_dir
+        if not os.path.isabs(str(storage_dir)):
+            raise ConfigParserException("Storage %s (%s) needs to be an absolute path in the configuration file!"
+                                        % (key, storage_dir))
+        return os.path.normpath(str(storage_dir))
+
     # Obtain Postgres data (on the Unix environment)
     def __get_postgres_data(self, postgres_data, rescue_dir):
         absolute_dir = postgres_data.get("absolute_dir")
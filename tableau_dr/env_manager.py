@@ -37,6 +37,19 @@ import platform
 import re
 import utils
 import uuid
+import pipes
+import threading
+import sys
+from concurrency import backoff_wait_sec
+from pg_client import PgConnectionPool, PgClientException
+from pg_bundle import PgBundleCache, PgBundleException, postgres_major_version
+from mount_manager import probe_mount, MOUNT_OK, MOUNT_EMPTY
+from snapshot import snapshot_tree, SnapshotException
+from backup_coordinator import BackupCoordinator, BackupCoordinatorException
+from backup_catalog import BACKUP_FILE_PATTERN
+import pg_client
+import profiler
+import command_output
 
 # Custom exceptions
 class ValidateEnvironmentException(Exception):
@@ -73,7 +86,16 @@ class EnvironmentManager:
                  filestore_app_dir,
                  filestore_temp_mount_dir,
                  dataengine_dir,
-                 is_reverse):
+                 is_reverse,
+                 basebackup_max_rate=None,
+                 basebackup_wal_method=d.PG_BASEBACKUP_DEFAULT_WAL_METHOD,
+                 basebackup_staging=False,
+                 pg_bundle_dir=None,
+                 pg_version=d.PG_VERSION,
+                 mount_options=None,
+                 rescue_dir=None,
+                 backup_staging_dir=None,
+                 snapshot_method=d.SNAPSHOT_DEFAULT_METHOD):
         logging.debug("EnvironmentManager class is being initialized!")
         self.rescue_user = rescue_user
         logging.debug("Distaster recovery user is set to %s." % rescue_user)
@@ -124,6 +146,16 @@ class EnvironmentManager:
         self.backups_dir = backups_dir
         logging.debug("Directory for storing backup files has been set to %s" % backups_dir)
 
+        # Backups and the sync tree may be on other volumes, so the rescue directory is not their parent
+        self.rescue_dir = rescue_dir if rescue_dir is not None else os.path.split(backups_dir)[0]
+        logging.debug("Tableau DR's directory has been set to %s" % self.rescue_dir)
+
+        self.backup_staging_dir = backup_staging_dir if backup_staging_dir is not None \
+            else os.path.join(sync_root_dir, d.BACKUP_STAGING_DIR)
+        self.snapshot_method = snapshot_method
+        logging.debug("Backups are staged in %s, with %s snapshots of the sync directory"
+                      % (self.backup_staging_dir, snapshot_method))
+
         self.dr_unix_ip = dr_unix_ip
         logging.debug("Tableau DR Linux's IP address is set to %s" % dr_unix_ip)
 
@@ -158,6 +190,27 @@ class EnvironmentManager:
         self.is_reverse = is_reverse
         logging.debug("Reverse switch is set to %s" % is_reverse)
 
+        self.basebackup_max_rate = basebackup_max_rate
+        self.basebackup_wal_method = basebackup_wal_method
+        self.basebackup_staging = basebackup_staging
+        logging.debug("Basebackup max rate: %s, WAL method: %s, staging: %s" % (basebackup_max_rate,
+                                                                                basebackup_wal_method,
+                                                                                basebackup_staging))
+
+        self.pg_bundle_dir = pg_bundle_dir
+        logging.debug("Postgres bundle directory is set to %s" % pg_bundle_dir)
+
+        self.pg_version = pg_version
+        logging.debug("Postgres version is set to %s" % pg_version)
+
+        self.mount_options = mount_options or {}  # Name of the share -> additional CIFS mount options
+        logging.debug("Additional mount options are set to %s" % self.mount_options)
+
+        self.__pg_pools = {}  # (host, port, user) -> connection pool
+        self.__pg_pools_lock = threading.Lock()
+        if not pg_client.is_available():
+            logging.debug("psycopg2 is not installed, Postgres queries are run with psql.")
+
     def validate_user(self):
         logging.debug("Validating that current user is the one to execute failover with...")
         stdout, stderr = self.__execute_cmd("whoami")
@@ -172,7 +225,7 @@ class EnvironmentManager:
 
     def validate_rescue_dir(self):
         logging.debug("Validating Tableau DR's directory...")
-        rescue_dir_path = os.path.split(self.backups_dir)[0]
+        rescue_dir_path = self.rescue_dir
         if not os.access(rescue_dir_path, os.W_OK):
             raise ValidateEnvironmentException("The provided directory for Tableau DR (%s) "
                                                "is not writable by %s!" % (rescue_dir_path, self.rescue_user))
@@ -223,15 +276,14 @@ class EnvironmentManager:
                 "Was not able to find all required mount points! Identified mount points: %s"
                 % (tableau_server_mountpoints))
 
-        # Check that directories actually exist
+        # Check that the shares respond, a hung share would block listing it
         for mountpoint in tableau_server_mountpoints:
-            try:
-                dir_content = os.listdir(mountpoint)
-                if dir_content == []:
-                    raise ValidateEnvironmentException("Mountpoint dir (%s) is empty!" % mountpoint)
-            except OSError, e:
-                raise ValidateEnvironmentException("Mountpoint dir (%s) does not exist! OS Error: %s" % (mountpoint,
-                                                                                                         e))
+            probe_result = probe_mount(mountpoint, d.MOUNT_PROBE_TIMEOUT_SEC)
+            if probe_result["state"] == MOUNT_EMPTY:
+                raise ValidateEnvironmentException("Mountpoint dir (%s) is empty!" % mountpoint)
+            elif probe_result["state"] != MOUNT_OK:
+                raise ValidateEnvironmentException("Mountpoint dir (%s) is %s! Error: %s"
+                                                   % (mountpoint, probe_result["state"], probe_result["error"]))
 
         # Here we can safely assume that mountdirs exists and are functional
         logging.info("Mount points are OK!")
@@ -246,6 +298,7 @@ class EnvironmentManager:
         for cron_job in rsync_cron_jobs:
             user_crons.remove(cron_job)
         user_crons.write()
+        self.remove_wal_receiver_jobs()
         logging.debug("Successfully cleared relevant replication jobs from crontab!")
 
     # Function to add initial cron jobs
@@ -277,7 +330,7 @@ class EnvironmentManager:
             # Ensure that there is replication between source and sync
             source_sync_rsync_job = d.RSYNC_TEMPLATE.format(source_path=utils.add_trailing_slash(source_path),
                                                             destination_path=utils.remove_trailing_slash(sync_path),
-                                                            rescue_dir = os.path.split(self.backups_dir)[0],
+                                                            rescue_dir = self.rescue_dir,
                                                             uuid=uuid.uuid4())
             jobs_to_add.append(source_sync_rsync_job)
 
@@ -285,7 +338,7 @@ class EnvironmentManager:
                 sync_target_rsync_job = d.RSYNC_TEMPLATE.format(source_path=utils.add_trailing_slash(sync_path),
                                                                 destination_path=utils.remove_trailing_slash(
                                                                     target_path),
-                                                                rescue_dir = os.path.split(self.backups_dir)[0],
+                                                                rescue_dir = self.rescue_dir,
                                                             uuid=uuid.uuid4())
                 jobs_to_add.append(sync_target_rsync_job)
 
@@ -298,13 +351,13 @@ class EnvironmentManager:
 
         source_sync_rsync_job = d.RSYNC_TEMPLATE.format(source_path=utils.add_trailing_slash(config_path_prod),
                                                         destination_path=utils.remove_trailing_slash(config_path_sync),
-                                                        rescue_dir = os.path.split(self.backups_dir)[0],
+                                                        rescue_dir = self.rescue_dir,
                                                         uuid=uuid.uuid4())
         jobs_to_add.append(source_sync_rsync_job)
 
         for job_cmd in jobs_to_add:
             logging.debug("Executing the replication job before adding it...")
-            self.__execute_cmd(job_cmd)
+            self.__execute_cmd("sh -c %s" % pipes.quote(job_cmd))  # The job reads its bandwidth limit in a subshell
             if job_cmd in rsync_cron_job_cmds:
                 rsync_cron_jobs[rsync_cron_job_cmds.index(job_cmd)].enable()
             else:
@@ -319,8 +372,12 @@ class EnvironmentManager:
     def delete_directory_tree(self):
         logging.debug("Deleting Tableau DR's directory tree...")
         clusters_dir = os.path.split(self.cluster_source_mount_full_path)[0]
-        dirs_to_remove = [clusters_dir,
-                          self.backups_dir]
+        # The storage directories may be user-supplied roots, e.g. a whole volume, so only the directories and
+        # files created by Tableau DR are removed from them. Within the rescue directory everything is removed below.
+        dirs_to_remove = [clusters_dir, self.sync_full_path]
+        if os.path.exists(self.backup_staging_dir):
+            dirs_to_remove += [os.path.join(self.backup_staging_dir, x) for x in os.listdir(self.backup_staging_dir)
+                               if x.startswith(d.BACKUP_TEMP_DIR_PREFIX)]
         for dir_path in dirs_to_remove:
             if os.path.exists(dir_path):
                 logging.debug("Deleting %s..." % dir_path)
@@ -328,6 +385,13 @@ class EnvironmentManager:
             else:
                 logging.debug("%s does not exist." % dir_path)
 
+        if os.path.exists(self.backups_dir):
+            for file_name in os.listdir(self.backups_dir):
+                if BACKUP_FILE_PATTERN.match(file_name.replace(".tsbak.tmp", ".tsbak")) or \
+                        file_name.startswith(d.BACKUP_INDEX_FILE):
+                    logging.debug("Deleting %s..." % os.path.join(self.backups_dir, file_name))
+                    os.remove(os.path.join(self.backups_dir, file_name))
+
         pg_dirs_to_remove = [self.cluster_source_pg_data_dir,
                              self.cluster_target_pg_data_dir,
                              os.path.split(self.cluster_source_pg_data_dir)[0]]
@@ -343,7 +407,7 @@ class EnvironmentManager:
                                                                                             e))
 
         # Removing everything that remains in the folder
-        tableau_dr_dir = os.path.split(self.backups_dir)[0]
+        tableau_dr_dir = self.rescue_dir
         for root, dirs, files in os.walk(tableau_dr_dir, topdown=False):
             for filename in files:
                 file_abs_path = os.path.join(root, filename)
@@ -364,6 +428,7 @@ class EnvironmentManager:
                           self.cluster_source_pg_data_dir,
                           self.cluster_target_pg_data_dir,
                           self.backups_dir,
+                          self.backup_staging_dir,
                           self.sync_full_path]
 
         if self.tdfs_enabled:
@@ -485,6 +550,13 @@ class EnvironmentManager:
         if target_server is not None:
             self.__validate_pg_datadir(self.cluster_target_pg_data_dir, target_server, stop_after_basebackup=True)
 
+        installed_version = self.installed_postgres_version()
+        if installed_version != self.pg_version:
+            raise ValidateEnvironmentException("The Postgres replica needs Postgres %s, but %s is installed in %s! "
+                                               "Please run prepare to install it."
+                                               % (self.pg_version, installed_version or "nothing",
+                                                  self.pg_absolute_dir))
+
         # Find Postgres processes
         logging.debug("Checking whether the correct Postgres is running on Tableau DR Linux or not.")
         procs = subprocess.check_output(shlex.split("ps -ef")).splitlines()
@@ -518,31 +590,26 @@ class EnvironmentManager:
                                    pg_data_dir=self.cluster_source_pg_data_dir,
                                    start=True)
 
-        # Attempting to run psql to tests connection to local Postgres
+        # Attempting to connect to local Postgres
         logging.debug("Attempting to connect to local Postgres...")
-        self.__test_local_pg_connection(pg_absolute_dir=self.pg_absolute_dir,
-                                        pg_port=self.pg_port,
-                                        pg_user=self.pg_user,
-                                        pg_database=self.pg_database)
+        self.__test_local_pg_connection(pg_port=self.pg_port,
+                                        pg_user=self.pg_user)
 
         # Attempting to connect to Postgres on source to pg_database
         logging.debug("Attempting to connect to source Tableau Server's Postgres...")
-        retry_needed = self.__test_source_pg_connection(pg_absolute_dir=self.pg_absolute_dir,
-                                                        pg_host=source_server.host,
-                                                        pg_port=8060,
+        retry_needed = self.__test_source_pg_connection(pg_port=8060,
                                                         pg_user="tableau",
-                                                        pg_database=self.pg_database,
                                                         source_server=source_server,
                                                         target_server=target_server,
                                                         test_replication_role=True)
         num_retries = 0
         while retry_needed and num_retries <= d.REMOTE_PG_CONNECT_MAX_RETRIES:
             num_retries += 1
-            retry_needed = self.__test_source_pg_connection(pg_absolute_dir=self.pg_absolute_dir,
-                                                            pg_host=source_server.host,
-                                                            pg_port=8060,
+            # Give the fixes applied on Tableau Server time to take effect
+            time.sleep(backoff_wait_sec(num_retries, d.REMOTE_PG_CONNECT_INITIAL_WAIT_SEC,
+                                        d.REMOTE_PG_CONNECT_MAX_WAIT_SEC))
+            retry_needed = self.__test_source_pg_connection(pg_port=8060,
                                                             pg_user="tableau",
-                                                            pg_database=self.pg_database,
                                                             source_server=source_server,
                                                             target_server=target_server,
                                                             test_replication_role=True)
@@ -551,6 +618,19 @@ class EnvironmentManager:
             # TODO: Add more meaningful info on why this may have happened
             raise ValidateEnvironmentException("Was not able to connect to source Tableau Server's Postgres!")
 
+        # Streaming replication only works between servers of the same major version
+        source_pg_version = self.run_pg_query("SHOW server_version;",
+                                              host=source_server.host,
+                                              port=d.REMOTE_PG_PORT,
+                                              user=d.REMOTE_PG_USER)[0][0]
+        if postgres_major_version(source_pg_version) != postgres_major_version(self.pg_version):
+            raise ValidateEnvironmentException("The source Tableau Server runs Postgres %s, but the replica is built "
+                                               "for Postgres %s! Please set the matching Postgres version in the "
+                                               "configuration file and run prepare."
+                                               % (source_pg_version, self.pg_version))
+        logging.debug("Source Tableau Server runs Postgres %s, the replica runs %s." % (source_pg_version,
+                                                                                        self.pg_version))
+
         logging.info("Tableau Postgres Repository is OK!")
         return True
 
@@ -566,6 +646,24 @@ class EnvironmentManager:
         logging.info("Tableau servers are OK!")
         return True
 
+    # Function to run SQL statements and return the rows of the result as text, the way psql prints them.
+    # Without a host, the statements are run on the local Postgres replica.
+    def run_pg_query(self, query, host=None, port=None, user=None, params=None):
+        try:
+            return self.__pg_query(query=query,
+                                   params=params,
+                                   host=host if host is not None else "localhost",
+                                   port=port if port is not None else self.pg_port,
+                                   user=user if user is not None else self.pg_user)
+        except PgClientException, e:
+            raise EnvironmentManagerException(str(e))
+
+    # Close the pooled Postgres connections, e.g. before the replica is stopped
+    def close_pg_connections(self):
+        with self.__pg_pools_lock:
+            for pg_pool in self.__pg_pools.values():
+                pg_pool.close()
+
     def disable_rsync(self):
         logging.debug("Disabling Tableau File Store Repository sync is in progress...")
         user_crons = CronTab(user=self.rescue_user)
@@ -652,7 +750,7 @@ class EnvironmentManager:
 
         dr_sync_rsync_job = d.RSYNC_TEMPLATE.format(source_path=utils.add_trailing_slash(config_path_dr),
                                                     destination_path=utils.remove_trailing_slash(config_path_sync),
-                                                    rescue_dir=os.path.split(self.backups_dir)[0],
+                                                    rescue_dir=self.rescue_dir,
                                                     uuid=uuid.uuid4())
 
         if dr_sync_rsync_job not in user_cron_cmds:
@@ -669,6 +767,38 @@ class EnvironmentManager:
         user_crons.write()
         logging.debug("Rsync direction has been successfully reversed!")
 
+    # Function to list the enabled replication jobs together with the pair of locations they replicate between
+    def get_replication_jobs(self):
+        user_crons = CronTab(user=self.rescue_user)
+        replication_jobs = []
+        for cron_job in self.__get_relevant_rsync_jobs(user_crons):
+            if not cron_job.is_enabled():
+                continue
+            match = re.search(r"cron\.lock(\S+) rsync .* (\S+) (\S+)$", cron_job.command)
+            if match is None:
+                logging.debug("Not able to parse the following replication job, ignoring it: %s" % cron_job.command)
+                continue
+            job_uuid, source_path, destination_path = match.groups()
+            replication_jobs.append({"uuid": job_uuid,
+                                     "pair": "%s_%s" % (self.__get_replication_location(source_path),
+                                                        self.__get_replication_location(destination_path)),
+                                     "source_path": source_path,
+                                     "destination_path": destination_path})
+        return replication_jobs
+
+    # Lock files of the enabled replication jobs writing into the given directory
+    def replication_lock_file_paths(self, destination_path):
+        return [os.path.join(self.rescue_dir, d.RSYNC_LOCK_FILE.format(uuid=job["uuid"]))
+                for job in self.get_replication_jobs()
+                if job["destination_path"].startswith(destination_path)]
+
+    # Copy the listed files, given relative to source_dir, into destination_dir
+    def copy_listed_files(self, source_dir, destination_dir, file_list_path):
+        self.__execute_cmd(d.PRESEED_RSYNC_CMD.format(file_list_path=file_list_path,
+                                                      source_path=utils.add_trailing_slash(source_dir),
+                                                      destination_path=utils.add_trailing_slash(destination_dir)),
+                           capture_bytes=d.CMD_OUTPUT_CAPTURE_BYTES)
+
     def install_java(self):
         logging.info("Checking if Java is installed..")
 
@@ -676,7 +806,7 @@ class EnvironmentManager:
             err, out = self.__execute_cmd(d.JAVA_CHECK_CMD)
         except EnvironmentManagerException:
             logging.info("Java installer is not found! Installing Java JRE 8..")
-            map(lambda cmd: self.__execute_cmd(cmd), d.JAVA_INSTALL_CMDS)
+            map(lambda cmd: self.__execute_cmd(cmd, capture_bytes=d.CMD_OUTPUT_CAPTURE_BYTES), d.JAVA_INSTALL_CMDS)
 
     def check_filestore(self):
 
@@ -785,11 +915,13 @@ class EnvironmentManager:
             src = os.path.join(self.sync_full_path, self.dataengine_dir)
             tgt = os.path.join(self.cluster_target_mount_full_path, self.dataengine_dir)
 
-        out, err = self.__execute_cmd(d.FILESTORE_IS_SYNC_DRY_CMD.format(
-            src_dataengine_dir=src,
-            tgt_dataengine_dir=tgt))
-
-        mismatches = len(filter(lambda l: l.startswith("extract"), out.split("\n")))
+        # The dry run lists every file of the extract tree, only the mismatches are counted
+        mismatched_lines = []
+        self.__execute_cmd(d.FILESTORE_IS_SYNC_DRY_CMD.format(src_dataengine_dir=src,
+                                                              tgt_dataengine_dir=tgt),
+                           capture_bytes=d.CMD_OUTPUT_CAPTURE_BYTES,
+                           stdout_handler=lambda l: mismatched_lines.append(1) if l.startswith("extract") else None)
+        mismatches = len(mismatched_lines)
 
         if mismatches > 0:
             logging.info("Data discrepacy found between Tableau cluster and Tableau DR! "
@@ -797,7 +929,8 @@ class EnvironmentManager:
 
             out, err = self.__execute_cmd(d.FILESTORE_IS_SYNC_CMD.format(
                 src_dataengine_dir=src,
-                tgt_dataengine_dir=tgt))
+                tgt_dataengine_dir=tgt),
+                capture_bytes=d.CMD_OUTPUT_CAPTURE_BYTES)
 
             logging.debug("Re-sync output: %s" % out)
         else:
@@ -988,7 +1121,45 @@ class EnvironmentManager:
             logging.error("Failed to set up Filestore configuration: %s" % str(exc))
 
     def install_build_postgres(self, source_server):
-        logging.debug("Installing and building Postgres is in progress...")
+        logging.debug("Installing Postgres is in progress...")
+        installed = self.installed_postgres_version() == self.pg_version
+        if installed:
+            logging.info("Postgres %s is already installed in %s." % (self.pg_version, self.pg_absolute_dir))
+
+        bundle_cache = None
+        if self.pg_bundle_dir is not None and not installed:
+            bundle_cache = PgBundleCache(bundle_dir=self.pg_bundle_dir,
+                                         version=self.pg_version,
+                                         build_procedure=d.PG_BUILD_PROCEDURE)
+            bundle_path = bundle_cache.find()
+            if bundle_path is not None:
+                try:
+                    self.__unpack_pg_bundle(bundle_path)
+                    installed = True
+                except EnvironmentManagerException, e:
+                    logging.warning("Was not able to install Postgres from %s, building it from source instead: %s"
+                                    % (bundle_path, e))
+                    bundle_cache.discard()
+
+        if not installed:
+            self.__build_postgres()
+            if bundle_cache is not None:
+                self.__package_pg_bundle(bundle_cache)
+
+        for cmd in d.ADD_PG_USER_CMDS:
+            try:
+                cmd = cmd.format(pg_abs_path=self.pg_absolute_dir,
+                                 rescue_user_gid=self.rescue_user)
+                self.__execute_cmd(cmd)
+            except EnvironmentManagerException, e:
+                logging.debug("Error encountered while executing the following command: %s \n Error: %s" % (cmd, e))
+
+        # Set localedef
+        self.__execute_cmd(d.LOCALEDEF_CMD)
+
+    # Download, compile and install Postgres from source
+    def __build_postgres(self):
+        logging.info("Building Postgres %s from source, this takes a few minutes..." % self.pg_version)
         tempdir = tempfile.gettempdir()
         temp_pg_dir = os.path.join(tempdir, "postgres")
 
@@ -1003,10 +1174,10 @@ class EnvironmentManager:
             os.mkdir(temp_pg_dir)
 
         logging.debug("Obtaining and building Postgres source...")
-        pg_tar_path = os.path.join(temp_pg_dir, "postgresql-%s.tar.bz2" % d.PG_VERSION)
+        pg_tar_path = os.path.join(temp_pg_dir, "postgresql-%s.tar.bz2" % self.pg_version)
         if not os.path.exists(pg_tar_path):
             try:
-                urllib.urlretrieve(d.PG_SOURCE_URL,
+                urllib.urlretrieve(d.PG_SOURCE_URL.format(version=self.pg_version),
                                    pg_tar_path)
             except Exception, e:
                 raise EnvironmentManagerException("Tableau DR was not able to download Postgresql {version} source "
@@ -1014,39 +1185,29 @@ class EnvironmentManager:
                                                   "Please download it manually and place the tar into {dest_path}!"
                                                   .format(error=e,
                                                           dest_path=temp_pg_dir,
-                                                          version=d.PG_VERSION))
+                                                          version=self.pg_version))
 
         untar_cmd = "tar xvf {pg_tar_path} -C {temp_pg_dir}".format(pg_tar_path=pg_tar_path,
                                                                     temp_pg_dir=temp_pg_dir)
-        pg_source_path = os.path.join(temp_pg_dir, "postgresql-%s" % d.PG_VERSION)
+        pg_source_path = os.path.join(temp_pg_dir, "postgresql-%s" % self.pg_version)
         if not os.path.exists(pg_source_path):
-            self.__execute_cmd(untar_cmd)
+            self.__execute_cmd(untar_cmd, capture_bytes=d.CMD_OUTPUT_CAPTURE_BYTES)
         else:
             if os.listdir(pg_source_path) == []:
-                self.__execute_cmd(untar_cmd)
+                self.__execute_cmd(untar_cmd, capture_bytes=d.CMD_OUTPUT_CAPTURE_BYTES)
 
         # Execute the actual build procedure
         for cmd in d.PG_BUILD_PROCEDURE:
             try:
                 self.__execute_cmd(cmd.format(prefix=self.pg_absolute_dir),
-                                   cwd=pg_source_path)
+                                   cwd=pg_source_path,
+                                   capture_bytes=d.CMD_OUTPUT_CAPTURE_BYTES)
             except EnvironmentManagerException:
                 raise EnvironmentManagerException("Tableau DR was not able to prepare Postgresql! "
                                                   "Please make sure to install all of the required Linux "
                                                   "packages beforehand! "
                                                   "For the list of those packages please check the documentation.")
 
-        for cmd in d.ADD_PG_USER_CMDS:
-            try:
-                cmd = cmd.format(pg_abs_path=self.pg_absolute_dir,
-                                 rescue_user_gid=self.rescue_user)
-                self.__execute_cmd(cmd)
-            except EnvironmentManagerException, e:
-                logging.debug("Error encountered while executing the following command: %s \n Error: %s" % (cmd, e))
-
-        # Set localedef
-        self.__execute_cmd(d.LOCALEDEF_CMD)
-
         try:
             logging.info("Deleting temporaly postgres files...")
             self.delete_temp_pg_dir()
@@ -1054,7 +1215,49 @@ class EnvironmentManager:
             logging.debug("Was not able to remove %s due to the following error: %s" % (temp_pg_dir, e))
             raise Exception("Was not able to remove %s due to the following error: %s" % (temp_pg_dir, e))
 
-    def basebackup_start_source_postgres(self, source_server):
+    # Install a compiled Postgres tree packaged by an earlier build
+    def __unpack_pg_bundle(self, bundle_path):
+        logging.info("Installing Postgres %s from %s..." % (self.pg_version, bundle_path))
+        self.__execute_cmd("sudo mkdir -p %s" % self.pg_absolute_dir)
+        self.__execute_cmd("sudo tar -xzf %s -C %s" % (bundle_path, self.pg_absolute_dir))
+        installed_version = self.installed_postgres_version()
+        if installed_version != self.pg_version:
+            raise EnvironmentManagerException("Postgres installed from %s reports an unexpected version: %s"
+                                              % (bundle_path, installed_version))
+
+    # Version of the Postgres binaries in the Postgres directory, None if they are missing
+    def installed_postgres_version(self):
+        try:
+            stdout, stderr = self.__execute_cmd("%s/bin/postgres --version" % self.pg_absolute_dir,
+                                                env={"LD_LIBRARY_PATH": os.path.join(self.pg_absolute_dir, "lib")})
+        except (EnvironmentManagerException, OSError):
+            return None
+        match = re.search(r"(\d+(?:\.\d+)+)", stdout)
+        return match.group(1) if match is not None else None
+
+    # Package the freshly built Postgres tree, so that later installs only need to unpack it
+    def __package_pg_bundle(self, bundle_cache):
+        pg_dirs = filter(lambda x: os.path.exists(os.path.join(self.pg_absolute_dir, x)), d.PG_BUNDLE_DIRS)
+        try:
+            temp_path = bundle_cache.temp_path()
+            self.__execute_cmd("sudo tar -czf %s -C %s %s" % (temp_path, self.pg_absolute_dir, " ".join(pg_dirs)))
+            self.__execute_cmd("sudo chown %s %s" % (self.rescue_user, temp_path))
+            bundle_cache.publish(temp_path)
+        except (EnvironmentManagerException, PgBundleException, OSError), e:
+            # Postgres is installed, only the next install will be slower
+            logging.warning("Was not able to package Postgres into %s: %s" % (bundle_cache.bundle_dir, e))
+
+    def basebackup_start_source_postgres(self, source_server, incremental=False):
+        if incremental and self.__has_pg_data(self.cluster_source_pg_data_dir):
+            try:
+                self.postgres_incremental_resync(tab_host=source_server.host,
+                                                 pg_data_dir=self.cluster_source_pg_data_dir)
+                self.start_source_postgres()
+                return
+            except Exception, e:
+                logging.warning("Incremental resync of the Postgres replica has failed, "
+                                "falling back to a full basebackup: %s" % e)
+
         self.postgres_basebackup(tab_host=source_server.host,
                                  pg_data_dir=self.cluster_source_pg_data_dir,
                                  initial=True)
@@ -1064,6 +1267,14 @@ class EnvironmentManager:
         # Start Postgres
         self.start_source_postgres()
 
+    # Function to rebuild the source Tableau Server's Postgres replica when it cannot catch up anymore
+    def resync_source_postgres(self, source_server, incremental=True):
+        logging.info("Resynchronizing the source Tableau Server's Postgres replica...")
+        self.stop_source_postgres()
+        self.basebackup_start_source_postgres(source_server=source_server,
+                                              incremental=incremental)
+        logging.info("Postgres replica has been successfully resynchronized!")
+
     def start_source_postgres(self):
         logging.debug("Starting Postgres instance for the source Tableau cluster...")
         self.__manage_postgres(pg_absolute_dir=self.pg_absolute_dir,
@@ -1116,102 +1327,391 @@ class EnvironmentManager:
             if not initial:
                 raise EnvironmentManagerException("Postgres data directory (%s) does not exist!" % pg_data_dir)
 
+        conf_temp_dir = None
         if not initial:
             # Preserve the content of recovery.conf and postgresql.conf
-            recovery_conf_temp_path = os.path.join(tempfile.gettempdir(), "recovery.conf")
-            recovery_conf_absolute_path = os.path.join(pg_data_dir, "recovery.conf")
-            recovery_conf_temp_cmd = "echo \"$(cat %s)\" > %s" % (recovery_conf_absolute_path,
-                                                                  recovery_conf_temp_path)
-            self.__execute_cmd(cmd_str=recovery_conf_temp_cmd,
-                               as_unix_pg_user=True)
+            # Use a private temporary directory so that replicas of other rescue groups do not collide
+            conf_temp_dir = self.__make_pg_user_temp_dir(prefix="tableau_dr_pgconf_")
+        try:
+            if not initial:
+                recovery_conf_temp_path = os.path.join(conf_temp_dir, "recovery.conf")
+                recovery_conf_absolute_path = os.path.join(pg_data_dir, "recovery.conf")
+                recovery_conf_temp_cmd = "echo \"$(cat %s)\" > %s" % (recovery_conf_absolute_path,
+                                                                      recovery_conf_temp_path)
+                self.__execute_cmd(cmd_str=recovery_conf_temp_cmd,
+                                   as_unix_pg_user=True)
+
+                postgresql_conf_temp_path = os.path.join(conf_temp_dir, "postgresql.conf")
+                postgresql_conf_absolute_path = os.path.join(pg_data_dir, "postgresql.conf")
+                postgresql_conf_temp_cmd = "echo \"$(cat %s)\" > %s" % (postgresql_conf_absolute_path,
+                                                                        postgresql_conf_temp_path)
+                self.__execute_cmd(cmd_str=postgresql_conf_temp_cmd,
+                                   as_unix_pg_user=True)
 
-            postgresql_conf_temp_path = os.path.join(tempfile.gettempdir(), "postgresql.conf")
-            postgresql_conf_absolute_path = os.path.join(pg_data_dir, "postgresql.conf")
-            postgresql_conf_temp_cmd = "echo \"$(cat %s)\" > %s" % (postgresql_conf_absolute_path,
-                                                                    postgresql_conf_temp_path)
-            self.__execute_cmd(cmd_str=postgresql_conf_temp_cmd,
+            # Creating/Modifying the content of .pgpass
+            self.__modify_pgpass(tab_host=tab_host,
+                                 remote_pg_port=8060,
+                                 remote_pg_db="replication",
+                                 remote_pg_user=remote_pg_user,
+                                 remote_pg_password=remote_pg_password,
+                                 append=True)
+
+            # With staging, the old data directory is only deleted once the new basebackup is complete
+            staging_dir = None
+            if self.basebackup_staging:
+                staging_dir = self.__make_pg_user_temp_dir(prefix="tableau_dr_basebackup_",
+                                                           dir=os.path.split(pg_data_dir)[0])
+                self.__run_basebackup(tab_host=tab_host,
+                                      pg_user=remote_pg_user,
+                                      destination_dir=staging_dir,
+                                      tar_format=True)
+
+            # Config data is preserved, we can delete the old data directory
+            chown_data_dir_cmd = "sudo chmod -R g+w %s" % pg_data_dir
+            self.__execute_cmd(chown_data_dir_cmd)
+
+            delete_data_dir_cmd = "rm -rf %s" % pg_data_dir
+            self.__execute_cmd(cmd_str=delete_data_dir_cmd,
                                as_unix_pg_user=True)
 
-        # Config data is preserved, we can delete the old data directory
-        chown_data_dir_cmd = "sudo chmod -R g+w %s" % pg_data_dir
-        self.__execute_cmd(chown_data_dir_cmd)
+            # Executing basebackup
+            if staging_dir is None:
+                self.__run_basebackup(tab_host=tab_host,
+                                      pg_user=remote_pg_user,
+                                      destination_dir=pg_data_dir)
+            else:
+                logging.debug("Unpacking the staged basebackup into %s..." % pg_data_dir)
+                self.__execute_cmd("mkdir -m 700 %s" % pg_data_dir, as_unix_pg_user=True)
+                self.__execute_cmd("tar -xzf %s -C %s" % (os.path.join(staging_dir, "base.tar.gz"),
+                                                          pg_data_dir),
+                                   as_unix_pg_user=True)
+                self.__execute_cmd("sudo rm -rf %s" % staging_dir)
 
-        delete_data_dir_cmd = "rm -rf %s" % pg_data_dir
-        self.__execute_cmd(cmd_str=delete_data_dir_cmd,
-                           as_unix_pg_user=True)
+            if not initial:
+                # Replacing config file contents in data dir from the temporary files
+                replace_recovery_conf_cmd = "echo \"$(cat %s)\" > %s" % (recovery_conf_temp_path,
+                                                                         recovery_conf_absolute_path)
+                self.__execute_cmd(replace_recovery_conf_cmd,
+                                   as_unix_pg_user=True)
 
-        # Creating/Modifying the content of .pgpass
-        self.__modify_pgpass(tab_host=tab_host,
-                             remote_pg_port=8060,
-                             remote_pg_db="replication",
-                             remote_pg_user=remote_pg_user,
-                             remote_pg_password=remote_pg_password,
-                             append=True)
-
-        # Executing basebackup
-        backup_cmd = d.PG_BASEBACKUP_CMD.format(pg_dir=self.pg_absolute_dir,
-                                                host=tab_host,
-                                                pg_port=8060,
-                                                pg_data_dir=pg_data_dir,
-                                                pg_user=remote_pg_user,
-                                                pg_pass=remote_pg_password)
-        self.__execute_cmd(cmd_str=backup_cmd,
-                           as_unix_pg_user=True,
-                           env={"LD_LIBRARY_PATH": os.path.join(self.pg_absolute_dir, "lib")})
+                replace_postgresql_conf_cmd = "echo \"$(cat %s)\" > %s" % (postgresql_conf_temp_path,
+                                                                           postgresql_conf_absolute_path)
+                self.__execute_cmd(cmd_str=replace_postgresql_conf_cmd,
+                                   as_unix_pg_user=True)
+        finally:
+            # The copy of recovery.conf holds the replication password
+            if conf_temp_dir is not None:
+                self.__execute_cmd("sudo rm -rf %s" % conf_temp_dir)
 
-        if not initial:
-            # Replacing config file contents in data dir from the temporary files
-            replace_recovery_conf_cmd = "echo \"$(cat %s)\" > %s" % (recovery_conf_temp_path,
-                                                                     recovery_conf_absolute_path)
-            self.__execute_cmd(replace_recovery_conf_cmd,
-                               as_unix_pg_user=True)
+        logging.debug("Postgres basebackup has been successful!")
 
-            replace_postgresql_conf_cmd = "echo \"$(cat %s)\" > %s" % (postgresql_conf_temp_path,
-                                                                       postgresql_conf_absolute_path)
-            self.__execute_cmd(cmd_str=replace_postgresql_conf_cmd,
-                               as_unix_pg_user=True)
+    # Function to bring an existing replica data directory up to date by copying only the files that have changed
+    # on the source Tableau Server's data directory share, while the source is in online backup mode
+    def postgres_incremental_resync(self, tab_host, pg_data_dir):
+        source_pg_data_dir = os.path.join(self.cluster_source_mount_full_path, d.TABLEAU_PG_DATA_DIR)
+        if not os.path.isdir(source_pg_data_dir):
+            raise EnvironmentManagerException("The source Tableau Server's Postgres data directory (%s) "
+                                              "is not accessible!" % source_pg_data_dir)
+        logging.info("Resynchronizing %s from %s incrementally..." % (pg_data_dir, source_pg_data_dir))
 
-        logging.debug("Postgres basebackup has been successful!")
+        self.__manage_postgres(pg_absolute_dir=self.pg_absolute_dir,
+                               pg_data_dir=pg_data_dir,
+                               start=False)
+        # WAL of the outdated replica must not be replayed, the replica fetches what it needs from the source
+        self.__execute_cmd("find %s -maxdepth 1 -type f -delete" % os.path.join(pg_data_dir, "pg_xlog"),
+                           as_unix_pg_user=True)
+
+        self.__start_source_backup(tab_host)
+        try:
+            stdout, stderr = self.__execute_cmd(d.PG_RESYNC_CMD.format(
+                source_pg_data_dir=utils.add_trailing_slash(source_pg_data_dir),
+                pg_data_dir=utils.remove_trailing_slash(pg_data_dir)),
+                capture_bytes=d.CMD_OUTPUT_CAPTURE_BYTES)  # The statistics are at the end
+        except Exception:
+            # The failure of the resync is reported, not a failure to end the online backup after it
+            exc_info = sys.exc_info()
+            try:
+                self.run_pg_query(d.PG_STOP_BACKUP_QUERY, host=tab_host, port=d.REMOTE_PG_PORT,
+                                  user=d.REMOTE_PG_USER)
+            except Exception, e:
+                logging.error("Was not able to stop the online backup on %s after the resync has failed: %s"
+                              % (tab_host, e))
+            raise exc_info[0], exc_info[1], exc_info[2]
+        self.run_pg_query(d.PG_STOP_BACKUP_QUERY, host=tab_host, port=d.REMOTE_PG_PORT, user=d.REMOTE_PG_USER)
+
+        self.__execute_cmd("sudo chown -R postgresql:postgresql %s" % pg_data_dir)
+        self.__execute_cmd("sudo chmod 700 %s" % pg_data_dir)
+        self.__execute_cmd("mkdir -p %s" % os.path.join(pg_data_dir, "pg_xlog", "archive_status"),
+                           as_unix_pg_user=True)
 
-    def execute_source_pgdump(self, destination_dir, dump_format="p"):
+        rsync_stats = utils.parse_rsync_stats(stdout)
+        logging.info("Incremental resync has copied %s of %s files (%s of %s bytes)."
+                     % (rsync_stats["transferred_files"], rsync_stats["files"],
+                        rsync_stats["transferred_bytes"], rsync_stats["total_bytes"]))
+        return rsync_stats
+
+    def execute_source_pgdump(self, destination_dir, dump_format="p", pg_port=None):
+        pg_port = pg_port if pg_port is not None else self.pg_port
         logging.debug("Executing Tableau Postgres Repository pgdump is in progress...")
 
         logging.debug("Executing Tableau Postgres Repository pgdump...")
         pg_dump_cmd = d.PG_DUMP_COMMAND.format(pg_dir=self.pg_absolute_dir,
+                                               port=pg_port,
                                                user=self.pg_user,
                                                database=self.pg_database,
                                                dump_format=dump_format)
-        stdout, stderr = self.__execute_cmd(cmd_str=pg_dump_cmd,
-                                            env={"LD_LIBRARY_PATH": os.path.join(self.pg_absolute_dir, "lib")})
-        pg_dump_file_path = os.path.join(destination_dir, d.WORKGROUP_PG_DUMP_FILE)
-        open(pg_dump_file_path, "w").write(stdout)
+        self.__execute_cmd(cmd_str=pg_dump_cmd,
+                           env={"LD_LIBRARY_PATH": os.path.join(self.pg_absolute_dir, "lib")},
+                           stdout_file_path=os.path.join(destination_dir, d.WORKGROUP_PG_DUMP_FILE))
 
         logging.debug("Executing Tableau Postgres Repository pgdump all...")
         pg_dumpall_cmd = d.PG_DUMPALL_COMMAND.format(pg_dir=self.pg_absolute_dir,
+                                                     port=pg_port,
                                                      user=self.pg_user)
-        stdout, stderr = self.__execute_cmd(cmd_str=pg_dumpall_cmd,
-                                            env={"LD_LIBRARY_PATH": os.path.join(self.pg_absolute_dir, "lib")})
-        pg_dumpall_file_path = os.path.join(destination_dir, d.BACKUP_SQL_FILE)
-        open(pg_dumpall_file_path, "w").write(stdout)
+        self.__execute_cmd(cmd_str=pg_dumpall_cmd,
+                           env={"LD_LIBRARY_PATH": os.path.join(self.pg_absolute_dir, "lib")},
+                           stdout_file_path=os.path.join(destination_dir, d.BACKUP_SQL_FILE))
 
         logging.debug("Successfully executed Tableau Postgres Repository pgdump!")
 
-    def create_backup(self):
-        logging.info("Creating backup file...")
+    # Table of contents of a repository dump in tar format
+    def list_pg_dump(self, dump_file_path):
+        stdout, stderr = self.__execute_cmd(cmd_str=d.PG_RESTORE_LIST_COMMAND.format(pg_dir=self.pg_absolute_dir,
+                                                                                     dump_file_path=dump_file_path),
+                                            env={"LD_LIBRARY_PATH": os.path.join(self.pg_absolute_dir, "lib")})
+        return stdout
+
+    # Data of one table of a repository dump in COPY format
+    def dump_table_data(self, dump_file_path, table):
+        cmd_str = d.PG_RESTORE_TABLE_DATA_COMMAND.format(pg_dir=self.pg_absolute_dir,
+                                                         table=table,
+                                                         dump_file_path=dump_file_path)
+        stdout, stderr = self.__execute_cmd(cmd_str=cmd_str,
+                                            env={"LD_LIBRARY_PATH": os.path.join(self.pg_absolute_dir, "lib")})
+        return stdout
+
+    # Function to schedule the WAL receiver streaming into the archive. Cron restarts it whenever it is not running.
+    def schedule_wal_receiver(self, source_host, archive_dir, wal_dir):
+        receiver_cmd = d.WAL_RECEIVER_TEMPLATE.format(archive_dir=archive_dir,
+                                                      pg_dir=self.pg_absolute_dir,
+                                                      host=source_host,
+                                                      port=d.REMOTE_PG_PORT,
+                                                      user=d.REMOTE_PG_USER,
+                                                      wal_dir=wal_dir)
+        user_crons = CronTab(user=self.rescue_user)
+        receiver_jobs = self.__get_wal_receiver_jobs(user_crons)
+        for cron_job in receiver_jobs:
+            if cron_job.command != receiver_cmd:
+                logging.debug("Removing outdated WAL receiver job: %s" % cron_job.command)
+                user_crons.remove(cron_job)
+
+        if receiver_cmd not in map(lambda x: x.command, receiver_jobs):
+            cron_job = user_crons.new(command=receiver_cmd)
+            cron_job.setall('* * * * *')
+            if not cron_job.is_valid():
+                raise EnvironmentManagerException("The following cron job is not valid: %s" % cron_job)
+            cron_job.enable()
+        user_crons.write()
+        logging.debug("WAL receiver has been scheduled for %s!" % source_host)
 
-        # Create a temporary directory for tsbak contents
-        backup_temp_dir = os.path.join(tempfile.gettempdir(), "backup")
-        if os.path.exists(backup_temp_dir):
-            logging.debug("Removing existing temporary directory for backup...")
-            shutil.rmtree(backup_temp_dir)
+    # Function to remove WAL receiver jobs and stop the receivers they started
+    def remove_wal_receiver_jobs(self):
+        user_crons = CronTab(user=self.rescue_user)
+        for cron_job in self.__get_wal_receiver_jobs(user_crons):
+            user_crons.remove(cron_job)
+        user_crons.write()
+
+        rescue_dir = self.rescue_dir
+        for process in psutil.process_iter():
+            try:
+                cmdline = " ".join(process.cmdline())
+                if "pg_receivexlog" in cmdline and rescue_dir in cmdline:
+                    logging.debug("Stopping WAL receiver (pid %s)..." % process.pid)
+                    process.terminate()
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+
+    # Function to let the Postgres replica fetch WAL from the archive once the source does not keep it anymore
+    def enable_replica_wal_restore(self, wal_dir):
+        recovery_conf_absolute_path = os.path.join(self.cluster_source_pg_data_dir, "recovery.conf")
+        try:
+            recovery_conf_content, stderr = self.__execute_cmd("cat %s" % recovery_conf_absolute_path,
+                                                               as_unix_pg_user=True)
+        except EnvironmentManagerException, e:
+            logging.debug("Was not able to read %s, not enabling WAL restore: %s" % (recovery_conf_absolute_path, e))
+            return
+
+        restore_command_line = d.RESTORE_COMMAND_CONF.format(wal_dir=wal_dir)
+        recovery_conf_lines = recovery_conf_content.splitlines()
+        if restore_command_line in recovery_conf_lines:
+            logging.debug("The Postgres replica already restores WAL from the archive.")
+            return
+
+        logging.debug("Adding restore_command to %s..." % recovery_conf_absolute_path)
+        recovery_conf_lines = filter(lambda x: not x.strip().startswith("restore_command"), recovery_conf_lines)
+        recovery_conf_lines.append(restore_command_line)
+        self.__execute_cmd("cat > %s" % recovery_conf_absolute_path, as_unix_pg_user=True,
+                           stdin="\n".join(recovery_conf_lines) + "\n")
+
+        # recovery.conf is only read on start
+        self.stop_source_postgres()
+        self.start_source_postgres()
+
+    # Function to create a compressed base backup of the source Tableau Server's Postgres for the WAL archive
+    def archive_base_backup(self, source_host, base_backup_dir, pgpass_file_path):
+        logging.debug("Creating a base backup of %s in %s..." % (source_host, base_backup_dir))
+        backup_cmd = d.PG_ARCHIVE_BASEBACKUP_CMD.format(pg_dir=self.pg_absolute_dir,
+                                                        host=source_host,
+                                                        pg_port=d.REMOTE_PG_PORT,
+                                                        base_backup_dir=base_backup_dir,
+                                                        pg_user=d.REMOTE_PG_USER)
+        if self.basebackup_max_rate is not None:
+            backup_cmd += " --max-rate=%s" % self.basebackup_max_rate
+        self.__execute_cmd(cmd_str=backup_cmd,
+                           env={"LD_LIBRARY_PATH": os.path.join(self.pg_absolute_dir, "lib"),
+                                "PGPASSFILE": pgpass_file_path})
+        logging.debug("Base backup has been successfully created!")
+
+    # Function to restore a base backup in a temporary Postgres instance, recover it to the given point in time
+    # from the WAL archive and dump it
+    def execute_point_in_time_pgdump(self, destination_dir, base_backup_file_path, wal_dir, point_in_time):
+        target_time = time.strftime("%Y-%m-%d %H:%M:%S+00", time.gmtime(point_in_time))
+        logging.info("Recovering Tableau Postgres Repository as of %s..." % target_time)
+
+        restore_dir = self.__make_pg_user_temp_dir(prefix="tableau_dr_pitr_")
+        restore_data_dir = os.path.join(restore_dir, "pitr")
+        restore_pg_port = utils.get_free_port()
+        is_started = False
+        try:
+            self.__execute_cmd("mkdir -m 700 %s" % restore_data_dir, as_unix_pg_user=True)
+            self.__execute_cmd("tar -xzf %s -C %s" % (base_backup_file_path, restore_data_dir), as_unix_pg_user=True)
+            self.__execute_cmd("cat > %s" % os.path.join(restore_data_dir, "postgresql.conf"),
+                               as_unix_pg_user=True,
+                               stdin=d.POSTGRESQL_CONF_CONTENT)
+            self.__execute_cmd("cat > %s" % os.path.join(restore_data_dir, "recovery.conf"),
+                               as_unix_pg_user=True,
+                               stdin=d.PITR_RECOVERY_CONF_CONTENT.format(wal_dir=wal_dir,
+                                                                         target_time=target_time))
+
+            self.__manage_postgres(pg_absolute_dir=self.pg_absolute_dir,
+                                   pg_data_dir=restore_data_dir,
+                                   pg_port=restore_pg_port)
+            is_started = True
 
-        os.makedirs(backup_temp_dir)
+            # Recovery is finished when the instance has been promoted
+            recovery_start_time = time.time()
+            while True:
+                try:
+                    if self.run_pg_query("SELECT pg_is_in_recovery();", port=restore_pg_port)[0][0] == "f":
+                        break
+                except (EnvironmentManagerException, IndexError), e:
+                    logging.debug("Recovering Postgres is not ready yet: %s" % e)
+                if time.time() - recovery_start_time > d.PITR_RECOVERY_TIMEOUT_SEC:
+                    raise EnvironmentManagerException("Recovering Tableau Postgres Repository as of %s has not "
+                                                      "finished in %s seconds!" % (target_time,
+                                                                                   d.PITR_RECOVERY_TIMEOUT_SEC))
+                time.sleep(5)
+
+            # Recovery also ends and promotes when the archive runs out of WAL before the target time
+            replayed_until = self.run_pg_query("SELECT extract(epoch FROM pg_last_xact_replay_timestamp());",
+                                               port=restore_pg_port)[0][0]
+            if replayed_until == "":
+                raise EnvironmentManagerException("No transaction has been replayed from the WAL archive, "
+                                                  "Tableau Postgres Repository could not be recovered as of %s!"
+                                                  % target_time)
+            if float(replayed_until) < point_in_time:
+                logging.warning("The last transaction replayed from the WAL archive has been committed at %s, "
+                                "the WAL archive may not reach %s." % (time.strftime("%Y-%m-%d %H:%M:%S+00",
+                                                                                     time.gmtime(
+                                                                                         float(replayed_until))),
+                                                                       target_time))
+            logging.info("Tableau Postgres Repository has been recovered as of %s!" % target_time)
+
+            self.execute_source_pgdump(destination_dir=destination_dir,
+                                       dump_format="t",
+                                       pg_port=restore_pg_port)
+        finally:
+            if is_started:
+                self.__manage_postgres(pg_absolute_dir=self.pg_absolute_dir,
+                                       pg_data_dir=restore_data_dir,
+                                       start=False,
+                                       pg_port=restore_pg_port)
+            self.__execute_cmd("rm -rf %s" % restore_dir, as_unix_pg_user=True)
+
+    def create_backup(self, point_in_time=None, wal_archive=None):
+        logging.info("Creating backup file...")
+
+        # Create a temporary directory for tsbak contents (unique, so that several rescue groups can back up at once)
+        if not os.path.exists(self.backup_staging_dir):
+            os.makedirs(self.backup_staging_dir)
+        backup_temp_dir = tempfile.mkdtemp(prefix=d.BACKUP_TEMP_DIR_PREFIX, dir=self.backup_staging_dir)
         logging.debug("Temporary directory for backup has been created at %s." % backup_temp_dir)
 
         if not os.path.exists(self.backups_dir):
             logging.debug("Directory for backups (%s) does not exist! Creating it..." % self.backups_dir)
             os.makedirs(self.backups_dir)
 
+        # Creating manifest file
+        manifest_temp_path = os.path.join(backup_temp_dir, "manifest.yml")
+        logging.debug("Creating %s..." % manifest_temp_path)
+        with open(manifest_temp_path, "w") as f:
+            f.write("--- \n:version: \"1.6\"\n")
+            logging.debug("manifest.yaml has been successfully created!")
+
+        # Capture the files of the sync directory while replication into it is fenced, then dump the repository
+        # from the replica paused at the same point
+        coordinator = BackupCoordinator(self)
+        try:
+            replay_location = coordinator.run(capture_function=lambda: self.__capture_sync_files(backup_temp_dir),
+                                              dump_function=lambda: self.__dump_repository(backup_temp_dir,
+                                                                                           point_in_time,
+                                                                                           wal_archive),
+                                              pause_replay=point_in_time is None)
+        except (BackupCoordinatorException, EnvironmentManagerException), e:
+            shutil.rmtree(backup_temp_dir)
+            raise EnvironmentManagerException("Was not able to create a consistent backup: %s" % e)
+        if replay_location is not None:
+            logging.info("The backup is consistent with the repository at WAL location %s." % replay_location)
+
+        timestamp = time.strftime(d.BACKUP_TIMESTAMP_FORMAT)
+        backup_zip_filename = d.BACKUP_FILE_TEMPLATE.format(timestamp=timestamp)
+        backup_zip_abs_path = os.path.join(self.backups_dir, backup_zip_filename)
+        # The archive only gets its name once it is complete, so that a partial one is never listed or restored
+        backup_zip_temp_path = backup_zip_abs_path + ".tmp"
+        logging.debug("Zipping backup file to %s..." % backup_zip_abs_path)
+        zip_command = "7z a -tzip -mx1 %s %s/*" % (backup_zip_temp_path, backup_temp_dir)
+        try:
+            try:
+                with profiler.span("compress_backup", path=backup_zip_abs_path):
+                    self.__execute_cmd(cmd_str=zip_command, capture_bytes=d.CMD_OUTPUT_CAPTURE_BYTES)
+            except OSError:
+                raise EnvironmentManagerException("Seems like you do not have 7z installed!")
+            os.rename(backup_zip_temp_path, backup_zip_abs_path)
+            logging.debug("Zipping has been successful!")
+        finally:
+            if os.path.exists(backup_zip_temp_path):
+                os.remove(backup_zip_temp_path)
+            logging.debug("Removing temporary backup directory...")
+            shutil.rmtree(backup_temp_dir)
+            logging.debug("Successfully removed temporary backup directory")
+
+        logging.info("Backup file (%s) has been successfully created!" % backup_zip_abs_path)
+        return backup_zip_abs_path, replay_location
+
+    # Size of the synced data a backup is made of
+    def sync_data_bytes(self):
+        data_bytes = 0
+        for dir_name in [d.DATAENGINE_DIR, d.WEBDATACONNECTORS_DIR, "config"]:
+            for dir_path, dir_names, file_names in os.walk(os.path.join(self.sync_full_path, dir_name)):
+                for file_name in file_names:
+                    try:
+                        data_bytes += os.lstat(os.path.join(dir_path, file_name)).st_size
+                    except OSError:
+                        continue  # Replaced by replication in the meantime
+        return data_bytes
+
+    # Copy the configuration and take a snapshot of the extracts of the sync directory into a backup
+    def __capture_sync_files(self, backup_temp_dir):
         # Copy tabsvc.yaml to backup temp directory
         tab_config_abs_dir = os.path.join(self.sync_full_path,
                                           "config")
@@ -1265,59 +1765,36 @@ class EnvironmentManager:
                             else:
                                 logging.debug("Not copying %s since it is not present." % copy_from)
 
-        # Creating manifest file
-        manifest_temp_path = os.path.join(backup_temp_dir, "manifest.yml")
-        logging.debug("Creating %s..." % manifest_temp_path)
-        with open(manifest_temp_path, "w") as f:
-            f.write("--- \n:version: \"1.6\"\n")
-            logging.debug("manifest.yaml has been successfully created!")
-
+        # Snapshot the dataengine and webdataconnectors directories. Hardlinks or reflinks only take
+        # metadata operations, and files replaced by the next replication run keep their content in the snapshot.
+        for dir_name, temp_dir_name in [(d.DATAENGINE_DIR, "dataengine"),
+                                        (d.WEBDATACONNECTORS_DIR, "webdataconnectors")]:
+            sync_dir_path = os.path.join(self.sync_full_path, dir_name)
+            temp_dir_path = os.path.join(backup_temp_dir, temp_dir_name)
+            logging.debug("Taking a snapshot of %s at %s..." % (sync_dir_path, temp_dir_path))
+            try:
+                with profiler.span("snapshot_tree", directory=temp_dir_name):
+                    snapshot_tree(sync_dir_path, temp_dir_path, method=self.snapshot_method)
+            except SnapshotException, e:
+                raise EnvironmentManagerException(str(e))
+            logging.debug("Snapshot of %s has been successfully taken!" % temp_dir_name)
+
+    # Dump the repository into a backup, as it is now or as it was at point_in_time
+    def __dump_repository(self, backup_temp_dir, point_in_time, wal_archive):
         # Execute pgdump and pgdump_all and put the resulting files into backup temporary directory
         logging.debug("Executing pgdump and pgdump_all...")
-        self.execute_source_pgdump(destination_dir=backup_temp_dir,
-                                   dump_format="t")
+        with profiler.span("dump_repository", point_in_time=point_in_time is not None):
+            if point_in_time is None:
+                self.execute_source_pgdump(destination_dir=backup_temp_dir,
+                                           dump_format="t")
+            else:
+                base_backup = wal_archive.base_backup_for(point_in_time)
+                self.execute_point_in_time_pgdump(destination_dir=backup_temp_dir,
+                                                  base_backup_file_path=base_backup["file_path"],
+                                                  wal_dir=wal_archive.wal_dir,
+                                                  point_in_time=point_in_time)
         logging.debug("Pgdump and pgdump_all has been successful!")
 
-        # Copy dataengine directory
-        dataengine_abs_path = os.path.join(self.sync_full_path, d.DATAENGINE_DIR)
-        dataengine_temp_path = os.path.join(backup_temp_dir, "dataengine")
-        logging.debug("Copying %s to %s..." % (dataengine_abs_path,
-                                               dataengine_temp_path))
-        shutil.copytree(dataengine_abs_path,
-                        dataengine_temp_path)
-        logging.debug("Dataengine directory has been successfully copied!")
-
-        # Copy webdataconnectors directory
-        webdataconnectors_abs_path = os.path.join(self.sync_full_path, d.WEBDATACONNECTORS_DIR)
-        webdataconnectors_temp_path = os.path.join(backup_temp_dir, "webdataconnectors")
-        logging.debug("Copying %s to %s..." % (webdataconnectors_abs_path,
-                                               webdataconnectors_temp_path))
-        shutil.copytree(webdataconnectors_abs_path,
-                        webdataconnectors_temp_path)
-        logging.debug("Webdataconnectors directory has been successfully copied!")
-
-        # Copy won't be executed if the source dir is empty. Let's ensure that they exist
-        for item in [dataengine_temp_path, webdataconnectors_temp_path]:
-            if not os.path.exists(item):
-                os.makedirs(item)
-
-        timestamp = time.strftime("%Y%m%d%H%M%S")
-        backup_zip_filename = "backup-%s.tsbak" % timestamp
-        backup_zip_abs_path = os.path.join(self.backups_dir, backup_zip_filename)
-        logging.debug("Zipping backup file to %s..." % backup_zip_abs_path)
-        zip_command = "7z a -tzip -mx1 %s %s/*" % (backup_zip_abs_path, backup_temp_dir)
-        try:
-            self.__execute_cmd(cmd_str=zip_command)
-        except OSError:
-            raise EnvironmentManagerException("Seems like you do not have 7z installed!")
-        logging.debug("Zipping has been successful!")
-
-        logging.debug("Removing temporary backup directory...")
-        shutil.rmtree(backup_temp_dir)
-        logging.debug("Successfully removed temporary backup directory")
-
-        logging.info("Backup file (%s) has been successfully created!" % backup_zip_abs_path)
-
     # Remove mount dirs
     def remove_mount_dirs(self):
 
@@ -1404,14 +1881,40 @@ class EnvironmentManager:
                                                           "to store anything in the folders managed by Tableau DR!"
                                                           % mount_dir)
 
-        # Create Samba credential files
         logging.debug("Creating mount points...")
+        for mount_path, mount_cmd in self.__get_mount_cmds(source_server, target_server):
+            if mount_path == self.filestore_temp_mount_dir or os.listdir(mount_path) == []:
+                self.__execute_cmd(mount_cmd)
+
+    # Mount paths of the Tableau Servers' shares by name
+    def get_share_mounts(self):
+        share_mounts = {"source": self.cluster_source_mount_full_path}
+        if self.cluster_target_mount_full_path is not None:
+            share_mounts["target"] = self.cluster_target_mount_full_path
+        if self.tdfs_enabled:
+            share_mounts["filestore_temp"] = self.filestore_temp_mount_dir
+        return share_mounts
+
+    # Unmount a share, even if it does not respond anymore, and mount it again
+    def remount_share(self, mount_path, source_server, target_server=None):
+        mount_cmds = dict(self.__get_mount_cmds(source_server, target_server))
+        if mount_path not in mount_cmds:
+            raise EnvironmentManagerException("%s is not a share managed by Tableau DR!" % mount_path)
+        if len(self.__get_relevant_mount_points(mount_paths=[mount_path])) > 0:
+            logging.debug("Unmounting %s..." % mount_path)
+            self.__execute_cmd(d.UMOUNT_LAZY_CMD.format(mount_abs_path=mount_path))
+        logging.info("Mounting %s again..." % mount_path)
+        self.__execute_cmd(mount_cmds[mount_path])
+
+    # Create the Samba credential files and return the mount command of each share
+    def __get_mount_cmds(self, source_server, target_server=None):
         config_path = os.path.join(os.path.expanduser("~"),
                                    "tableau_dr",
                                    "config")
         if not os.path.exists(config_path):
             os.makedirs(config_path)
 
+        mount_cmds = []
         prod_smb_cred_file_abs_path = os.path.join(config_path, ".smb_credentials_prod")
         smb_cred_prod_content = d.SMB_CREDENTIALS_CONTENT.format(user=source_server.user,
                                                                  password=source_server.password,
@@ -1424,9 +1927,9 @@ class EnvironmentManager:
                                                              cred_file_path=prod_smb_cred_file_abs_path,
                                                              rescue_user=self.rescue_user,
                                                              failover_group=self.rescue_user,
-                                                             rights=mount_rights)
-        if os.listdir(self.cluster_source_mount_full_path) == []:
-            self.__execute_cmd(create_prod_mount_cmd)
+                                                             rights=self.__get_mount_options("source",
+                                                                                             mount_rights))
+        mount_cmds.append((self.cluster_source_mount_full_path, create_prod_mount_cmd))
 
         if target_server is not None:
             dr_smd_cred_file_abs_path = os.path.join(config_path, ".smb_credentials_dr")
@@ -1441,10 +1944,8 @@ class EnvironmentManager:
                                                           cred_file_path=dr_smd_cred_file_abs_path,
                                                           rescue_user=self.rescue_user,
                                                           failover_group=self.rescue_user,
-                                                          rights=mount_rights)
-
-            if os.listdir(self.cluster_target_mount_full_path) == []:
-                self.__execute_cmd(create_dr_mount_cmd)
+                                                          rights=self.__get_mount_options("target", mount_rights))
+            mount_cmds.append((self.cluster_target_mount_full_path, create_dr_mount_cmd))
 
         if self.tdfs_enabled:
             create_filestore_temp_mount_cmd =\
@@ -1452,18 +1953,26 @@ class EnvironmentManager:
                                               mount_abs_path=self.filestore_temp_mount_dir,
                                               cred_file_path=prod_smb_cred_file_abs_path,
                                               rescue_user=self.rescue_user,
-                                              rights="rw")
-            # if not os.path.exists(self.filestore_temp_mount_dir):
-            self.__execute_cmd(create_filestore_temp_mount_cmd)
+                                              rights=self.__get_mount_options("filestore_temp", "rw"))
+            mount_cmds.append((self.filestore_temp_mount_dir, create_filestore_temp_mount_cmd))
+        return mount_cmds
+
+    # Access rights of a share followed by the options of its mount profile
+    def __get_mount_options(self, share_name, mount_rights):
+        profile_options = self.mount_options.get(share_name)
+        return "%s,%s" % (mount_rights, profile_options) if profile_options else mount_rights
 
-    def __manage_postgres(self, pg_absolute_dir, pg_data_dir, start=True):
+    def __manage_postgres(self, pg_absolute_dir, pg_data_dir, start=True, pg_port=None):
         logging.debug("Managing Postgres is in progress...")
 
         operation = "start" if start else "stop"
         logging.debug("Postgres management operation is set to %s." % operation)
+        if not start:
+            self.close_pg_connections()  # A smart shutdown waits for every client to disconnect
         manage_cmd = d.MANAGE_PG_COMMAND.format(pg_dir=pg_absolute_dir,
                                                 operation=operation,
-                                                 pg_data_dir=pg_data_dir,
+                                                pg_data_dir=pg_data_dir,
+                                                pg_port=pg_port if pg_port is not None else self.pg_port,
                                                 pg_data_dir_short=os.path.split(pg_data_dir)[1])
         try:
             self.__execute_cmd(cmd_str=manage_cmd,
@@ -1486,7 +1995,66 @@ class EnvironmentManager:
         # Now we can be pretty certain that the operation was successful
         logging.debug("Postgres %s operation was successful!" % operation)
 
-    def __execute_cmd(self, cmd_str, as_unix_pg_user=False, stdin=None, cwd=None, env=None):
+    # Private temporary directory owned by the Postgres user, e.g. for files holding replication credentials
+    def __make_pg_user_temp_dir(self, prefix, dir=None):
+        temp_dir = tempfile.mkdtemp(prefix=prefix, dir=dir)  # Only accessible by its owner
+        self.__execute_cmd("sudo chown postgresql:postgresql %s" % temp_dir)
+        return temp_dir
+
+    # Execute a command and return its stdout and stderr. Only the last capture_bytes of stdout are kept if given,
+    # and only the end of stderr. While the command is running the lines of stdout are passed to stdout_handler
+    # and the lines of stderr, e.g. its progress, to progress_handler. With stdout_file_path stdout is written
+    # to that file instead of being kept.
+    def __execute_cmd(self, cmd_str, as_unix_pg_user=False, stdin=None, cwd=None, env=None, capture_bytes=None,
+                      stdout_handler=None, progress_handler=None, stdout_file_path=None):
+        with profiler.span("execute_cmd", command=profiler.command_name(cmd_str)):
+            p, cmd_str = self.__start_cmd(cmd_str, as_unix_pg_user=as_unix_pg_user, cwd=cwd, env=env)
+            capture_files = {}
+            if os.environ.get(d.CMD_OUTPUT_ENV_VAR):
+                capture_files = command_output.open_capture_files(d.CMD_OUTPUT_DIR, profiler.command_name(cmd_str))
+            # The file only gets its name once the command has succeeded, a failed one leaves nothing behind
+            stdout_file = open(stdout_file_path + ".tmp", "wb") if stdout_file_path is not None \
+                else capture_files.get("out")
+            try:
+                stdout_buffer = command_output.OutputBuffer(
+                    max_bytes=capture_bytes if stdout_file_path is None else d.CMD_ERROR_OUTPUT_BYTES,
+                    line_handler=stdout_handler,
+                    file_obj=stdout_file)
+                stderr_buffer = command_output.OutputBuffer(max_bytes=d.CMD_OUTPUT_CAPTURE_BYTES,
+                                                            line_handler=progress_handler,
+                                                            file_obj=capture_files.get("err"))
+                returncode = command_output.communicate(p, stdin, stdout_buffer, stderr_buffer)
+            except Exception:
+                if stdout_file_path is not None:
+                    os.remove(stdout_file_path + ".tmp")
+                raise
+            finally:
+                for output_file in set([stdout_file] + capture_files.values()) - set([None]):
+                    output_file.close()
+
+        #logging.warning("SHELL as %s out> %s" % (("postgresql" if as_unix_pg_user else self.rescue_user), stdout))
+        #logging.warning("SHELL as %s err> %s" % (("postgresql" if as_unix_pg_user else self.rescue_user), stderr))
+
+        if stdout_file_path is not None:
+            if returncode == 0:
+                os.rename(stdout_file_path + ".tmp", stdout_file_path)
+            else:
+                os.remove(stdout_file_path + ".tmp")
+
+        if returncode != 0:
+            raise EnvironmentManagerException(
+                "Executing the following command was not successful: %s\nStatus code: %s\nSTDOUT: %s\nSTDERR: %s%s" % (
+                    cmd_str,
+                    returncode,
+                    stdout_buffer.tail(d.CMD_ERROR_OUTPUT_BYTES) if stdout_file_path is None
+                    else "not written to %s" % stdout_file_path,
+                    stderr_buffer.tail(d.CMD_ERROR_OUTPUT_BYTES),
+                    "\nComplete output: %s" % ", ".join(sorted([x.name for x in capture_files.values()]))
+                    if len(capture_files) > 0 else ""))
+
+        return stdout_buffer.getvalue(), stderr_buffer.getvalue()
+
+    def __start_cmd(self, cmd_str, as_unix_pg_user=False, cwd=None, env=None):
 
         def demote(user_uid):
             """Returns a demoter to {user_uid} function for subprocess.Popen(preexec_fn)"""
@@ -1538,20 +2106,64 @@ class EnvironmentManager:
                              cwd=cwd,
                              env=env)
 
-        stdout, stderr = p.communicate(input=stdin)
+        return p, cmd_str
 
-        #logging.warning("SHELL as %s out> %s" % (("postgresql" if as_unix_pg_user else self.rescue_user), stdout))
-        #logging.warning("SHELL as %s err> %s" % (("postgresql" if as_unix_pg_user else self.rescue_user), stderr))
+    def __get_replication_location(self, path):
+        if path.startswith(self.sync_full_path):
+            return "sync"
+        if path.startswith(self.cluster_source_mount_full_path):
+            return "source"
+        if self.cluster_target_mount_full_path is not None and path.startswith(self.cluster_target_mount_full_path):
+            return "target"
+        return "unknown"
 
-        if p.returncode != 0:
-            raise EnvironmentManagerException(
-                "Executing the following command was not successful: %s\nStatus code: %s\nSTDOUT: %s\nSTDERR: %s" % (
-                    cmd_str,
-                    p.returncode,
-                    stdout,
-                    stderr))
+    # Run pg_basebackup from the given Tableau Server, limited to the configured rate and reporting its progress
+    def __run_basebackup(self, tab_host, pg_user, destination_dir, tar_format=False):
+        backup_cmd = d.PG_BASEBACKUP_CMD.format(pg_dir=self.pg_absolute_dir,
+                                                host=tab_host,
+                                                pg_port=8060,
+                                                pg_data_dir=destination_dir,
+                                                pg_user=pg_user)
+        backup_cmd += " --progress"
+        if self.basebackup_max_rate is not None:
+            backup_cmd += " --max-rate=%s" % self.basebackup_max_rate
+        if tar_format:
+            # Postgres 9.5 cannot stream WAL into tar output, the WAL is fetched at the end instead
+            backup_cmd += " --format=tar --gzip --xlog-method=fetch"
+        else:
+            backup_cmd += " --xlog-method=%s" % self.basebackup_wal_method
 
-        return stdout, stderr
+        logging.info("Executing basebackup from %s into %s..." % (tab_host, destination_dir))
+        progress_reporter = utils.ProgressReporter("Basebackup from %s" % tab_host,
+                                                   log_interval_sec=d.PROGRESS_LOG_INTERVAL_SEC)
+        self.__execute_cmd(cmd_str=backup_cmd,
+                           progress_handler=progress_reporter.update_from_basebackup,
+                           as_unix_pg_user=True,
+                           env={"LD_LIBRARY_PATH": os.path.join(self.pg_absolute_dir, "lib")})
+        progress_reporter.finish()
+
+    def __has_pg_data(self, pg_data_dir):
+        try:
+            self.__execute_cmd("ls %s" % os.path.join(pg_data_dir, "PG_VERSION"), as_unix_pg_user=True)
+            return True
+        except EnvironmentManagerException:
+            return False
+
+    def __start_source_backup(self, tab_host):
+        try:
+            self.run_pg_query(d.PG_START_BACKUP_QUERY, host=tab_host, port=d.REMOTE_PG_PORT, user=d.REMOTE_PG_USER)
+        except EnvironmentManagerException, e:
+            if "a backup is already in progress" not in str(e):
+                raise
+            # A previous resync was interrupted before finishing its backup
+            logging.warning("An earlier online backup of %s was not finished, stopping it..." % tab_host)
+            self.run_pg_query(d.PG_STOP_BACKUP_QUERY, host=tab_host, port=d.REMOTE_PG_PORT, user=d.REMOTE_PG_USER)
+            self.run_pg_query(d.PG_START_BACKUP_QUERY, host=tab_host, port=d.REMOTE_PG_PORT, user=d.REMOTE_PG_USER)
+
+    def __get_wal_receiver_jobs(self, crontab):
+        rescue_dir = self.rescue_dir
+        return filter(lambda x: rescue_dir in x.command,
+                      list(crontab.find_command("pg_receivexlog")))
 
     def __get_relevant_rsync_jobs(self, crontab):
         logging.debug("Obtaining relevant cron jobs is in progress...")
@@ -1706,145 +2318,94 @@ class EnvironmentManager:
         pgpass_chmod_cmd = "chmod 600 {pgpass_absolute_path}".format(pgpass_absolute_path = pgpass_absolute_path)
         self.__execute_cmd(pgpass_chmod_cmd, as_unix_pg_user=True)
 
-    # Test connection to remote Postgres
+    # Test connection to local Postgres
     def __test_local_pg_connection(self,
-                                   pg_absolute_dir,
                                    pg_port,
-                                   pg_user,
-                                   pg_database):
+                                   pg_user):
 
         pg_host = "localhost"
         logging.debug("Testing connection to local Postgres at %s:%s" % (pg_host, pg_port))
-        command = "{abs_dir}/bin/psql -h {host} -p {port} -U {user} {database} --no-password".format(abs_dir=pg_absolute_dir,
-                                                                                             host=pg_host,
-                                                                                             port=pg_port,
-                                                                                             user=pg_user,
-                                                                                             database=pg_database)
-        command = d.CMD_AS_PG_USER.format(cmd=command,
-                                          pg_dir=self.pg_absolute_dir)
-
-        #logging.warning("SHELL cmd> %s" % command)
-        psql_proc = subprocess.Popen(shlex.split(command),
-                                     stdin=subprocess.PIPE,
-                                     stdout=subprocess.PIPE,
-                                     stderr=subprocess.PIPE)
-        return_code = psql_proc.poll()
-        if return_code is None:
-            psql_proc.communicate(input="\\q")
-        else:
-            stdout, stderr = psql_proc.communicate()
+        try:
+            self.__pg_query("SELECT 1;", host=pg_host, port=pg_port, user=pg_user)
+        except PgClientException, e:
             raise ValidateEnvironmentException("Wasn't able to connect to local Postgres at %s:%s!\n"
-                                               "Stdout: %s\nStderr:%s" % (pg_host, pg_port, stdout, stderr))
+                                               "Error: %s" % (pg_host, pg_port, e))
 
     # Test connection to remote Postgres
     def __test_source_pg_connection(self,
-                                    pg_absolute_dir,
-                                    pg_host,
                                     pg_port,
                                     pg_user,
-                                    pg_database,
                                     source_server,
                                     target_server=None,
                                     test_replication_role=False):
 
-        if test_replication_role:
-            logging.debug("Testing replication role...")
-            test_cmd = "select rolreplication from pg_roles where rolname = 'tableau'; \\q"
-        else:
-            test_cmd = "\\q"
-
-        logging.debug("Testing connection to Postgres at %s:%s" % (pg_host, pg_port))
         pg_host = source_server.host
-        command = "{abs_dir}/bin/psql -h {host} -p {port} -U {user} {database} --no-password".format(abs_dir=pg_absolute_dir,
-                                                                                             host=pg_host,
-                                                                                             port=pg_port,
-                                                                                             user=pg_user,
-                                                                                             database=pg_database)
-        command = d.CMD_AS_PG_USER.format(cmd=command,
-                                          pg_dir=self.pg_absolute_dir)
-        #logging.warning("SHELL cmd> %s" % command)
-
-        psql_proc = subprocess.Popen(shlex.split(command),
-                                     stdin=subprocess.PIPE,
-                                     stdout=subprocess.PIPE,
-                                     stderr=subprocess.PIPE)
-        return_code = psql_proc.poll()
+        logging.debug("Testing connection to Postgres at %s:%s" % (pg_host, pg_port))
         retry_needed = False  # Boolean to indicate whether retrying to connect to Pg is needed
-        if return_code is None:
-            stdout, stderr = psql_proc.communicate(input=test_cmd)
+        try:
             if test_replication_role:
-                logging.debug("STDOUT: %s\nSTDERR: %s" % (stdout, stderr))
-                repl_role_info = stdout.splitlines()
-                repl_role_info = map(utils.clean_str, repl_role_info)
-                if "f" in repl_role_info:
+                logging.debug("Testing replication role...")
+                repl_role_info = self.__pg_query("SELECT rolreplication FROM pg_roles WHERE rolname = %(rolname)s;",
+                                                 params={"rolname": pg_user},
+                                                 host=pg_host,
+                                                 port=pg_port,
+                                                 user=pg_user)
+                if [["f"]] == repl_role_info:
                     logging.warn("Replication role is not defined for user %s!" % pg_user)
-                    self.__handle_psql_errors(stderr="no replication role",
-                                              tab_server=source_server,
-                                              start_tab_server=True)
-                    if target_server is not None:
-                        self.__handle_psql_errors(stderr="no replication role",
-                                                  tab_server=target_server)
-
-                elif "t" in repl_role_info:
-                    logging.debug("Replication role is defined for user %s!" % pg_user)
-
-                if psql_proc.returncode == 0:
-                    logging.debug("Successfully connected to Postgres at %s:%s" % (pg_host, pg_port))
-                else:
-                    logging.debug("Wasn't able to connect to Postgres at %s:%s!\n"
-                                  "Stdout: %s\nStderr:%s" % (pg_host, pg_port, stdout, stderr))
-                    if "Connection refused" in stderr:
-                        logging.warn(
-                            "Connection refused encountered when attempting to connect to "
-                            "Postgres of Tableau Server at %s!"
-                            "If this is not expected, stop Disaster Recovery and take the necessary steps!" % pg_host)
-                        retry_needed = False
-                    else:
-                        self.__handle_psql_errors(stderr=stderr, tab_server=source_server, start_tab_server=True)
-                        if target_server is not None:
-                            self.__handle_psql_errors(stderr="no replication role",
-                                                      tab_server=target_server)
-                        retry_needed = True
-
-        else:
-            stdout, stderr = psql_proc.communicate()
-            logging.debug("Wasn't able to connect to Postgres at %s:%s!\n"
-                          "Stdout: %s\nStderr:%s" % (pg_host, pg_port, stdout, stderr))
-            self.__handle_psql_errors(stderr=stderr, tab_server=source_server, start_tab_server=True)
-            if target_server is not None:
-                self.__handle_psql_errors(stderr="no replication role",
-                                          tab_server=target_server)
-            retry_needed = True
+                    raise PgClientException("No replication role is defined for user %s!" % pg_user,
+                                            pg_client.NO_REPLICATION_ROLE)
+                logging.debug("Replication role is defined for user %s!" % pg_user)
+            else:
+                self.__pg_query("SELECT 1;", host=pg_host, port=pg_port, user=pg_user)
+            logging.debug("Successfully connected to Postgres at %s:%s" % (pg_host, pg_port))
+        except PgClientException, e:
+            logging.debug("Wasn't able to connect to Postgres at %s:%s! Error: %s" % (pg_host, pg_port, e))
+            if e.error_code == pg_client.CONNECTION_REFUSED:
+                logging.warn(
+                    "Connection refused encountered when attempting to connect to "
+                    "Postgres of Tableau Server at %s!"
+                    "If this is not expected, stop Disaster Recovery and take the necessary steps!" % pg_host)
+            else:
+                self.__handle_pg_error(error_code=e.error_code,
+                                       message=str(e),
+                                       tab_server=source_server,
+                                       start_tab_server=True)
+                if target_server is not None:
+                    self.__handle_pg_error(error_code=pg_client.NO_REPLICATION_ROLE,
+                                           message=str(e),
+                                           tab_server=target_server)
+                retry_needed = True
 
         data_dir_short = os.path.split(self.cluster_source_pg_data_dir)[1]
         log_lines_list = self.__parse_pg_log(data_dir_short)
         if log_lines_list is not None:
             last_line = log_lines_list[-1]
             if "FATAL: no pg_hba.conf entry for replication connection from host" in last_line:
-                self.__handle_psql_errors(stderr="no pg_hba.conf entry for host",
-                                          tab_server=source_server,
-                                          start_tab_server=True)
+                self.__handle_pg_error(error_code=pg_client.NO_HBA_ENTRY,
+                                       message=last_line,
+                                       tab_server=source_server,
+                                       start_tab_server=True)
                 if target_server is not None:
-                    self.__handle_psql_errors(stderr="no replication role",
-                                              tab_server=target_server)
+                    self.__handle_pg_error(error_code=pg_client.NO_REPLICATION_ROLE,
+                                           message=last_line,
+                                           tab_server=target_server)
                 retry_needed = True
 
         return retry_needed
 
-    # Function to handle different psql errors
-    def __handle_psql_errors(self, stderr, tab_server, start_tab_server=False):
-        stderr = str(stderr)
-        if "password authentication failed for user" in stderr:
+    # Function to fix the cause of a failed Postgres connection on Tableau Server
+    def __handle_pg_error(self, error_code, message, tab_server, start_tab_server=False):
+        if error_code == pg_client.AUTHENTICATION_FAILED:
             logging.debug(
                 "Was not able to authenticate as PG user 'tableau'! "
                 "Changing user password...")
             tab_server.change_db_pass("tableau", self.pg_password)
-        elif "no pg_hba.conf entry for host" in stderr:
+        elif error_code == pg_client.NO_HBA_ENTRY:
             logging.debug(
                 "Replication connection is not enabled for user 'tableau'. Enabling it...")
             tab_server.enable_user_replication_connection(pg_user="tableau",
                                                           ip=self.dr_unix_ip)
-        elif "fe_sendauth: no password supplied" in stderr:
+        elif error_code == pg_client.NO_PASSWORD:
             logging.debug(".pgpass does not exist or has invalid content. Modifying it...")
             for db_name in [self.pg_database, "replication"]:
                 self.__modify_pgpass(tab_host=tab_server.host,
@@ -1853,14 +2414,48 @@ class EnvironmentManager:
                                      remote_pg_user="tableau",
                                      remote_pg_password=self.pg_password,
                                      append=True)
-        elif "no replication role" in stderr:
+        elif error_code == pg_client.NO_REPLICATION_ROLE:
             logging.debug("No replication role is provided for 'tableau' user! Adding it...")
             tab_server.stop()
             tab_server.alter_user_role_replication(pg_user="tableau")
             if start_tab_server:
                 tab_server.start()
         else:
-            raise ValidateEnvironmentException("Wasn't able to fix connection to Postgres!\nError: %s" % stderr)
+            raise ValidateEnvironmentException("Wasn't able to fix connection to Postgres!\nError: %s" % message)
+
+    # Run a query in process when psycopg2 is installed, otherwise with psql.
+    # Failures are raised as PgClientException with an error code.
+    def __pg_query(self, query, host, port, user, params=None):
+        if pg_client.is_available():
+            rows = self.__get_pg_pool(host, port, user).query(query, params)
+            return [map(pg_client.to_psql_text, row) for row in rows]
+
+        if params is not None:
+            query = query % dict((k, pg_client.quote_literal(v)) for k, v in params.items())
+        command = d.PSQL_QUERY_COMMAND.format(pg_dir=self.pg_absolute_dir,
+                                              host=host,
+                                              port=port,
+                                              user=user,
+                                              database=self.pg_database)
+        try:
+            stdout, stderr = self.__execute_cmd(command, as_unix_pg_user=True, stdin=query)
+        except EnvironmentManagerException, e:
+            raise PgClientException(str(e), pg_client.classify_error(e))
+        return [line.split("|") for line in stdout.splitlines() if len(line.strip()) > 0]
+
+    def __get_pg_pool(self, host, port, user):
+        with self.__pg_pools_lock:
+            pool_key = (host, int(port), user)
+            if pool_key not in self.__pg_pools:
+                # The replica is a copy of the source Tableau Server's database, so it has the same credentials
+                self.__pg_pools[pool_key] = PgConnectionPool(host=host,
+                                                             port=port,
+                                                             user=user,
+                                                             password=self.pg_password,
+                                                             database=self.pg_database,
+                                                             max_connections=d.PG_POOL_MAX_CONNECTIONS,
+                                                             connect_timeout_sec=d.PG_CONNECT_TIMEOUT_SEC)
+            return self.__pg_pools[pool_key]
 
     # Parsing the tail of PG log
     def __parse_pg_log(self, data_dir):
@@ -0,0 +1,153 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import logging
+import tempfile
+import json
+import time
+import os
+import defaults as d
+from backup_coordinator import ReplicationFence
+
+
+# Custom exception
+class ExtractSeederException(Exception):
+    pass
+
+
+# Size and modification time of every file of a directory tree, keyed by the path relative to the root
+def scan_tree(root_path):
+    state = {}
+    if not os.path.isdir(root_path):
+        return state
+    for dir_path, dir_names, file_names in os.walk(root_path):
+        for file_name in file_names:
+            file_path = os.path.join(dir_path, file_name)
+            try:
+                file_stat = os.lstat(file_path)
+            except OSError:
+                continue  # Removed while walking
+            state[os.path.relpath(file_path, root_path)] = [file_stat.st_size, int(file_stat.st_mtime)]
+    return state
+
+
+# Files to copy because they are missing or differ on the target, files to delete because they are
+# only on the target, and the number of bytes to copy
+def plan_delta(source_state, target_state):
+    to_copy = sorted([x for x in source_state if target_state.get(x) != source_state[x]])
+    to_delete = sorted([x for x in target_state if x not in source_state])
+    return to_copy, to_delete, sum([source_state[x][0] for x in to_copy])
+
+
+# Last known state of the target's directories, written when they have been seeded
+class FileStateIndex:
+
+    # Constructor
+    def __init__(self, index_file_path):
+        self.index_file_path = index_file_path
+
+    def load(self):
+        if not os.path.exists(self.index_file_path):
+            return {}
+        try:
+            with open(self.index_file_path, "r") as f:
+                return json.load(f)
+        except ValueError, e:
+            logging.warning("File state index %s is corrupt, ignoring it: %s" % (self.index_file_path, e))
+            return {}
+
+    def save(self, state):
+        with open(self.index_file_path + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.rename(self.index_file_path + ".tmp", self.index_file_path)
+
+
+# Brings the target Tableau Server's extracts up to date with the sync directory ahead of a restore or
+# switchover, copying only the files that differ
+class ExtractSeeder:
+
+    # Constructor
+    def __init__(self, env_manager, index_file_path, fence_timeout_sec=d.BACKUP_FENCE_TIMEOUT_SEC):
+        self.env_manager = env_manager
+        self.index = FileStateIndex(index_file_path)
+        self.fence_timeout_sec = fence_timeout_sec
+
+    # Seed every replicated directory of the target. With trust_index the target is not scanned,
+    # its state is taken from the index, which is only right if nothing else has written to it since.
+    def seed(self, dry_run=False, trust_index=False):
+        target_root = self.env_manager.cluster_target_mount_full_path
+        if target_root is None:
+            raise ExtractSeederException("Cannot pre-seed the target in a single cluster setting!")
+
+        start_time = time.time()
+        fence = ReplicationFence(self.env_manager.replication_lock_file_paths(target_root), self.fence_timeout_sec)
+        if not dry_run:
+            fence.acquire()  # Replication jobs into the target must not run while it is seeded
+        try:
+            index_state = self.index.load()
+            result = {"dry_run": dry_run, "dirs": {}}
+            for replication_dir in d.REPLICATION_DIRS:
+                source_path = os.path.join(self.env_manager.sync_full_path, replication_dir)
+                target_path = os.path.join(target_root, replication_dir)
+                if trust_index and replication_dir in index_state:
+                    target_state = index_state[replication_dir]
+                else:
+                    target_state = scan_tree(target_path)
+                source_state = scan_tree(source_path)
+
+                to_copy, to_delete, copy_bytes = plan_delta(source_state, target_state)
+                logging.info("Pre-seeding %s: %s of %s files differ (%.1f MB to copy), %s files to delete."
+                             % (target_path, len(to_copy), len(source_state), copy_bytes / 1048576.0,
+                                len(to_delete)))
+                if not dry_run:
+                    self.__copy_files(source_path, target_path, to_copy)
+                    self.__delete_files(target_path, to_delete)
+                    # Files are copied with their modification times, so the target now matches the source
+                    index_state[replication_dir] = source_state
+                    self.index.save(index_state)
+                result["dirs"][replication_dir] = {"files": len(source_state),
+                                                   "files_to_copy": len(to_copy),
+                                                   "files_to_delete": len(to_delete),
+                                                   "bytes_to_copy": copy_bytes}
+        finally:
+            fence.release()
+        result["duration_sec"] = time.time() - start_time
+        return result
+
+    def __copy_files(self, source_path, target_path, relative_paths):
+        if len(relative_paths) == 0:
+            return
+        if not os.path.exists(target_path):
+            os.makedirs(target_path)
+        file_list_fd, file_list_path = tempfile.mkstemp(prefix="preseed", dir=self.env_manager.rescue_dir)
+        try:
+            with os.fdopen(file_list_fd, "w") as f:
+                f.write("\n".join(relative_paths) + "\n")
+            self.env_manager.copy_listed_files(source_path, target_path, file_list_path)
+        finally:
+            os.remove(file_list_path)
+
+    def __delete_files(self, target_path, relative_paths):
+        for relative_path in relative_paths:
+            file_path = os.path.join(target_path, relative_path)
+            try:
+                os.remove(file_path)
+            except OSError, e:
+                if os.path.exists(file_path):
+                    raise ExtractSeederException("Was not able to delete %s from the target: %s" % (file_path, e))
@@ -0,0 +1,414 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import BaseHTTPServer
+import SocketServer
+import xml.etree.ElementTree as ET
+import threading
+import logging
+import socket
+import base64
+import random
+import uuid
+import time
+import re
+
+ACTION_CREATE = "http://schemas.xmlsoap.org/ws/2004/09/transfer/Create"
+ACTION_DELETE = "http://schemas.xmlsoap.org/ws/2004/09/transfer/Delete"
+ACTION_COMMAND = "http://schemas.microsoft.com/wbem/wsman/1/windows/shell/Command"
+ACTION_RECEIVE = "http://schemas.microsoft.com/wbem/wsman/1/windows/shell/Receive"
+ACTION_SIGNAL = "http://schemas.microsoft.com/wbem/wsman/1/windows/shell/Signal"
+COMMAND_STATE_DONE = "http://schemas.microsoft.com/wbem/wsman/1/windows/shell/CommandState/Done"
+COMMAND_STATE_RUNNING = "http://schemas.microsoft.com/wbem/wsman/1/windows/shell/CommandState/Running"
+
+# A Receive that has waited the operation timeout for output is answered with this fault, clients retry it
+OPERATION_TIMEOUT_FAULT_CODE = "2150858793"
+UNKNOWN_FAULT_CODE = "2150858778"
+
+# Failures the server can inject
+FAIL_HTTP_ERROR = "http_error"  # HTTP 500 with a WS-Man fault
+FAIL_AUTH = "auth"  # HTTP 401
+FAIL_OPERATION_TIMEOUT = "operation_timeout"  # Receive answered with the operation timeout fault
+FAIL_HANG = "hang"  # No response for hang_sec, to run into the client's read timeout
+FAILURE_MODES = [FAIL_HTTP_ERROR, FAIL_AUTH, FAIL_OPERATION_TIMEOUT, FAIL_HANG]
+
+ENVELOPE_TEMPLATE = """<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope" \
+xmlns:a="http://schemas.xmlsoap.org/ws/2004/08/addressing" \
+xmlns:x="http://schemas.xmlsoap.org/ws/2004/09/transfer" \
+xmlns:w="http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd" \
+xmlns:rsp="http://schemas.microsoft.com/wbem/wsman/1/windows/shell">\
+<s:Header><a:Action>{action}</a:Action><a:MessageID>uuid:{message_id}</a:MessageID>\
+<a:To>http://schemas.xmlsoap.org/ws/2004/08/addressing/role/anonymous</a:To>\
+<a:RelatesTo>{relates_to}</a:RelatesTo></s:Header><s:Body>{body}</s:Body></s:Envelope>"""
+
+SHELL_CREATED_TEMPLATE = """<x:ResourceCreated><a:Address>http://{address}/wsman</a:Address>\
+<a:ReferenceParameters><w:ResourceURI>http://schemas.microsoft.com/wbem/wsman/1/windows/shell/cmd</w:ResourceURI>\
+<w:SelectorSet><w:Selector Name="ShellId">{shell_id}</w:Selector></w:SelectorSet></a:ReferenceParameters>\
+</x:ResourceCreated><rsp:Shell><rsp:ShellId>{shell_id}</rsp:ShellId></rsp:Shell>"""
+
+FAULT_TEMPLATE = """<s:Fault><s:Code><s:Value>s:Receiver</s:Value></s:Code><s:Reason>\
+<s:Text xml:lang="en-US">{message}</s:Text></s:Reason><s:Detail>\
+<f:WSManFault xmlns:f="http://schemas.microsoft.com/wbem/wsman/1/wsmanfault" Code="{code}" Machine="{address}">\
+<f:Message>{message}</f:Message></f:WSManFault></s:Detail></s:Fault>"""
+
+
+# Custom exception
+class FakeWinRMException(Exception):
+    pass
+
+
+def escape_xml(text):
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+
+
+# Text of the first element of a SOAP message whose tag ends with the given name, None if there is none
+def find_text(root, name):
+    for node in root.iter():
+        if node.tag.endswith("}" + name):
+            return node.text
+    return None
+
+
+def find_attribute(root, name, attribute):
+    for node in root.iter():
+        if node.tag.endswith("}" + name) and node.get(attribute) is not None:
+            return node.get(attribute)
+    return None
+
+
+# Command line of a Command request, PowerShell scripts sent with -encodedcommand are decoded.
+# Returns the command and whether it is a PowerShell script.
+def parse_command_line(command, arguments=None):
+    command_line = " ".join(filter(None, [command, arguments]))
+    match = re.match(r"^powershell(\.exe)? -encodedcommand (\S+)$", command_line.strip(), re.IGNORECASE)
+    if match is not None:
+        return base64.b64decode(match.group(2)).decode("utf_16_le").encode("utf-8"), True
+    return command_line, False
+
+
+# Emulates the commands Tableau DR runs on a Tableau Server: tabadmin status, start, stop and the others,
+# psql.exe, Test-Path, winrm get winrm/config and the small lookups done while connecting
+class TableauStandIn:
+
+    # Constructor
+    def __init__(self, running=True, existing_paths=None, shell_memory_mb=2048, operation_duration_sec=0,
+                 user="tableau_dr", domain="LOGON"):
+        self.running = running
+        self.existing_paths = existing_paths  # Paths Test-Path finds, every path exists if None
+        self.shell_memory_mb = shell_memory_mb
+        self.operation_duration_sec = operation_duration_sec  # Duration of tabadmin start, stop, restore, reindex
+        self.user = user
+        self.domain = domain
+        self.psql_commands = []
+        self.__lock = threading.Lock()
+
+    # (pattern, handler) pairs for FakeWinRMServer, the first pattern found in a command handles it
+    def handlers(self):
+        return [(r"tabadmin\.exe status", self.tabadmin_status),
+                (r"tabadmin\.exe start", self.tabadmin_start),
+                (r"tabadmin\.exe stop", self.tabadmin_stop),
+                (r"tabadmin\.exe (restore|reindex|dbpass)", self.tabadmin_operation),
+                (r"psql\.exe", self.psql),
+                (r"^\$PathExists = Test-Path", self.test_path),
+                (r"^winrm get winrm/config", self.winrm_config),
+                (r"^Get-ExecutionPolicy", lambda command: (0, "RemoteSigned\r\n", "")),
+                (r"^whoami$", lambda command: (0, "%s\\%s\r\n" % (self.domain.lower(), self.user), "")),
+                (r"^echo %systemdrive%$", lambda command: (0, "C:\r\n", "")),
+                (r"^ECHO %Temp%$", lambda command: (0, "C:\\Users\\%s\\AppData\\Local\\Temp\r\n" % self.user, "")),
+                (r"^net session$", lambda command: (2, "", "System error 5 has occurred.\r\nAccess is denied.\r\n"))]
+
+    def tabadmin_status(self, command):
+        with self.__lock:
+            status = "RUNNING" if self.running else "STOPPED"
+        return 0, "Status: %s\r\n" % status, ""
+
+    def tabadmin_start(self, command):
+        with self.__lock:
+            self.running = True
+        return 0, "===== Starting service...\r\n", "", self.operation_duration_sec
+
+    def tabadmin_stop(self, command):
+        with self.__lock:
+            self.running = False
+        return 0, "===== Stopping service...\r\n", "", self.operation_duration_sec
+
+    def tabadmin_operation(self, command):
+        return 0, "", "", self.operation_duration_sec
+
+    def psql(self, command):
+        with self.__lock:
+            self.psql_commands.append(command)
+        return 0, "PG is running\r\n", ""
+
+    def test_path(self, command):
+        path = re.search(r'Test-Path "([^"]*)"', command).group(1)
+        if self.existing_paths is None or path in self.existing_paths:
+            return 0, "", ""
+        return 1, "", ""
+
+    def winrm_config(self, command):
+        return 0, "Config\r\n    Winrs\r\n        MaxMemoryPerShellMB = %s\r\n" % self.shell_memory_mb, ""
+
+
+# WS-Man endpoint speaking enough of the protocol for pywinrm to open shells and run commands in them.
+# Commands are answered by handlers, every request can be delayed by latency_sec and failures can be
+# injected at random with failure_rate or for the next requests with inject_failure().
+class FakeWinRMServer:
+
+    # Constructor
+    def __init__(self, handlers=None, username=None, password=None, latency_sec=0, failure_rate=0,
+                 failure_mode=FAIL_HTTP_ERROR, operation_timeout_sec=1, hang_sec=5, seed=None,
+                 host="127.0.0.1", port=0):
+        if failure_mode not in FAILURE_MODES:
+            raise FakeWinRMException("Unknown failure mode %s! Known modes: %s" % (failure_mode,
+                                                                                  ", ".join(FAILURE_MODES)))
+        self.handlers = [(re.compile(pattern, re.IGNORECASE), handler) for pattern, handler in (handlers or [])]
+        self.credentials = "%s:%s" % (username, password) if username is not None else None
+        self.latency_sec = latency_sec
+        self.failure_rate = failure_rate
+        self.failure_mode = failure_mode
+        self.operation_timeout_sec = operation_timeout_sec
+        self.hang_sec = hang_sec
+        self.host = host
+        self.port = port
+        self.__random = random.Random(seed)
+        self.__lock = threading.Lock()
+        self.__shells = {}  # Shell id -> command id -> command state
+        self.__injected_failures = []  # (mode, action) of the next failures to inject
+        self.__http_server = None
+        self.reset_stats()
+
+    # host:port to connect to, e.g. as the host of a TableauServerConnector
+    def address(self):
+        return "%s:%s" % (self.host, self.port)
+
+    def start(self):
+        self.__http_server = ThreadingHTTPServer((self.host, self.port), WSManRequestHandler)
+        self.__http_server.fake_winrm_server = self
+        self.port = self.__http_server.server_address[1]
+        thread = threading.Thread(target=self.__http_server.serve_forever, name="fake-winrm-%s" % self.port)
+        thread.daemon = True
+        thread.start()
+        logging.debug("Fake WinRM server is listening on %s." % self.address())
+        return self.address()
+
+    def stop(self):
+        if self.__http_server is not None:
+            self.__http_server.shutdown()
+            self.__http_server.close_connections()  # Clients keep their connections open between requests
+            self.__http_server.server_close()
+            self.__http_server = None
+
+    # Fail the next count requests, or the next count requests of an action like ACTION_RECEIVE
+    def inject_failure(self, mode, count=1, action=None):
+        with self.__lock:
+            self.__injected_failures.extend([(mode, action)] * count)
+
+    def stats(self):
+        with self.__lock:
+            return {"requests": self.__requests,
+                    "actions": dict(self.__actions),
+                    "commands": list(self.__commands),
+                    "failures_injected": self.__failures_injected}
+
+    def reset_stats(self):
+        with self.__lock:
+            self.__requests = 0
+            self.__actions = {}
+            self.__commands = []
+            self.__failures_injected = 0
+
+    # Answer a request, returns the HTTP status code and the body of the response
+    def handle(self, authorization, body):
+        if self.latency_sec > 0:
+            time.sleep(self.latency_sec)
+        try:
+            root = ET.fromstring(body)
+        except ET.ParseError, e:
+            return 400, "Malformed request: %s" % e
+        action = find_text(root, "Action")
+        message_id = find_text(root, "MessageID")
+        with self.__lock:
+            self.__requests += 1
+            action_name = (action or "").split("/")[-1]
+            self.__actions[action_name] = self.__actions.get(action_name, 0) + 1
+
+        if self.credentials is not None and \
+                authorization != "Basic %s" % base64.b64encode(self.credentials):
+            return 401, ""
+        failure_mode = self.__next_failure(action)
+        if failure_mode == FAIL_AUTH:
+            return 401, ""
+        elif failure_mode == FAIL_HANG:
+            time.sleep(self.hang_sec)
+        elif failure_mode == FAIL_OPERATION_TIMEOUT and action == ACTION_RECEIVE:
+            return self.__fault(action, message_id, OPERATION_TIMEOUT_FAULT_CODE,
+                                "The WS-Management service cannot complete the operation within the time "
+                                "specified in OperationTimeout.")
+        elif failure_mode is not None:
+            return self.__fault(action, message_id, UNKNOWN_FAULT_CODE, "Injected failure.")
+
+        shell_id = find_text(root, "Selector")
+        if action == ACTION_CREATE:
+            shell_id = str(uuid.uuid4()).upper()
+            with self.__lock:
+                self.__shells[shell_id] = {}
+            return self.__response(action, message_id, SHELL_CREATED_TEMPLATE.format(address=self.address(),
+                                                                                     shell_id=shell_id))
+        with self.__lock:
+            commands = self.__shells.get(shell_id)
+        if commands is None:
+            return self.__fault(action, message_id, UNKNOWN_FAULT_CODE, "The shell %s was not found." % shell_id)
+
+        if action == ACTION_DELETE:
+            with self.__lock:
+                del self.__shells[shell_id]
+            return self.__response(action, message_id, "")
+        elif action == ACTION_COMMAND:
+            command, is_powershell = parse_command_line(find_text(root, "Command") or "", find_text(root, "Arguments"))
+            command_id = str(uuid.uuid4()).upper()
+            commands[command_id] = self.__run(command)
+            return self.__response(action, message_id,
+                                   "<rsp:CommandResponse><rsp:CommandId>%s</rsp:CommandId></rsp:CommandResponse>"
+                                   % command_id)
+        elif action == ACTION_RECEIVE:
+            command_id = find_attribute(root, "DesiredStream", "CommandId")
+            if command_id not in commands:
+                return self.__fault(action, message_id, UNKNOWN_FAULT_CODE, "The command was not found.")
+            return self.__receive(action, message_id, command_id, commands[command_id],
+                                  find_text(root, "OperationTimeout"))
+        elif action == ACTION_SIGNAL:
+            commands.pop(find_attribute(root, "Signal", "CommandId"), None)
+            return self.__response(action, message_id, "<rsp:SignalResponse/>")
+        return self.__fault(action, message_id, UNKNOWN_FAULT_CODE, "Unsupported action %s." % action)
+
+    def __next_failure(self, action):
+        with self.__lock:
+            for i, (mode, failure_action) in enumerate(self.__injected_failures):
+                if failure_action is None or failure_action == action:
+                    del self.__injected_failures[i]
+                    self.__failures_injected += 1
+                    return mode
+            if self.failure_rate > 0 and self.__random.random() < self.failure_rate:
+                self.__failures_injected += 1
+                return self.failure_mode
+        return None
+
+    # Run a command through the first handler matching it, commands without a handler succeed without output
+    def __run(self, command):
+        with self.__lock:
+            self.__commands.append(command)
+        result = (0, "", "")
+        for pattern, handler in self.handlers:
+            if pattern.search(command):
+                result = handler(command)
+                break
+        exit_code, stdout, stderr, duration_sec = tuple(result) + (0,) * (4 - len(result))
+        return {"exit_code": exit_code,
+                "stdout": stdout,
+                "stderr": stderr,
+                "done_time": time.time() + duration_sec}
+
+    # Output of a command once it is done. A command running longer than the operation timeout is answered
+    # with the operation timeout fault, the client asks again.
+    def __receive(self, action, message_id, command_id, command_state, operation_timeout):
+        timeout_sec = self.operation_timeout_sec
+        match = re.match(r"PT(\d+(\.\d+)?)S", operation_timeout or "")
+        if match is not None:
+            timeout_sec = min(timeout_sec, float(match.group(1)))
+        remaining_sec = command_state["done_time"] - time.time()
+        if remaining_sec > timeout_sec:
+            time.sleep(timeout_sec)
+            return self.__fault(action, message_id, OPERATION_TIMEOUT_FAULT_CODE,
+                                "The WS-Management service cannot complete the operation within the time "
+                                "specified in OperationTimeout.")
+        if remaining_sec > 0:
+            time.sleep(remaining_sec)
+        streams = "".join(['<rsp:Stream Name="%s" CommandId="%s">%s</rsp:Stream>'
+                           '<rsp:Stream Name="%s" CommandId="%s" End="true"></rsp:Stream>'
+                           % (name, command_id, base64.b64encode(command_state[name]), name, command_id)
+                           for name in ["stdout", "stderr"]])
+        return self.__response(action, message_id,
+                               '<rsp:ReceiveResponse>%s<rsp:CommandState CommandId="%s" State="%s">'
+                               '<rsp:ExitCode>%s</rsp:ExitCode></rsp:CommandState></rsp:ReceiveResponse>'
+                               % (streams, command_id, COMMAND_STATE_DONE, command_state["exit_code"]))
+
+    def __response(self, action, message_id, body):
+        return 200, ENVELOPE_TEMPLATE.format(action=(action or "") + "Response",
+                                             message_id=str(uuid.uuid4()).upper(),
+                                             relates_to=message_id or "",
+                                             body=body)
+
+    def __fault(self, action, message_id, code, message):
+        return 500, ENVELOPE_TEMPLATE.format(action="http://schemas.dmtf.org/wbem/wsman/1/wsman/fault",
+                                             message_id=str(uuid.uuid4()).upper(),
+                                             relates_to=message_id or "",
+                                             body=FAULT_TEMPLATE.format(code=code,
+                                                                        message=escape_xml(message),
+                                                                        address=self.address()))
+
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    # Constructor
+    def __init__(self, server_address, request_handler_class):
+        BaseHTTPServer.HTTPServer.__init__(self, server_address, request_handler_class)
+        self.open_connections = set()
+        self.open_connections_lock = threading.Lock()
+
+    def close_connections(self):
+        with self.open_connections_lock:
+            for connection in self.open_connections:
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+
+
+class WSManRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"  # pywinrm keeps its connection open between requests
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        with self.server.open_connections_lock:
+            self.server.open_connections.add(self.connection)
+
+    def finish(self):
+        with self.server.open_connections_lock:
+            self.server.open_connections.discard(self.connection)
+        try:
+            BaseHTTPServer.BaseHTTPRequestHandler.finish(self)
+        except socket.error:
+            pass  # The connection has been closed by stop()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.getheader("Content-Length") or 0))
+        status, response_body = self.server.fake_winrm_server.handle(self.headers.getheader("Authorization"), body)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/soap+xml;charset=UTF-8")
+        self.send_header("Content-Length", str(len(response_body)))
+        if status == 401:
+            self.send_header("WWW-Authenticate", "Basic realm=\"WSMAN\"")
+        self.end_headers()
+        self.wfile.write(response_body)
+
+    def log_message(self, format, *args):
+        logging.debug("Fake WinRM server: %s" % (format % args))
@@ -0,0 +1,97 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import time
+import os
+import defaults as d
+
+
+# Walk a directory tree, stat every entry and measure how many entries are scanned per second.
+# The walk stops after time_limit_sec, the files found are returned with their sizes.
+def measure_directory_walk(root_path, time_limit_sec):
+    start_time = time.time()
+    entries = 0
+    files = []
+    for dir_path, dir_names, file_names in os.walk(root_path):
+        for entry_name in dir_names + file_names:
+            entry_path = os.path.join(dir_path, entry_name)
+            try:
+                entry_stat = os.lstat(entry_path)
+            except OSError:
+                continue
+            entries += 1
+            if entry_name in file_names:
+                files.append((entry_path, entry_stat.st_size))
+        if time.time() - start_time >= time_limit_sec:
+            break
+    elapsed_sec = max(time.time() - start_time, 0.001)
+    return {"entries": entries,
+            "elapsed_sec": elapsed_sec,
+            "entries_per_sec": entries / elapsed_sec,
+            "files": files}
+
+
+# Read the largest files sequentially and measure the throughput in MB/s, None if there is nothing to read.
+# Files read recently may be served from the page cache, so the largest files are preferred.
+def measure_sequential_read(files, max_bytes, time_limit_sec, chunk_bytes=1048576):
+    start_time = time.time()
+    read_bytes = 0
+    for file_path, file_size in sorted(files, key=lambda x: x[1], reverse=True):
+        if file_size == 0:
+            break
+        try:
+            with open(file_path, "rb") as f:
+                while read_bytes < max_bytes and time.time() - start_time < time_limit_sec:
+                    chunk = f.read(chunk_bytes)
+                    if not chunk:
+                        break
+                    read_bytes += len(chunk)
+        except IOError, e:
+            logging.debug("Was not able to read %s: %s" % (file_path, e))
+            continue
+        if read_bytes >= max_bytes or time.time() - start_time >= time_limit_sec:
+            break
+    if read_bytes == 0:
+        return None
+    return read_bytes / 1048576.0 / max(time.time() - start_time, 0.001)
+
+
+# Profile to mount a share with: replicating it is either dominated by copying data or by scanning its tree.
+# The time each takes is estimated from the sample of the tree that has been walked.
+def recommend_profile(walk_result, read_mbps):
+    if walk_result["entries"] == 0 or read_mbps is None:
+        return None
+    sample_mb = sum([x[1] for x in walk_result["files"]]) / 1048576.0
+    copy_time_sec = sample_mb / read_mbps
+    scan_time_sec = walk_result["entries"] / walk_result["entries_per_sec"]
+    return "bulk-copy" if copy_time_sec >= scan_time_sec else "metadata-heavy"
+
+
+# Measure the directory walk and sequential read speed of a mounted share and recommend a mount profile
+def benchmark_mount(mount_path,
+                    time_limit_sec=d.MOUNT_BENCHMARK_TIME_LIMIT_SEC,
+                    max_read_bytes=d.MOUNT_BENCHMARK_MAX_READ_BYTES):
+    logging.info("Benchmarking %s..." % mount_path)
+    walk_result = measure_directory_walk(mount_path, time_limit_sec)
+    read_mbps = measure_sequential_read(walk_result["files"], max_read_bytes, time_limit_sec)
+    return {"path": mount_path,
+            "entries": walk_result["entries"],
+            "entries_per_sec": round(walk_result["entries_per_sec"], 1),
+            "read_mbps": round(read_mbps, 1) if read_mbps is not None else None,
+            "recommended_profile": recommend_profile(walk_result, read_mbps)}
@@ -0,0 +1,144 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import subprocess
+import threading
+import time
+import psutil
+import defaults as d
+
+# Health states of a mounted share
+MOUNT_OK = "ok"
+MOUNT_NOT_MOUNTED = "not_mounted"
+MOUNT_EMPTY = "empty"
+MOUNT_FAILED = "failed"
+MOUNT_HUNG = "hung"
+
+
+# Custom exception
+class MountManagerException(Exception):
+    pass
+
+
+# Run a command without waiting longer than timeout_sec for it, the return code is None on timeout.
+# A process blocked on a dead CIFS mount may not even die when it is killed, so it is not waited for.
+def run_with_timeout(args, timeout_sec):
+    p = subprocess.Popen(args,
+                         stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE,
+                         close_fds=True)
+    deadline = time.time() + timeout_sec
+    while p.poll() is None:
+        if time.time() >= deadline:
+            try:
+                p.kill()
+            except OSError:
+                pass
+            return None, "", "No response within %s seconds" % timeout_sec
+        time.sleep(0.05)
+    stdout, stderr = p.communicate()
+    return p.returncode, stdout, stderr
+
+
+# Check that a share is mounted and responds by listing it in a subprocess
+def probe_mount(mount_path, timeout_sec):
+    result = {"path": mount_path,
+              "state": MOUNT_OK,
+              "latency_ms": None,
+              "error": None,
+              "timestamp": time.time()}
+    if mount_path not in [item.mountpoint for item in psutil.disk_partitions(all=True)]:
+        result["state"] = MOUNT_NOT_MOUNTED
+        return result
+
+    start_time = time.time()
+    returncode, stdout, stderr = run_with_timeout(["ls", "-A", mount_path], timeout_sec)
+    if returncode is None:
+        result["state"] = MOUNT_HUNG
+        result["error"] = stderr
+    elif returncode != 0:
+        result["state"] = MOUNT_FAILED
+        result["error"] = stderr.strip()
+    else:
+        result["latency_ms"] = (time.time() - start_time) * 1000
+        if len(stdout.strip()) == 0:
+            result["state"] = MOUNT_EMPTY
+    return result
+
+
+# Probes the shares of the Tableau Servers and remounts the ones that are not responding
+class MountManager:
+
+    # Constructor
+    def __init__(self, mounts, remount_function,
+                 probe_timeout_sec=d.MOUNT_PROBE_TIMEOUT_SEC,
+                 max_remount_attempts=d.MOUNT_MAX_REMOUNT_ATTEMPTS):
+        logging.debug("Mount manager is being initialized for %s!" % mounts)
+        self.mounts = mounts  # Name of the share -> mount path
+        self.remount_function = remount_function
+        self.probe_timeout_sec = probe_timeout_sec
+        self.max_remount_attempts = max_remount_attempts
+        self.__health = {}  # Name of the share -> result of its last probe
+        self.__health_lock = threading.Lock()
+        self.__remount_lock = threading.Lock()  # A share is only remounted by one thread at a time
+
+    # Probe every share and return their health
+    def probe(self):
+        for name in sorted(self.mounts.keys()):
+            self.__probe(name)
+        return self.health()
+
+    # Result of the last probe of every share
+    def health(self):
+        with self.__health_lock:
+            return dict(self.__health)
+
+    # Latency of a share at its last probe in milliseconds, None if it is unknown or the share is not healthy
+    def latency_ms(self, name):
+        with self.__health_lock:
+            result = self.__health.get(name)
+        return result["latency_ms"] if result is not None and result["state"] == MOUNT_OK else None
+
+    # Probe the shares and remount those that are not healthy, fail if any of them stays unhealthy
+    def ensure_healthy(self, names=None):
+        with self.__remount_lock:
+            for name in sorted(names if names is not None else self.mounts.keys()):
+                result = self.__probe(name)
+                attempt = 0
+                while result["state"] != MOUNT_OK and attempt < self.max_remount_attempts:
+                    attempt += 1
+                    logging.warning("Share %s (%s) is %s, remounting it (%s/%s)..."
+                                    % (name, result["path"], result["state"], attempt, self.max_remount_attempts))
+                    try:
+                        self.remount_function(result["path"])
+                    except Exception, e:
+                        logging.warning("Remounting %s has failed: %s" % (result["path"], e))
+                    result = self.__probe(name)
+
+                if result["state"] != MOUNT_OK:
+                    raise MountManagerException("Share %s (%s) is %s%s!"
+                                                % (name, result["path"], result["state"],
+                                                   ": %s" % result["error"] if result["error"] else ""))
+                logging.debug("Share %s responds in %.1f ms." % (name, result["latency_ms"]))
+
+    def __probe(self, name):
+        result = probe_mount(self.mounts[name], self.probe_timeout_sec)
+        with self.__health_lock:
+            self.__health[name] = result
+        return result
@@ -0,0 +1,110 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import platform
+import hashlib
+import json
+import time
+import os
+
+
+# Custom exception
+class PgBundleException(Exception):
+    pass
+
+
+# Postgres version matching the one bundled with the given Tableau Server version
+def postgres_version_for_tableau(tableau_version, version_matrix):
+    tableau_major_minor = ".".join(str(tableau_version).split(".")[:2])
+    if tableau_major_minor not in version_matrix:
+        raise PgBundleException("No Postgres version is known for Tableau Server %s! Known versions: %s"
+                                % (tableau_version, ", ".join(sorted(version_matrix.keys()))))
+    return version_matrix[tableau_major_minor]
+
+
+# Major version of a Postgres version, replication only works between servers of the same major version
+def postgres_major_version(pg_version):
+    version_parts = str(pg_version).split()[0].split(".")
+    if int(version_parts[0]) >= 10:
+        return version_parts[0]
+    return ".".join(version_parts[:2])
+
+
+# Distribution and architecture the Postgres binaries are built for
+def platform_id():
+    distname, version, id = platform.linux_distribution()
+    return "%s-%s-%s" % (distname.strip().lower().replace(" ", "_"), version.split(".")[0], platform.machine())
+
+
+# Key of a Postgres build: the same version, configure flags and platform give the same binaries.
+# The installation prefix is not part of the key, as Postgres finds its libraries and share files
+# relative to its binaries.
+def bundle_key(version, build_procedure, platform_name):
+    build_str = "\n".join([version, platform_name] + list(build_procedure))
+    return hashlib.sha1(build_str).hexdigest()[:12]
+
+
+def bundle_file_name(version, key):
+    return "postgresql-%s-%s.tar.gz" % (version, key)
+
+
+# Directory of compiled Postgres trees packaged as tar.gz files, keyed by version and build flags
+class PgBundleCache:
+
+    # Constructor
+    def __init__(self, bundle_dir, version, build_procedure):
+        self.bundle_dir = bundle_dir
+        self.version = version
+        self.build_procedure = build_procedure
+        self.key = bundle_key(version, build_procedure, platform_id())
+        self.bundle_path = os.path.join(bundle_dir, bundle_file_name(version, self.key))
+        self.manifest_path = self.bundle_path + ".json"
+        logging.debug("Postgres bundle for this build: %s" % self.bundle_path)
+
+    # Path of the bundle of this build if it has been packaged before
+    def find(self):
+        if os.path.exists(self.bundle_path) and os.path.exists(self.manifest_path):
+            return self.bundle_path
+        return None
+
+    # Path to package the bundle into before it is published with publish()
+    def temp_path(self):
+        if not os.path.exists(self.bundle_dir):
+            os.makedirs(self.bundle_dir)
+        return self.bundle_path + ".tmp"
+
+    # Make a packaged bundle available to later installs
+    def publish(self, temp_path):
+        if not os.path.exists(temp_path) or os.path.getsize(temp_path) == 0:
+            raise PgBundleException("Postgres bundle %s is missing or empty!" % temp_path)
+        os.rename(temp_path, self.bundle_path)
+        # The manifest is written last, a bundle without it is not used
+        with open(self.manifest_path + ".tmp", "w") as f:
+            json.dump({"version": self.version,
+                       "build_procedure": list(self.build_procedure),
+                       "platform": platform_id(),
+                       "created": time.time()}, f)
+        os.rename(self.manifest_path + ".tmp", self.manifest_path)
+        logging.info("Postgres %s has been packaged into %s!" % (self.version, self.bundle_path))
+
+    # Forget a bundle that could not be installed, so that the next install builds Postgres again
+    def discard(self):
+        for file_path in [self.manifest_path, self.bundle_path]:
+            if os.path.exists(file_path):
+                os.remove(file_path)
@@ -0,0 +1,167 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import threading
+import Queue
+
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None  # Queries fall back to psql
+
+# Error codes of failed Postgres connections and queries
+CONNECTION_REFUSED = "connection_refused"
+AUTHENTICATION_FAILED = "authentication_failed"
+NO_HBA_ENTRY = "no_hba_entry"
+NO_PASSWORD = "no_password"
+NO_REPLICATION_ROLE = "no_replication_role"
+UNKNOWN_ERROR = "unknown_error"
+
+# SQLSTATE codes reported by the server
+SQLSTATE_ERROR_CODES = {"28P01": AUTHENTICATION_FAILED,
+                        "28000": NO_HBA_ENTRY}
+
+# libpq reports connection failures without a SQLSTATE, only with a message
+MESSAGE_ERROR_CODES = [("Connection refused", CONNECTION_REFUSED),
+                       ("password authentication failed for user", AUTHENTICATION_FAILED),
+                       ("no pg_hba.conf entry for", NO_HBA_ENTRY),
+                       ("no password supplied", NO_PASSWORD)]
+
+
+# Custom exception
+class PgClientException(Exception):
+
+    def __init__(self, message, error_code=UNKNOWN_ERROR):
+        Exception.__init__(self, message)
+        self.error_code = error_code
+
+
+# Error code of a failed connection or query from its SQLSTATE or, lacking that, its message
+def classify_error(message, sqlstate=None):
+    if sqlstate in SQLSTATE_ERROR_CODES:
+        return SQLSTATE_ERROR_CODES[sqlstate]
+    for message_part, error_code in MESSAGE_ERROR_CODES:
+        if message_part in str(message):
+            return error_code
+    return UNKNOWN_ERROR
+
+
+# Whether the in-process client can be used
+def is_available():
+    return psycopg2 is not None
+
+
+# SQL literal of a parameter, used when a query with parameters is run by psql
+def quote_literal(value):
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, long, float)):
+        return str(value)
+    return "'%s'" % str(value).replace("'", "''")
+
+
+# Text of a value as psql prints it in unaligned mode
+def to_psql_text(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return str(value)
+
+
+# Small pool of connections to one Postgres endpoint
+class PgConnectionPool:
+
+    # Constructor
+    def __init__(self, host, port, user, password, database, max_connections, connect_timeout_sec):
+        logging.debug("Postgres connection pool for %s@%s:%s is being initialized!" % (user, host, port))
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.database = database
+        self.connect_timeout_sec = connect_timeout_sec
+        self.__idle_connections = Queue.LifoQueue()
+        self.__connection_slots = threading.BoundedSemaphore(max_connections)
+
+    # Run a query with parameters in %(name)s style and return the rows of its result
+    def query(self, query, params=None):
+        self.__connection_slots.acquire()
+        try:
+            connection = self.__get_idle_connection()
+            if connection is not None:
+                try:
+                    return self.__execute(connection, query, params)
+                except PgClientException, e:
+                    if connection.closed == 0:
+                        raise
+                    # The server has closed an idle connection, e.g. after a restart
+                    logging.debug("Pooled connection to %s:%s is broken, reconnecting: %s" % (self.host,
+                                                                                              self.port,
+                                                                                              e))
+            return self.__execute(self.__connect(), query, params)
+        finally:
+            self.__connection_slots.release()
+
+    def close(self):
+        connection = self.__get_idle_connection()
+        while connection is not None:
+            connection.close()
+            connection = self.__get_idle_connection()
+
+    def __get_idle_connection(self):
+        try:
+            return self.__idle_connections.get_nowait()
+        except Queue.Empty:
+            return None
+
+    def __connect(self):
+        try:
+            connection = psycopg2.connect(host=self.host,
+                                          port=self.port,
+                                          user=self.user,
+                                          password=self.password,
+                                          dbname=self.database,
+                                          connect_timeout=self.connect_timeout_sec)
+        except psycopg2.Error, e:
+            raise PgClientException("Was not able to connect to Postgres at %s:%s as %s: %s"
+                                    % (self.host, self.port, self.user, str(e).strip()),
+                                    classify_error(e, e.pgcode))
+        connection.autocommit = True
+        return connection
+
+    def __execute(self, connection, query, params):
+        try:
+            cursor = connection.cursor()
+            try:
+                cursor.execute(query, params)
+                rows = cursor.fetchall() if cursor.description is not None else []
+            finally:
+                cursor.close()
+        except psycopg2.Error, e:
+            if connection.closed == 0:
+                self.__idle_connections.put(connection)
+            raise PgClientException("Query on Postgres at %s:%s has failed: %s" % (self.host,
+                                                                                   self.port,
+                                                                                   str(e).strip()),
+                                    classify_error(e, e.pgcode))
+        self.__idle_connections.put(connection)
+        return rows
@@ -0,0 +1,182 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+from contextlib import contextmanager
+import threading
+import logging
+import atexit
+import json
+import time
+import sys
+import os
+import re
+import defaults as d
+
+# Tokens of a command line that do not name the program it runs
+COMMAND_PREFIX_TOKENS = ["sudo", "sh", "bash", "-c", "env", "nohup"]
+
+active_profiler = None  # Profiler of this process while profiling is enabled
+
+
+# Custom exception
+class ProfilerException(Exception):
+    pass
+
+
+# Name of the program a command runs, e.g. pg_dump or tabadmin. Command lines may hold passwords,
+# so only this name is recorded with a span.
+def command_name(cmd_str):
+    match = re.search(r"([\w-]+)\.exe\b", cmd_str) or re.search(r"\b([A-Z][a-z]+-[A-Z][A-Za-z]+)\b", cmd_str)
+    if match is not None:
+        return match.group(1)
+    for token in cmd_str.split():
+        if token not in COMMAND_PREFIX_TOKENS and "=" not in token and not token.startswith("-"):
+            return os.path.basename(token.strip("'\""))
+    return "unknown"
+
+
+# Stack of a frame in the folded format of flamegraph.pl and speedscope: frames from the root, separated by ;
+def folded_stack(thread_name, frame):
+    frames = []
+    while frame is not None:
+        frames.append("%s:%s" % (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name))
+        frame = frame.f_back
+    frames.append(thread_name)
+    return ";".join([x.replace(";", ":").replace(" ", "_") for x in reversed(frames)])
+
+
+# Records timing spans of the slow operations and samples the stacks of every thread at a fixed interval.
+# Sampling takes the stacks of the Python threads, so a thread waiting for a command is sampled as well.
+class Profiler:
+
+    # Constructor
+    def __init__(self, sample_interval_sec=d.PROFILE_SAMPLE_INTERVAL_SEC, max_trace_events=d.PROFILE_MAX_TRACE_EVENTS):
+        self.sample_interval_sec = sample_interval_sec
+        self.max_trace_events = max_trace_events
+        self.start_time = time.time()
+        self.dropped_events = 0
+        self.__events = []
+        self.__stacks = {}  # Folded stack -> number of samples
+        self.__thread_names = {}  # Thread id -> name
+        self.__lock = threading.Lock()
+        self.__stop_event = threading.Event()
+        self.__sampler_thread = None
+
+    def start(self):
+        self.__sampler_thread = threading.Thread(target=self.__sample_periodically, name="profiler")
+        self.__sampler_thread.daemon = True
+        self.__sampler_thread.start()
+
+    def stop(self):
+        self.__stop_event.set()
+        if self.__sampler_thread is not None:
+            self.__sampler_thread.join()
+
+    def add_span(self, name, start_time, end_time, args=None):
+        thread = threading.current_thread()
+        with self.__lock:
+            if len(self.__events) >= self.max_trace_events:
+                self.dropped_events += 1
+                return
+            self.__thread_names[thread.ident] = thread.name
+            self.__events.append({"name": name,
+                                  "cat": "tableau_dr",
+                                  "ph": "X",
+                                  "ts": int((start_time - self.start_time) * 1000000),
+                                  "dur": int((end_time - start_time) * 1000000),
+                                  "pid": os.getpid(),
+                                  "tid": thread.ident,
+                                  "args": args or {}})
+
+    # Take one sample of the stack of every thread but the sampler's
+    def sample(self):
+        thread_names = dict([(x.ident, x.name) for x in threading.enumerate()])
+        current_thread_id = threading.current_thread().ident
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == current_thread_id:
+                continue
+            stack = folded_stack(thread_names.get(thread_id, str(thread_id)), frame)
+            with self.__lock:
+                self.__stacks[stack] = self.__stacks.get(stack, 0) + 1
+
+    # Span trace in the Chrome trace format, it can be opened with chrome://tracing or Perfetto
+    def trace(self):
+        with self.__lock:
+            metadata_events = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": thread_id,
+                                "args": {"name": thread_name}}
+                               for thread_id, thread_name in self.__thread_names.items()]
+            return {"traceEvents": metadata_events + list(self.__events),
+                    "displayTimeUnit": "ms",
+                    "otherData": {"start_time": self.start_time, "dropped_events": self.dropped_events}}
+
+    # Sampled stacks in the folded format, one "stack count" line per stack
+    def folded_stacks(self):
+        with self.__lock:
+            return "".join(["%s %d\n" % (stack, count) for stack, count in sorted(self.__stacks.items())])
+
+    # Write the span trace and the sampled stacks into output_dir, returns their paths
+    def write(self, output_dir):
+        timestamp = time.strftime(d.BACKUP_TIMESTAMP_FORMAT, time.localtime(self.start_time))
+        trace_file_path = os.path.join(output_dir, d.PROFILE_TRACE_FILE.format(timestamp=timestamp, pid=os.getpid()))
+        with open(trace_file_path, "w") as f:
+            json.dump(self.trace(), f)
+        stacks_file_path = os.path.join(output_dir, d.PROFILE_STACKS_FILE.format(timestamp=timestamp,
+                                                                                 pid=os.getpid()))
+        with open(stacks_file_path, "w") as f:
+            f.write(self.folded_stacks())
+        return trace_file_path, stacks_file_path
+
+    def __sample_periodically(self):
+        while not self.__stop_event.wait(self.sample_interval_sec):
+            self.sample()
+
+
+# Start profiling this process, the results are written into output_dir when it exits
+def start(output_dir, sample_interval_sec=d.PROFILE_SAMPLE_INTERVAL_SEC):
+    global active_profiler
+    if active_profiler is not None:
+        raise ProfilerException("Profiling has already been started!")
+    active_profiler = Profiler(sample_interval_sec=sample_interval_sec)
+    active_profiler.start()
+    atexit.register(stop, output_dir)
+    logging.debug("Profiling is enabled, the results are written to %s on exit." % output_dir)
+
+
+def stop(output_dir):
+    global active_profiler
+    if active_profiler is None:
+        return
+    profiler, active_profiler = active_profiler, None
+    profiler.stop()
+    trace_file_path, stacks_file_path = profiler.write(output_dir)
+    logging.info("Profile has been written to %s and %s." % (trace_file_path, stacks_file_path))
+
+
+# Time the enclosed block as a span of the trace. Without profiling this is close to free.
+@contextmanager
+def span(name, **args):
+    profiler = active_profiler
+    if profiler is None:
+        yield
+        return
+    start_time = time.time()
+    try:
+        yield
+    finally:
+        profiler.add_span(name, start_time, time.time(), args)
@@ -0,0 +1,203 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import threading
+import json
+import time
+import os
+import defaults as d
+
+STANDBY_QUERY = "SELECT pg_is_in_recovery(), pg_last_xlog_receive_location(), pg_last_xlog_replay_location(), " \
+                "EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp());"
+PRIMARY_QUERY = "SELECT pg_current_xlog_location(), current_setting('wal_keep_segments'), " \
+                "(SELECT state FROM pg_stat_replication WHERE client_addr = %(dr_ip)s::inet LIMIT 1);"
+
+
+# Custom exception
+class ReplicaMonitorException(Exception):
+    pass
+
+
+# Convert a WAL location like 16/B374D848 to a byte position
+def wal_location_to_bytes(wal_location):
+    if not wal_location:
+        return None
+    high, low = wal_location.split("/")
+    return (int(high, 16) << 32) + int(low, 16)
+
+
+# Data loss exposure of the replica: WAL not yet received and how old the last replayed transaction is
+def replication_lag(primary_location, receive_location, replay_location, replay_age_sec):
+    primary_bytes = wal_location_to_bytes(primary_location)
+    receive_bytes = wal_location_to_bytes(receive_location)
+    replay_bytes = wal_location_to_bytes(replay_location)
+    lag = {"receive_lag_bytes": None,
+           "replay_lag_bytes": None,
+           "replay_lag_sec": None}
+    if primary_bytes is None:
+        return lag
+    if receive_bytes is not None:
+        lag["receive_lag_bytes"] = max(primary_bytes - receive_bytes, 0)
+    if replay_bytes is not None:
+        lag["replay_lag_bytes"] = max(primary_bytes - replay_bytes, 0)
+        if replay_bytes >= primary_bytes:
+            lag["replay_lag_sec"] = 0.0  # Nothing to replay, an idle primary is not a lag
+        elif replay_age_sec is not None:
+            lag["replay_lag_sec"] = max(replay_age_sec, 0.0)
+    return lag
+
+
+# Time series of replica lag samples persisted as JSON lines
+class LagHistory:
+
+    # Constructor
+    def __init__(self, history_file_path, max_samples=d.REPLICA_LAG_MAX_SAMPLES):
+        self.history_file_path = history_file_path
+        self.max_samples = max_samples
+        self.__lock = threading.Lock()
+        self.__sample_count = None
+
+    def append(self, sample):
+        with self.__lock:
+            if self.__sample_count is None:
+                self.__sample_count = len(self.samples())
+            with open(self.history_file_path, "a") as f:
+                f.write(json.dumps(sample) + "\n")
+            self.__sample_count += 1
+            # Trimming rewrites the file, so let it grow a bit beyond the limit first
+            if self.__sample_count > self.max_samples * 1.1:
+                self.__trim()
+
+    def samples(self):
+        if not os.path.exists(self.history_file_path):
+            return []
+        samples = []
+        with open(self.history_file_path, "r") as f:
+            for line in f:
+                try:
+                    samples.append(json.loads(line))
+                except ValueError:
+                    continue  # A line may be cut short by a crash
+        return samples
+
+    def latest(self):
+        samples = self.samples()
+        return samples[-1] if len(samples) > 0 else None
+
+    def __trim(self):
+        samples = self.samples()[-self.max_samples:]
+        temp_file_path = self.history_file_path + ".tmp"
+        with open(temp_file_path, "w") as f:
+            for sample in samples:
+                f.write(json.dumps(sample) + "\n")
+        os.rename(temp_file_path, self.history_file_path)
+        self.__sample_count = len(samples)
+
+
+# Samples the WAL positions of the local hot standby and the source Tableau Server's Postgres
+class ReplicaMonitor:
+
+    # Constructor
+    def __init__(self, env_manager, source_server, history_file_path, wal_archive=None):
+        logging.debug("Replica monitor is being initialized!")
+        self.env_manager = env_manager
+        self.source_server = source_server
+        self.wal_archive = wal_archive
+        self.history = LagHistory(history_file_path)
+
+    # Take a sample and add it to the history
+    def sample(self):
+        sample = {"timestamp": time.time(),
+                  "standby_connected": False,
+                  "primary_connected": False,
+                  "in_recovery": None,
+                  "receive_location": None,
+                  "replay_location": None,
+                  "primary_location": None,
+                  "replication_state": None,
+                  "wal_keep_bytes": None}
+        replay_age_sec = None
+
+        try:
+            in_recovery, receive_location, replay_location, replay_age = \
+                self.env_manager.run_pg_query(STANDBY_QUERY)[0]
+            sample["standby_connected"] = True
+            sample["in_recovery"] = in_recovery == "t"
+            sample["receive_location"] = receive_location or None
+            sample["replay_location"] = replay_location or None
+            replay_age_sec = float(replay_age) if replay_age else None
+        except Exception, e:  # A sample without a connection is recorded as well
+            logging.debug("Was not able to query the local Postgres replica: %s" % e)
+
+        try:
+            primary_location, wal_keep_segments, replication_state = self.env_manager.run_pg_query(
+                PRIMARY_QUERY,
+                params={"dr_ip": self.env_manager.dr_unix_ip},
+                host=self.source_server.host,
+                port=d.REMOTE_PG_PORT,
+                user=d.REMOTE_PG_USER)[0]
+            sample["primary_connected"] = True
+            sample["primary_location"] = primary_location
+            sample["replication_state"] = replication_state or None
+            sample["wal_keep_bytes"] = int(wal_keep_segments) * d.WAL_SEGMENT_SIZE_BYTES
+        except Exception, e:  # A sample without a connection is recorded as well
+            logging.debug("Was not able to query the source Tableau Server's Postgres: %s" % e)
+
+        sample.update(replication_lag(primary_location=sample["primary_location"],
+                                      receive_location=sample["receive_location"],
+                                      replay_location=sample["replay_location"],
+                                      replay_age_sec=replay_age_sec))
+        self.history.append(sample)
+        return sample
+
+    # Report the data loss exposure and fail if the replica cannot catch up from the WAL kept on the source
+    def check(self):
+        sample = self.sample()
+        if not sample["standby_connected"] or not sample["primary_connected"]:
+            raise ReplicaMonitorException("Was not able to determine the replication lag of the Postgres "
+                                          "replica! Standby reachable: %s, source reachable: %s"
+                                          % (sample["standby_connected"], sample["primary_connected"]))
+        if sample["receive_lag_bytes"] is None:
+            raise ReplicaMonitorException("The Postgres replica has not received any WAL from the source "
+                                          "Tableau Server! Replication state: %s" % sample["replication_state"])
+
+        logging.info("Data loss exposure of the Postgres replica: %d bytes not received, %d bytes not replayed, "
+                     "%s seconds behind. Replication state: %s"
+                     % (sample["receive_lag_bytes"], sample["replay_lag_bytes"] or 0,
+                        "%.1f" % sample["replay_lag_sec"] if sample["replay_lag_sec"] is not None else "unknown",
+                        sample["replication_state"]))
+
+        if self.wal_archive is not None:
+            self.wal_archive.check()
+
+        wal_keep_bytes = sample["wal_keep_bytes"]
+        if wal_keep_bytes:
+            if sample["receive_lag_bytes"] > wal_keep_bytes and self.wal_archive is not None:
+                logging.warning("The Postgres replica is %d bytes behind the source Tableau Server, more than the "
+                                "WAL it keeps (%d bytes). The replica catches up from the WAL archive."
+                                % (sample["receive_lag_bytes"], wal_keep_bytes))
+            elif sample["receive_lag_bytes"] > wal_keep_bytes:
+                raise ReplicaMonitorException("The Postgres replica is %d bytes behind the source Tableau "
+                                              "Server, more than the WAL it keeps (%d bytes)! "
+                                              "A new basebackup is needed."
+                                              % (sample["receive_lag_bytes"], wal_keep_bytes))
+            if sample["receive_lag_bytes"] > wal_keep_bytes * d.REPLICA_LAG_WARNING_RATIO:
+                logging.warning("The Postgres replica is %d bytes behind the source Tableau Server, close to the "
+                                "WAL it keeps (%d bytes)!" % (sample["receive_lag_bytes"], wal_keep_bytes))
+        return sample
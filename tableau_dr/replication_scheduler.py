@@ -0,0 +1,206 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import contextlib
+import datetime
+import threading
+import time
+import os
+import psutil
+import defaults as d
+
+
+# Bandwidth budget of a replication pair at the given time in KB/s, 0 means unlimited
+def window_budget_kbps(throttle_windows, pair, now):
+    minute_of_day = now.hour * 60 + now.minute
+    weekday = d.WEEKDAYS[now.weekday()]
+    previous_weekday = d.WEEKDAYS[now.weekday() - 1]
+    for window in throttle_windows:
+        if window["from_min"] <= window["to_min"]:
+            is_active = weekday in window["days"] and window["from_min"] <= minute_of_day < window["to_min"]
+        else:
+            # The window spans midnight, so its second part belongs to the previous day
+            is_active = (weekday in window["days"] and minute_of_day >= window["from_min"]) or \
+                        (previous_weekday in window["days"] and minute_of_day < window["to_min"])
+        if is_active:
+            return window["bandwidth_limit_kbps"].get(pair, 0)
+    return 0
+
+
+# Next bandwidth limit of a replication job in KB/s, 0 means unlimited.
+# The limit is halved while replication is running and the storage it reads from or writes to is slow,
+# otherwise it is raised step by step up to the budget.
+def next_bandwidth_limit_kbps(current_kbps, budget_kbps, observed_kbps, latency_ms, max_latency_ms):
+    limits = filter(lambda x: x > 0, [current_kbps, budget_kbps])
+    capped_kbps = min(limits) if len(limits) > 0 else 0
+
+    if latency_ms is not None and latency_ms > max_latency_ms:
+        if observed_kbps <= 0:
+            return capped_kbps  # Replication is idle, so it is not the cause of the latency
+        base_kbps = min(filter(lambda x: x > 0, [capped_kbps, observed_kbps]))
+        return max(d.REPLICATION_MIN_BWLIMIT_KBPS, base_kbps / 2)
+
+    if current_kbps == 0:
+        return budget_kbps
+    if budget_kbps == 0 and observed_kbps < current_kbps * 0.8:
+        return 0  # The limit is not holding replication back anymore
+    increased_kbps = current_kbps + max(d.REPLICATION_MIN_BWLIMIT_KBPS, current_kbps / 4)
+    return min(increased_kbps, budget_kbps) if budget_kbps > 0 else increased_kbps
+
+
+# Median time of listing a directory in milliseconds, None if it cannot be listed
+def measure_latency_ms(path, samples=3):
+    timings_ms = []
+    for i in range(samples):
+        start_time = time.time()
+        try:
+            os.listdir(path)
+        except OSError, e:
+            logging.debug("Was not able to measure latency of %s: %s" % (path, e))
+            return None
+        timings_ms.append((time.time() - start_time) * 1000)
+    return sorted(timings_ms)[len(timings_ms) / 2]
+
+
+# Bytes read so far by each running rsync process replicating from the given path
+def rsync_read_bytes(source_path):
+    read_bytes = {}
+    for process in psutil.process_iter():
+        try:
+            if process.name() != "rsync" or source_path not in process.cmdline():
+                continue
+            io_counters = process.io_counters()
+            # Reads from network shares are only accounted in read_chars
+            read_bytes[process.pid] = getattr(io_counters, "read_chars", io_counters.read_bytes)
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+    return read_bytes
+
+
+# Throttles the replication cron jobs of a rescue group by writing the bandwidth limit file each job reads
+class ReplicationScheduler:
+
+    # Constructor
+    def __init__(self, env_manager, enabled, throttle_windows, max_source_latency_ms, mount_manager=None):
+        logging.debug("Replication scheduler is being initialized!")
+        self.env_manager = env_manager
+        self.mount_manager = mount_manager  # Probes the shares with a timeout, so a hung share cannot block
+        self.enabled = enabled
+        self.throttle_windows = throttle_windows
+        self.max_source_latency_ms = max_source_latency_ms
+        self.rescue_dir = env_manager.rescue_dir
+        self.__lock = threading.Lock()
+        self.__urgent_operations = 0
+        self.__limits_kbps = {}  # Job UUID -> current bandwidth limit
+        self.__read_bytes = {}  # Job UUID -> bytes read by its rsync processes at the last adjustment
+        self.__last_adjustment_time = None
+
+    # Adapt the bandwidth limit of every replication job to its budget, the observed transfer rate
+    # and the latency of the production Tableau Server's share
+    def adjust(self):
+        if not self.enabled:
+            return
+        with self.__lock:
+            if self.__urgent_operations > 0:
+                logging.debug("An urgent operation is running, replication is not throttled.")
+                return
+
+            now = time.time()
+            elapsed_sec = now - self.__last_adjustment_time if self.__last_adjustment_time is not None else None
+            self.__last_adjustment_time = now
+            if self.mount_manager is not None:
+                latency_ms = self.mount_manager.latency_ms("source")
+            else:
+                latency_ms = measure_latency_ms(self.env_manager.cluster_source_mount_full_path)
+            logging.debug("Latency of the source share: %s ms" % latency_ms)
+
+            for job in self.env_manager.get_replication_jobs():
+                budget_kbps = window_budget_kbps(self.throttle_windows, job["pair"], datetime.datetime.now())
+                observed_kbps = self.__observed_rate_kbps(job, elapsed_sec)
+                current_kbps = self.__limits_kbps.get(job["uuid"], budget_kbps)
+                limit_kbps = next_bandwidth_limit_kbps(current_kbps=current_kbps,
+                                                       budget_kbps=budget_kbps,
+                                                       observed_kbps=observed_kbps,
+                                                       latency_ms=latency_ms if "source" in job["pair"] else None,
+                                                       max_latency_ms=self.max_source_latency_ms)
+                if limit_kbps != current_kbps:
+                    logging.info("Bandwidth limit of %s replication (%s) is changed from %s to %s KB/s "
+                                 "(budget: %s KB/s, observed: %s KB/s, latency: %s ms)"
+                                 % (job["pair"], job["source_path"], current_kbps or "unlimited",
+                                    limit_kbps or "unlimited", budget_kbps or "unlimited", observed_kbps, latency_ms))
+                self.__set_limit(job["uuid"], limit_kbps)
+
+    # Set the bandwidth limit of every replication job to its current budget
+    def apply_budgets(self):
+        if not self.enabled:
+            return
+        with self.__lock:
+            self.__limits_kbps = {}
+            self.__read_bytes = {}
+            self.__last_adjustment_time = None
+            if self.__urgent_operations > 0:
+                return
+            for job in self.env_manager.get_replication_jobs():
+                self.__set_limit(job["uuid"], window_budget_kbps(self.throttle_windows,
+                                                                 job["pair"],
+                                                                 datetime.datetime.now()))
+
+    # Remove every bandwidth limit while an operator runs a switchover or a backup
+    @contextlib.contextmanager
+    def urgent(self, operation_name):
+        if not self.enabled:
+            yield
+            return
+
+        with self.__lock:
+            self.__urgent_operations += 1
+            logging.info("Removing replication bandwidth limits for %s..." % operation_name)
+            try:
+                for job in self.env_manager.get_replication_jobs():
+                    self.__set_limit(job["uuid"], 0)
+            except Exception, e:
+                logging.warning("Was not able to remove replication bandwidth limits: %s" % e)
+        try:
+            yield
+        finally:
+            with self.__lock:
+                self.__urgent_operations -= 1
+            logging.info("%s has finished, restoring replication bandwidth limits..." % operation_name)
+            try:
+                self.apply_budgets()
+            except Exception, e:
+                logging.warning("Was not able to restore replication bandwidth limits: %s" % e)
+
+    def __observed_rate_kbps(self, job, elapsed_sec):
+        read_bytes = rsync_read_bytes(job["source_path"])
+        previous_read_bytes = self.__read_bytes.get(job["uuid"], {})
+        self.__read_bytes[job["uuid"]] = read_bytes
+        if elapsed_sec is None or elapsed_sec <= 0 or len(read_bytes) == 0:
+            return 0
+        # rsync forks a sender and a receiver, the busier one tells the transfer rate
+        transferred_bytes = max([read_bytes[pid] - previous_read_bytes.get(pid, 0) for pid in read_bytes.keys()])
+        return int(max(transferred_bytes, 0) / 1024 / elapsed_sec)
+
+    def __set_limit(self, job_uuid, limit_kbps):
+        self.__limits_kbps[job_uuid] = limit_kbps
+        limit_file_path = os.path.join(self.rescue_dir, d.RSYNC_BWLIMIT_FILE.format(uuid=job_uuid))
+        temp_file_path = limit_file_path + ".tmp"
+        with open(temp_file_path, "w") as f:
+            f.write("%d\n" % limit_kbps)
+        os.rename(temp_file_path, limit_file_path)
@@ -0,0 +1,112 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import logging
+import subprocess
+import shutil
+import errno
+import os
+
+
+# Custom exception
+class SnapshotException(Exception):
+    pass
+
+
+# Whether two paths are on the same filesystem, the destination does not need to exist yet
+def same_filesystem(source_path, destination_path):
+    destination_path = os.path.abspath(destination_path)
+    while not os.path.exists(destination_path):
+        destination_path = os.path.dirname(destination_path)
+    return os.stat(source_path).st_dev == os.stat(destination_path).st_dev
+
+
+# Recreate the directory tree of source_dir under destination_dir with every file hardlinked.
+# This takes one metadata operation per file, no data is copied. Files replaced later by rsync get a new
+# inode, so the snapshot keeps the content they had when it was taken.
+def hardlink_tree(source_dir, destination_dir):
+    for dir_path, dir_names, file_names in os.walk(source_dir):
+        target_dir = os.path.join(destination_dir, os.path.relpath(dir_path, source_dir))
+        os.makedirs(target_dir)
+        shutil.copystat(dir_path, target_dir)
+        for dir_name in dir_names:
+            source_path = os.path.join(dir_path, dir_name)
+            if os.path.islink(source_path):  # os.walk does not descend into links to directories
+                os.symlink(os.readlink(source_path), os.path.join(target_dir, dir_name))
+        for file_name in file_names:
+            source_path = os.path.join(dir_path, file_name)
+            if os.path.islink(source_path):
+                os.symlink(os.readlink(source_path), os.path.join(target_dir, file_name))
+            else:
+                os.link(source_path, os.path.join(target_dir, file_name))
+
+
+# Copy a directory tree sharing the data blocks of its files, supported by e.g. XFS and Btrfs
+def reflink_tree(source_dir, destination_dir):
+    p = subprocess.Popen(["cp", "-a", "--reflink=always", source_dir, destination_dir],
+                         stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE,
+                         close_fds=True)
+    stdout, stderr = p.communicate()
+    if p.returncode != 0:
+        raise SnapshotException("Was not able to reflink %s to %s: %s" % (source_dir, destination_dir,
+                                                                          stderr.strip()))
+
+
+# Take a point-in-time snapshot of source_dir at destination_dir and return the method that was used, if any.
+# Auto tries a reflink, then hardlinks, and copies the tree if it is on another filesystem than the destination.
+def snapshot_tree(source_dir, destination_dir, method="auto"):
+    if os.path.exists(destination_dir):
+        raise SnapshotException("Snapshot destination %s already exists!" % destination_dir)
+    if not os.path.isdir(source_dir):
+        os.makedirs(destination_dir)  # Nothing to snapshot, e.g. no extracts have been synced yet
+        return None
+
+    if method == "auto":
+        if same_filesystem(source_dir, destination_dir):
+            methods = ["reflink", "hardlink"]
+        else:
+            methods = ["copy"]
+    elif method in ["reflink", "hardlink", "copy"]:
+        methods = [method]
+    else:
+        raise SnapshotException("Unknown snapshot method: %s" % method)
+
+    for method_name in methods:
+        try:
+            if method_name == "reflink":
+                reflink_tree(source_dir, destination_dir)
+            elif method_name == "hardlink":
+                hardlink_tree(source_dir, destination_dir)
+            else:
+                shutil.copytree(source_dir, destination_dir, symlinks=True)
+            logging.debug("Snapshot of %s has been taken at %s with %s." % (source_dir, destination_dir,
+                                                                              method_name))
+            return method_name
+        except (SnapshotException, OSError, shutil.Error), e:
+            if os.path.exists(destination_dir):
+                shutil.rmtree(destination_dir)
+            if method_name == methods[-1]:
+                if isinstance(e, OSError) and e.errno == errno.EXDEV:
+                    raise SnapshotException("Was not able to hardlink %s to %s, they are on different "
+                                            "filesystems!" % (source_dir, destination_dir))
+                raise SnapshotException("Was not able to take a snapshot of %s at %s: %s" % (source_dir,
+                                                                                              destination_dir,
+                                                                                              e))
+            logging.debug("Snapshot with %s is not possible (%s), trying the next method..." % (method_name, e))
@@ -0,0 +1,255 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+from contextlib import contextmanager
+import logging.handlers
+import collections
+import threading
+import logging
+import Queue
+import json
+import time
+import uuid
+import os
+import defaults as d
+
+# Attributes every log record has, the others have been passed as extra fields
+RECORD_ATTRIBUTES = set(logging.LogRecord("", logging.INFO, "", 0, "", None, None).__dict__.keys()
+                        + ["message", "asctime"])
+
+operation_context = threading.local()  # Stack of the operations running in a thread
+
+
+# Custom exception
+class StructuredLoggingException(Exception):
+    pass
+
+
+# Keep the start and the end of a long text, e.g. the output of a failed command
+def truncate(text, max_chars=d.LOG_MAX_MESSAGE_CHARS):
+    if len(text) <= max_chars:
+        return text
+    head_chars = max_chars / 2
+    tail_chars = max_chars - head_chars
+    return "%s\n... [%d characters truncated] ...\n%s" % (text[:head_chars],
+                                                          len(text) - head_chars - tail_chars,
+                                                          text[-tail_chars:])
+
+
+# Innermost operation running in this thread, None outside of operations
+def current_operation():
+    operations = getattr(operation_context, "operations", [])
+    return operations[-1] if len(operations) > 0 else None
+
+
+# Tag the log records of the enclosed block with the name and a correlation id of the operation.
+# Its duration is logged when it is finished.
+@contextmanager
+def operation(name, **fields):
+    parent = current_operation()
+    current = {"operation": name,
+               "operation_id": uuid.uuid4().hex[:12],
+               "parent_operation_id": parent["operation_id"] if parent is not None else None}
+    current.update(fields)
+    if not hasattr(operation_context, "operations"):
+        operation_context.operations = []
+    operation_context.operations.append(current)
+    start_time = time.time()
+    try:
+        yield current
+        duration_sec = time.time() - start_time
+        logging.info("%s has been finished in %.1f seconds." % (name, duration_sec),
+                     extra={"duration_sec": round(duration_sec, 3)})
+    except Exception, e:
+        duration_sec = time.time() - start_time
+        logging.error("%s has failed after %.1f seconds: %s" % (name, duration_sec, e),
+                      extra={"duration_sec": round(duration_sec, 3)})
+        raise
+    finally:
+        operation_context.operations.pop()
+
+
+# Adds the fields of the current operation to the records logged by a thread
+class OperationFilter(logging.Filter):
+
+    def filter(self, record):
+        current = current_operation()
+        if current is not None:
+            for key, value in current.items():
+                if not hasattr(record, key):
+                    setattr(record, key, value)
+        return True
+
+
+# One JSON object per record, with the fields of its operation and the extra fields it was logged with
+class JsonFormatter(logging.Formatter):
+
+    # Constructor
+    def __init__(self, prefix=""):
+        logging.Formatter.__init__(self)
+        self.prefix = prefix
+
+    def format(self, record):
+        entry = collections.OrderedDict([("timestamp", time.strftime("%Y-%m-%dT%H:%M:%S",
+                                                                     time.localtime(record.created))
+                                          + ".%03d" % record.msecs),
+                                         ("level", record.levelname),
+                                         ("logger", record.name),
+                                         ("thread", record.threadName),
+                                         ("message", truncate(record.getMessage()))])
+        for key, value in sorted(record.__dict__.items()):
+            if key not in RECORD_ATTRIBUTES and value is not None:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = truncate(record.exc_text)
+        return self.prefix + json.dumps(entry, default=str)
+
+
+# Text format, with long messages truncated
+class TruncatingFormatter(logging.Formatter):
+
+    def format(self, record):
+        return truncate(logging.Formatter.format(self, record))
+
+
+# Passes records to its handlers from a background thread, so that a slow disk or syslog never blocks
+# the thread logging them. The message is formatted and truncated before the record is queued. When the
+# queue is full the record is dropped and counted.
+class AsyncHandler(logging.Handler):
+
+    # Constructor
+    def __init__(self, handlers, queue_size=d.LOG_QUEUE_SIZE):
+        logging.Handler.__init__(self)
+        self.handlers = handlers
+        self.dropped_records = 0
+        self.__queue = Queue.Queue(queue_size)
+        self.__thread = threading.Thread(target=self.__forward_records, name="logging")
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def emit(self, record):
+        try:
+            self.__queue.put_nowait(self.prepare(record))
+        except Queue.Full:
+            self.dropped_records += 1
+        except Exception:
+            self.handleError(record)
+
+    # Freeze the record, its arguments may change or be large objects
+    def prepare(self, record):
+        record.msg = truncate(record.getMessage())
+        record.args = None
+        if record.exc_info:
+            record.exc_text = truncate(logging.Formatter().formatException(record.exc_info))
+            record.exc_info = None
+        return record
+
+    # Wait until the queued records have been written
+    def flush(self):
+        self.__queue.join()
+
+    def close(self):
+        if self.__thread.is_alive():
+            self.__queue.put(None)
+            self.__thread.join()
+        for handler in self.handlers:
+            handler.close()
+        logging.Handler.close(self)
+
+    def __forward_records(self):
+        reported_drops = 0
+        while True:
+            record = self.__queue.get()
+            try:
+                # Drops are reported before the next record and before the handlers are closed
+                dropped_records = self.dropped_records
+                if dropped_records > reported_drops:
+                    self.__handle(logging.makeLogRecord({"name": "tableau_dr",
+                                                         "levelno": logging.WARNING,
+                                                         "levelname": "WARNING",
+                                                         "msg": "%d log records have been dropped, the log queue "
+                                                                "was full!" % (dropped_records - reported_drops)}))
+                    reported_drops = dropped_records
+                if record is None:
+                    return
+                self.__handle(record)
+            finally:
+                self.__queue.task_done()
+
+    def __handle(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                try:
+                    handler.handle(record)
+                except Exception:
+                    handler.handleError(record)
+
+
+# Handler sending records to syslog, or journald through its syslog socket. The address is either a path of
+# a Unix socket or host:port for UDP.
+def create_syslog_handler(address):
+    if address.startswith("/"):
+        if not os.path.exists(address):
+            raise StructuredLoggingException("Syslog socket %s does not exist!" % address)
+        syslog_address = address
+    else:
+        host, _, port = address.partition(":")
+        try:
+            syslog_address = (host, int(port or logging.handlers.SYSLOG_UDP_PORT))
+        except ValueError:
+            raise StructuredLoggingException("Invalid syslog address: %s! Use a socket path or host:port." % address)
+    handler = logging.handlers.SysLogHandler(address=syslog_address,
+                                             facility=logging.handlers.SysLogHandler.LOG_DAEMON)
+    handler.setFormatter(JsonFormatter(prefix="tableau_dr: "))
+    return handler
+
+
+# Log to the console and a rotated log file in output_dir, and to syslog if an address is given.
+# Every handler is fed by a single background thread.
+def configure_logging(output_dir, console_level, console_format, file_format="json", syslog_address=None):
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(console_level)
+    console_handler.setFormatter(TruncatingFormatter(console_format))
+
+    file_handler = logging.handlers.RotatingFileHandler(os.path.join(output_dir, d.LOG_FILE),
+                                                        "a",
+                                                        maxBytes=d.LOG_MAX_BYTES,
+                                                        backupCount=d.LOG_BACKUP_COUNT)
+    file_handler.setLevel(logging.DEBUG)
+    if file_format == "json":
+        file_handler.setFormatter(JsonFormatter())
+    elif file_format == "text":
+        file_handler.setFormatter(TruncatingFormatter(console_format))
+    else:
+        raise StructuredLoggingException("Unknown log format: %s! Possible options: json, text" % file_format)
+
+    handlers = [console_handler, file_handler]
+    if syslog_address:
+        syslog_handler = create_syslog_handler(syslog_address)
+        syslog_handler.setLevel(logging.INFO)
+        handlers.append(syslog_handler)
+
+    async_handler = AsyncHandler(handlers)
+    async_handler.addFilter(OperationFilter())
+    logger = logging.getLogger()
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(async_handler)
+    return async_handler
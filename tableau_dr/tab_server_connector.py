@@ -28,6 +28,8 @@ from requests.exceptions import ReadTimeout
 import defaults as d
 import re
 import utils
+from concurrency import backoff_wait_sec
+import profiler
 
 # Custom exception
 class TableauServerConnectorException(Exception):
@@ -403,11 +405,16 @@ class TableauServerConnector:
 
     # Function to execute an arbitrary command
     def __execute_remote_command(self, command, powershell=False, retries=0, wait_before_retry=15):
+        with profiler.span("execute_remote_command", host=self.host, command=profiler.command_name(command),
+                           powershell=powershell):
+            return self.__run_remote_command(command, powershell, retries, wait_before_retry)
+
+    def __run_remote_command(self, command, powershell, retries, wait_before_retry):
         run_cmd = self.__obtain_run_cmd(powershell)
 
         for retry_loop_counter in range(retries+1):
             if (retry_loop_counter>0):
-                time.sleep(wait_before_retry)
+                time.sleep(backoff_wait_sec(retry_loop_counter, wait_before_retry, d.REMOTE_COMMAND_MAX_WAIT_SEC))
             #endif
             try:
                 #logging.warning("%s> %s" % (self.host, command))
@@ -0,0 +1,101 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import unittest
+import tempfile
+import shutil
+import time
+import json
+import os
+import defaults as d
+import tableau_dr.backup_catalog as backup_catalog
+
+
+class TestBackupCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.backups_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.backups_dir)
+
+    def create_backup_file(self, created, size_bytes=10):
+        file_name = d.BACKUP_FILE_TEMPLATE.format(timestamp=time.strftime(d.BACKUP_TIMESTAMP_FORMAT,
+                                                                          time.localtime(created)))
+        with open(os.path.join(self.backups_dir, file_name), "w") as f:
+            f.write("x" * size_bytes)
+        return file_name
+
+    # One backup every 6 hours for 60 days
+    def backups(self):
+        now = time.mktime((2017, 3, 1, 12, 0, 0, 0, 0, -1))
+        return [{"file_name": "backup-%d.tsbak" % i, "created": now - i * 6 * 3600, "size_bytes": 10}
+                for i in range(240)]
+
+    # Each tier keeps the newest backup of its last periods, the union is kept
+    def test_expired_backups(self):
+        backups = self.backups()
+        expired = backup_catalog.expired_backups(backups, {"hourly": 2, "daily": 7, "monthly": 2})
+        kept = filter(lambda x: x not in expired, backups)
+        self.assertEqual(len(kept), 8)  # 2 hourly within the 7 daily, plus the newest of the previous month
+        self.assertTrue(backups[0] in kept)
+        self.assertEqual(backup_catalog.expired_backups(backups, {}), [])
+        self.assertEqual(len(backup_catalog.expired_backups(backups, {"daily": 0})), 239)
+
+    # The oldest backups are deleted while the size budget is exceeded, the newest one is never deleted
+    def test_expired_backups_size_budget(self):
+        backups = self.backups()
+        self.assertEqual(len(backup_catalog.expired_backups(backups, {}, max_total_bytes=55)), 235)
+        self.assertEqual(len(backup_catalog.expired_backups(backups, {}, max_total_bytes=1)), 239)
+
+    def test_estimate_backup_bytes(self):
+        self.assertEqual(backup_catalog.estimate_backup_bytes(self.backups()), 12)
+        self.assertEqual(backup_catalog.estimate_backup_bytes([], 100), 120)
+        self.assertEqual(backup_catalog.estimate_backup_bytes([]), None)
+
+    # The index follows the directory and keeps metadata of the backups
+    def test_index(self):
+        now = time.time()
+        old_file_name = self.create_backup_file(now - 2 * 86400)
+        new_file_name = self.create_backup_file(now)
+        with open(os.path.join(self.backups_dir, new_file_name + ".tmp"), "w") as f:
+            f.write("partial")
+        catalog = backup_catalog.BackupCatalog(self.backups_dir, policy={"daily": 1})
+        self.assertEqual([x["file_name"] for x in catalog.backups()], [old_file_name, new_file_name])
+
+        catalog.add(os.path.join(self.backups_dir, new_file_name), replay_location="0/3000060")
+        with open(os.path.join(self.backups_dir, d.BACKUP_INDEX_FILE)) as f:
+            self.assertEqual(json.load(f)[new_file_name]["replay_location"], "0/3000060")
+        self.assertRaises(backup_catalog.BackupCatalogException, catalog.add, "backup-1.tsbak")
+
+        catalog.apply_retention(keep_file_names=set([old_file_name]))
+        self.assertTrue(os.path.exists(os.path.join(self.backups_dir, old_file_name)))
+        catalog.apply_retention()
+        self.assertFalse(os.path.exists(os.path.join(self.backups_dir, old_file_name)))
+        self.assertEqual([x["file_name"] for x in catalog.backups()], [new_file_name])
+
+        os.remove(os.path.join(self.backups_dir, new_file_name))
+        self.assertEqual(catalog.backups(), [])
+
+    def test_ensure_free_space(self):
+        catalog = backup_catalog.BackupCatalog(self.backups_dir)
+        catalog.ensure_free_space(lambda: 100)
+        self.assertRaises(backup_catalog.BackupCatalogException, catalog.ensure_free_space, lambda: 2 ** 62)
+        self.create_backup_file(time.time())
+        catalog.ensure_free_space(lambda: 2 ** 62)  # The size of the last backup is used instead
@@ -0,0 +1,123 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import unittest
+import tempfile
+import shutil
+import fcntl
+import os
+import defaults as d
+import tableau_dr.backup_coordinator as backup_coordinator
+
+
+class FakeEnvManager:
+
+    def __init__(self, rescue_dir, in_recovery="t"):
+        self.rescue_dir = rescue_dir
+        self.sync_full_path = os.path.join(rescue_dir, "data", "sync", "tabsvc")
+        self.in_recovery = in_recovery
+        self.resume_error = None
+        self.queries = []
+
+    def get_replication_jobs(self):
+        return [{"uuid": "1",
+                 "source_path": "/prod/dataengine/",
+                 "destination_path": self.sync_full_path + "/dataengine"},
+                {"uuid": "2",
+                 "source_path": self.sync_full_path + "/dataengine/",
+                 "destination_path": "/dr/dataengine"}]
+
+    def replication_lock_file_paths(self, destination_path):
+        return [os.path.join(self.rescue_dir, d.RSYNC_LOCK_FILE.format(uuid=job["uuid"]))
+                for job in self.get_replication_jobs() if job["destination_path"].startswith(destination_path)]
+
+    def run_pg_query(self, query):
+        self.queries.append(query)
+        if query == d.PG_REPLAY_LOCATION_QUERY:
+            return [(self.in_recovery, "0/3000060")]
+        if query == d.PG_REPLAY_RESUME_QUERY and self.resume_error is not None:
+            raise self.resume_error
+        return [("",)]
+
+
+class TestBackupCoordinator(unittest.TestCase):
+
+    def setUp(self):
+        self.rescue_dir = tempfile.mkdtemp()
+        self.env_manager = FakeEnvManager(self.rescue_dir)
+        self.coordinator = backup_coordinator.BackupCoordinator(self.env_manager, fence_timeout_sec=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.rescue_dir)
+
+    # Whether the lock file of a replication job is held by someone else
+    def is_locked(self, job_uuid):
+        with open(os.path.join(self.rescue_dir, d.RSYNC_LOCK_FILE.format(uuid=job_uuid)), "a") as f:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                return True
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            return False
+
+    # Replication into sync is fenced only during the capture, replay is paused until the dump has finished
+    def test_run(self):
+        events = []
+        capture_function = lambda: events.append(("capture", self.is_locked("1"), self.is_locked("2"),
+                                                  list(self.env_manager.queries)))
+        dump_function = lambda: events.append(("dump", self.is_locked("1"), list(self.env_manager.queries)))
+        replay_location = self.coordinator.run(capture_function, dump_function)
+
+        self.assertEqual(replay_location, "0/3000060")
+        self.assertEqual(events[0], ("capture", True, False, [d.PG_REPLAY_LOCATION_QUERY,
+                                                              d.PG_REPLAY_PAUSE_QUERY,
+                                                              d.PG_REPLAY_LOCATION_QUERY]))
+        self.assertEqual(events[1][:2], ("dump", False))
+        self.assertFalse(d.PG_REPLAY_RESUME_QUERY in events[1][2])
+        self.assertEqual(self.env_manager.queries[-1], d.PG_REPLAY_RESUME_QUERY)
+
+    # Replay is resumed and the fence released when the dump fails
+    def test_run_failure(self):
+        def dump_function():
+            raise IOError("disk full")
+        self.assertRaises(IOError, self.coordinator.run, lambda: None, dump_function)
+        self.assertEqual(self.env_manager.queries[-1], d.PG_REPLAY_RESUME_QUERY)
+        self.assertFalse(self.is_locked("1"))
+
+    # A failure to resume replay does not hide why the dump has failed
+    def test_run_failure_resume_failure(self):
+        def dump_function():
+            raise IOError("disk full")
+        self.env_manager.resume_error = ValueError("connection refused")
+        self.assertRaises(IOError, self.coordinator.run, lambda: None, dump_function)
+        self.assertRaises(ValueError, self.coordinator.run, lambda: None, lambda: None)
+
+    # A primary is not paused
+    def test_run_not_in_recovery(self):
+        self.env_manager.in_recovery = "f"
+        self.assertEqual(self.coordinator.run(lambda: None, lambda: None), None)
+        self.assertEqual(self.env_manager.queries, [d.PG_REPLAY_LOCATION_QUERY])
+
+    # A replication job that does not finish in time fails the fence
+    def test_fence_timeout(self):
+        with open(os.path.join(self.rescue_dir, d.RSYNC_LOCK_FILE.format(uuid="1")), "a") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            self.assertRaises(backup_coordinator.BackupCoordinatorException,
+                              self.coordinator.run, lambda: None, lambda: None)
+        self.assertEqual(self.env_manager.queries, [])
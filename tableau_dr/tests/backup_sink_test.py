@@ -0,0 +1,128 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import unittest
+import tempfile
+import threading
+import hashlib
+import base64
+import shutil
+import os
+import tableau_dr.backup_sink as backup_sink
+
+
+# In-memory stand-in for an S3 compatible object store
+class FakeS3Client:
+
+    def __init__(self):
+        self.uploads = {}  # Upload ID -> {"Key", "Initiated", "Parts": {part number: data}}
+        self.objects = {}  # Key -> (data, ETag)
+        self.uploaded_part_numbers = []
+        self.lock = threading.Lock()
+
+    def create_multipart_upload(self, Bucket, Key, Metadata):
+        upload_id = "upload%d" % len(self.uploads)
+        self.uploads[upload_id] = {"Key": Key, "Initiated": len(self.uploads), "Parts": {}}
+        return {"UploadId": upload_id}
+
+    def list_multipart_uploads(self, Bucket, Prefix):
+        return {"Uploads": [{"Key": x["Key"], "UploadId": upload_id, "Initiated": x["Initiated"]}
+                            for upload_id, x in self.uploads.items() if x["Key"].startswith(Prefix)]}
+
+    def list_parts(self, Bucket, Key, UploadId, PartNumberMarker):
+        parts = self.uploads[UploadId]["Parts"]
+        return {"Parts": [{"PartNumber": x, "ETag": '"%s"' % hashlib.md5(parts[x]).hexdigest()}
+                          for x in sorted(parts.keys()) if x > PartNumberMarker],
+                "IsTruncated": False}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, ContentMD5):
+        assert base64.b64encode(hashlib.md5(Body).digest()) == ContentMD5
+        with self.lock:
+            self.uploads[UploadId]["Parts"][PartNumber] = Body
+            self.uploaded_part_numbers.append(PartNumber)
+        return {"ETag": '"%s"' % hashlib.md5(Body).hexdigest()}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)["Parts"]
+        part_numbers = [x["PartNumber"] for x in MultipartUpload["Parts"]]
+        self.objects[Key] = ("".join([parts[x] for x in part_numbers]),
+                             backup_sink.multipart_etag([hashlib.md5(parts[x]).digest() for x in part_numbers]))
+
+    def head_object(self, Bucket, Key):
+        return {"ETag": '"%s"' % self.objects[Key][1]}
+
+
+class TestBackupSink(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.temp_dir, "backup-20170301120000.tsbak")
+        with open(self.file_path, "wb") as f:
+            f.write(os.urandom(10 * 1024 + 100))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_file_checksums(self):
+        file_sha256, part_md5s = backup_sink.file_checksums(self.file_path, 1024)
+        with open(self.file_path, "rb") as f:
+            data = f.read()
+        self.assertEqual(file_sha256, hashlib.sha256(data).hexdigest())
+        self.assertEqual(len(part_md5s), 11)
+        self.assertEqual(part_md5s[10], hashlib.md5(data[10240:]).digest())
+
+    # An interrupted copy is resumed and the result is checked
+    def test_local_directory_sink(self):
+        target_dir = os.path.join(self.temp_dir, "nfs")
+        os.makedirs(target_dir)
+        with open(self.file_path, "rb") as f:
+            data = f.read()
+        with open(os.path.join(target_dir, os.path.basename(self.file_path) + ".partial"), "wb") as f:
+            f.write(data[:5000])
+        result = backup_sink.LocalDirectorySink("nfs", target_dir).upload(self.file_path)
+        with open(result["location"], "rb") as f:
+            self.assertEqual(f.read(), data)
+        self.assertEqual(os.listdir(target_dir), [os.path.basename(self.file_path)])
+
+    # Parts are uploaded in parallel, parts uploaded before an interruption are not sent again
+    def test_s3_sink(self):
+        client = FakeS3Client()
+        sink = backup_sink.S3Sink("s3", "backups", prefix="tableau/", part_size_bytes=1024, max_parallel_uploads=3,
+                                  client=client)
+        key = "tableau/backup-20170301120000.tsbak"
+        upload_id = client.create_multipart_upload(Bucket="backups", Key=key, Metadata={})["UploadId"]
+        client.upload_part(Bucket="backups", Key=key, UploadId=upload_id, PartNumber=1,
+                           Body=backup_sink.read_part(self.file_path, 1, 1024),
+                           ContentMD5=base64.b64encode(hashlib.md5(backup_sink.read_part(self.file_path, 1,
+                                                                                         1024)).digest()))
+        client.upload_part(Bucket="backups", Key=key, UploadId=upload_id, PartNumber=2, Body="stale",
+                           ContentMD5=base64.b64encode(hashlib.md5("stale").digest()))
+        client.uploaded_part_numbers = []
+
+        result = sink.upload(self.file_path)
+        self.assertEqual(result["location"], "s3://backups/" + key)
+        self.assertEqual(sorted(client.uploaded_part_numbers), range(2, 12))
+        with open(self.file_path, "rb") as f:
+            self.assertEqual(client.objects[key][0], f.read())
+
+    def test_s3_sink_checksum_mismatch(self):
+        client = FakeS3Client()
+        client.head_object = lambda Bucket, Key: {"ETag": '"0123-1"'}
+        sink = backup_sink.S3Sink("s3", "backups", part_size_bytes=1024, client=client)
+        self.assertRaises(backup_sink.BackupSinkException, sink.upload, self.file_path)
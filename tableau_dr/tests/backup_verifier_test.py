@@ -0,0 +1,104 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import unittest
+import tempfile
+import zipfile
+import shutil
+import os
+import tableau_dr.backup_verifier as backup_verifier
+
+DUMP_TOC = """;
+; Archive created at 2017-03-01 12:00:00 CET
+;     dbname: workgroup
+;
+2230; 1262 16386 DATABASE - workgroup rails
+2231; 1259 16400 TABLE public extracts rails
+2232; 1259 16401 TABLE public workbooks rails
+2233; 1259 16402 TABLE public datasources rails
+2234; 1259 16403 TABLE public users rails
+2235; 1259 16404 TABLE public sites rails
+2236; 0 16400 TABLE DATA public extracts rails
+"""
+
+EXTRACTS_DATA = """SET statement_timeout = 0;
+COPY extracts (id, workbook_id, descriptor, datasource_id) FROM stdin;
+1\t10\tab/cd/{0A1B}/Sales.tde\t\\N
+2\t\\N\tef/01/{2C3D}/Orders.tde\t20
+3\t11\t\\N\t\\N
+\\.
+"""
+
+
+class TestBackupVerifier(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.backup_file_path = os.path.join(self.temp_dir, "backup-20170301120000.tsbak")
+        self.create_backup_file(["ab/cd/{0A1B}/Sales.tde", "ef/01/{2C3D}/Orders.tde"])
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def create_backup_file(self, extract_paths):
+        with zipfile.ZipFile(self.backup_file_path, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("manifest.yml", "--- \n:version: \"1.6\"\n")
+            archive.writestr("config.yml", "worker0.host: tableau\n")
+            archive.writestr("workgroup.pg_dump", "dump" * 1000)
+            archive.writestr("backup.sql", "CREATE ROLE rails;\n")
+            for extract_path in extract_paths:
+                archive.writestr("dataengine/extract/" + extract_path, "extract" * 1000)
+
+    def verify(self):
+        return backup_verifier.verify_backup(file_path=self.backup_file_path,
+                                             work_dir=self.temp_dir,
+                                             list_dump_function=lambda x: DUMP_TOC,
+                                             table_data_function=lambda x, y: EXTRACTS_DATA)
+
+    def test_parse_copy_data(self):
+        columns, rows = backup_verifier.parse_copy_data(EXTRACTS_DATA)
+        self.assertEqual(columns, ["id", "workbook_id", "descriptor", "datasource_id"])
+        self.assertEqual(rows[1], ["2", None, "ef/01/{2C3D}/Orders.tde", "20"])
+        self.assertEqual(backup_verifier.unescape_copy_value("a\\tb\\\\c"), "a\tb\\c")
+
+    def test_verify_backup(self):
+        result = self.verify()
+        self.assertTrue(result["verified"], result["errors"])
+        self.assertEqual(result["entries"], 6)
+        self.assertEqual(result["extracts_referenced"], 2)
+        self.assertEqual(result["extracts_missing"], 0)
+        self.assertEqual(filter(lambda x: x.startswith("tableau_dr_verify_"), os.listdir(self.temp_dir)), [])
+
+    def test_verify_missing_extract(self):
+        self.create_backup_file(["ab/cd/{0A1B}/Sales.tde"])
+        result = self.verify()
+        self.assertFalse(result["verified"])
+        self.assertEqual(result["extracts_missing"], 1)
+
+    # A flipped byte in the compressed data fails the CRC check
+    def test_verify_corrupt_archive(self):
+        with open(self.backup_file_path, "rb") as f:
+            data = bytearray(f.read())
+        offset = data.find("backup.sql") + len("backup.sql") + 2  # Compressed data follows the local header
+        data[offset] = (data[offset] + 1) % 256
+        with open(self.backup_file_path, "wb") as f:
+            f.write(data)
+        result = self.verify()
+        self.assertFalse(result["verified"])
+        self.assertTrue(result["errors"][0].startswith("The archive is not readable"))
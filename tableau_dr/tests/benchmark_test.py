@@ -0,0 +1,94 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import unittest
+import tempfile
+import shutil
+import os
+import winrm
+import defaults as d
+import tableau_dr.benchmark as benchmark
+import tableau_dr.fake_winrm as fake_winrm
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    # The same seed gives the same layout and sizes
+    def test_generate_tree(self):
+        tree = benchmark.generate_tree(os.path.join(self.work_dir, "a"), 20, seed=1, webdataconnector_count=2)
+        other_tree = benchmark.generate_tree(os.path.join(self.work_dir, "b"), 20, seed=1, webdataconnector_count=2)
+        self.assertEqual(tree["extracts"], other_tree["extracts"])
+        self.assertEqual(tree["bytes"], other_tree["bytes"])
+        self.assertEqual(len(tree["descriptors"]), 20)
+        self.assertTrue(tree["extracts"][0].startswith(os.path.join(d.DATAENGINE_DIR, "extract")))
+        self.assertEqual(sum([os.path.getsize(os.path.join(self.work_dir, "a", x)) for x in tree["extracts"]]),
+                         tree["bytes"])
+        self.assertTrue(os.path.exists(os.path.join(self.work_dir, "a", "config", "tabsvc.yml")))
+
+    def test_mutate_tree(self):
+        root_path = os.path.join(self.work_dir, "a")
+        tree = benchmark.generate_tree(root_path, 20, seed=1, webdataconnector_count=0)
+        mtimes = dict([(x, os.stat(os.path.join(root_path, x)).st_mtime) for x in tree["extracts"]])
+        benchmark.mutate_tree(root_path, tree["extracts"], 0.25, seed=1)
+        changed = filter(lambda x: os.stat(os.path.join(root_path, x)).st_mtime != mtimes[x], tree["extracts"])
+        self.assertEqual(len(changed), 5)
+
+    # A failed step is recorded and does not stop the benchmark
+    def test_run_step(self):
+        steps = {}
+        self.assertTrue(benchmark.run_step(steps, "ok", lambda: {"bytes": 1}))
+        self.assertFalse(benchmark.run_step(steps, "failed", lambda: 1 / 0))
+        self.assertEqual(steps["ok"]["bytes"], 1)
+        self.assertTrue(steps["ok"]["duration_sec"] >= 0)
+        self.assertEqual(steps["failed"]["duration_sec"], None)
+        self.assertTrue("error" in steps["failed"])
+
+    def test_compare_results(self):
+        results = {"steps": {"a": {"duration_sec": 3.0}, "b": {"duration_sec": None}, "c": {"duration_sec": 1.0}}}
+        baseline = {"steps": {"a": {"duration_sec": 2.0}, "b": {"duration_sec": 1.0}}}
+        self.assertEqual(benchmark.compare_results(results, baseline), {"a": 1.5})
+
+    # Round trips and failures of connector operations are counted per server
+    def test_run_connector_benchmarks(self):
+        server_connectors = []
+        for i in range(2):
+            server = fake_winrm.FakeWinRMServer(handlers=fake_winrm.TableauStandIn().handlers())
+            server_connectors.append((server, winrm.Session(server.start(), auth=("user", "password"))))
+        server_connectors[1][0].inject_failure(fake_winrm.FAIL_HTTP_ERROR)
+        try:
+            results = benchmark.run_connector_benchmarks(server_connectors,
+                                                         [("whoami", lambda x: x.run_cmd("whoami")),
+                                                          ("status", lambda x: x.run_cmd("tabadmin.exe status"))])
+        finally:
+            for server, session in server_connectors:
+                server.stop()
+        self.assertEqual(results["steps"]["whoami"]["failed"], 1)
+        self.assertEqual(results["steps"]["whoami"]["failures_injected"], 1)
+        self.assertEqual(results["steps"]["status"]["failed"], 0)
+        self.assertEqual(results["steps"]["status"]["round_trips"], 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+
+import subprocess
+import unittest
+import tempfile
+import shutil
+import os
+import tableau_dr.command_output as command_output
+
+
+def run(args, stdin=None, stdout_buffer=None, stderr_buffer=None):
+    p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE)
+    stdout_buffer = stdout_buffer or command_output.OutputBuffer()
+    stderr_buffer = stderr_buffer or command_output.OutputBuffer()
+    returncode = command_output.communicate(p, stdin, stdout_buffer, stderr_buffer)
+    return returncode, stdout_buffer, stderr_buffer
+
+
+class OutputBufferTest(unittest.TestCase):
+
+    def test_bounded(self):
+        output_buffer = command_output.OutputBuffer(max_bytes=10)
+        for i in range(100):
+            output_buffer.write("line %02d\n" % i)
+        self.assertEqual(output_buffer.getvalue(), "8\nline 99\n")
+        self.assertEqual(output_buffer.total_bytes, 800)
+        self.assertEqual(output_buffer.lines(), 100)
+        self.assertTrue(output_buffer.truncated())
+        self.assertEqual(output_buffer.tail(8), "[100 lines, only the last 8 of 800 bytes are shown]\nline 99\n")
+
+    def test_unbounded(self):
+        output_buffer = command_output.OutputBuffer()
+        output_buffer.write("a" * 100000)
+        output_buffer.write("\nlast")
+        self.assertEqual(len(output_buffer.getvalue()), 100005)
+        self.assertEqual(output_buffer.lines(), 2)
+        self.assertFalse(output_buffer.truncated())
+        self.assertEqual(output_buffer.tail(100), "[2 lines, only the last 100 of 100005 bytes are shown]\n"
+                                                  + "a" * 95 + "\nlast")
+
+    def test_line_handler(self):
+        lines = []
+        output_buffer = command_output.OutputBuffer(max_bytes=4, line_handler=lines.append)
+        for chunk in ["10/100 kB\r20/1", "00 kB\r\n", "done\n", "\n", "no newline"]:
+            output_buffer.write(chunk)
+        output_buffer.close()
+        self.assertEqual(lines, ["10/100 kB", "20/100 kB", "done", "no newline"])
+
+
+class CommunicateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_verbose_command(self):
+        script = "for i in $(seq 1 20000); do echo out $i; echo err $i 1>&2; done; exit 3"
+        returncode, stdout_buffer, stderr_buffer = run(["sh", "-c", script],
+                                                       stdout_buffer=command_output.OutputBuffer(max_bytes=1024),
+                                                       stderr_buffer=command_output.OutputBuffer(max_bytes=1024))
+        self.assertEqual(returncode, 3)
+        self.assertEqual(stdout_buffer.lines(), 20000)
+        self.assertEqual(stderr_buffer.lines(), 20000)
+        self.assertTrue(len(stdout_buffer.getvalue()) <= 1024)
+        self.assertTrue(stdout_buffer.getvalue().endswith("out 20000\n"))
+        self.assertTrue(stderr_buffer.getvalue().endswith("err 20000\n"))
+
+    def test_stdin_and_output_file(self):
+        stdin = "".join(["row %d\n" % i for i in range(100000)])
+        with open(os.path.join(self.work_dir, "out"), "wb") as f:
+            returncode, stdout_buffer, stderr_buffer = run(["cat"], stdin=stdin,
+                                                           stdout_buffer=command_output.OutputBuffer(max_bytes=16,
+                                                                                                     file_obj=f))
+        self.assertEqual(returncode, 0)
+        with open(os.path.join(self.work_dir, "out"), "rb") as f:
+            self.assertEqual(f.read(), stdin)
+        self.assertEqual(stdout_buffer.getvalue(), "row 99998\nrow 99999\n"[-16:])
+
+    def test_input_not_read(self):
+        returncode, stdout_buffer, stderr_buffer = run(["true"], stdin="x" * 1000000)
+        self.assertEqual(returncode, 0)
+
+    def test_capture_files(self):
+        capture_files = command_output.open_capture_files(self.work_dir, "pg_dump")
+        for capture_file in capture_files.values():
+            capture_file.close()
+        self.assertEqual(sorted([os.path.splitext(x)[1] for x in os.listdir(self.work_dir)]), [".err", ".out"])
+        self.assertTrue(all(["-pg_dump." in x for x in os.listdir(self.work_dir)]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import time
+import tableau_dr.concurrency as concurrency
+
+
+class TestConcurrency(unittest.TestCase):
+
+    # Test that results are returned in the order of the tasks and that the tasks run in parallel
+    def test_run_concurrently(self):
+        start_time = time.time()
+        results = concurrency.run_concurrently([("first", lambda: time.sleep(0.2) or 1),
+                                                ("second", lambda: time.sleep(0.2) or 2)])
+        self.assertEqual(results, [1, 2])
+        self.assertLess(time.time() - start_time, 0.35)
+
+    # Test that a failure is re-raised only after every task has finished
+    def test_run_concurrently_failure(self):
+        finished_tasks = []
+
+        def failing_task():
+            raise ValueError("Task failed!")
+
+        with self.assertRaises(ValueError):
+            concurrency.run_concurrently([("failing", failing_task),
+                                          ("slow", lambda: time.sleep(0.1) or finished_tasks.append("slow"))])
+        self.assertEqual(finished_tasks, ["slow"])
+
+    # Test that retrying stops at the first success
+    def test_retry_with_backoff(self):
+        attempts = []
+
+        def flaky_function():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise IOError("Not yet!")
+            return "done"
+
+        self.assertEqual(concurrency.retry_with_backoff(flaky_function, retries=5, initial_wait_sec=0), "done")
+        self.assertEqual(len(attempts), 3)
+
+    # Test that backoff grows exponentially up to the maximum
+    def test_backoff_wait_sec(self):
+        self.assertLessEqual(concurrency.backoff_wait_sec(1, 2, 30), 2)
+        self.assertGreaterEqual(concurrency.backoff_wait_sec(3, 2, 30), 4)
+        self.assertLessEqual(concurrency.backoff_wait_sec(10, 2, 30), 30)
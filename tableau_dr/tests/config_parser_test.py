@@ -97,3 +97,14 @@ class TestConfigParser(unittest.TestCase):
         modified_cluster_data["reverse"] = True
         with self.assertRaises(ConfigParserException):
             ConfigParser(cluster_data=modified_cluster_data)
+
+    # Test that the size budget of the backups directory is converted to bytes
+    def test_backup_retention_max_total_gb(self):
+        modified_cluster_data = deepcopy(example_cluster_data)
+        modified_cluster_data["rescue_env"]["backup_retention"] = {"daily": 7, "max_total_gb": 1.5}
+        policy, max_total_bytes = ConfigParser(cluster_data=modified_cluster_data).backup_retention_data()
+        self.assertEqual(policy, {"daily": 7})
+        self.assertEqual(max_total_bytes, int(1.5 * 1024 ** 3))
+        modified_cluster_data["rescue_env"]["backup_retention"] = {"max_total_gb": "a lot"}
+        with self.assertRaises(ConfigParserException):
+            ConfigParser(cluster_data=modified_cluster_data).backup_retention_data()
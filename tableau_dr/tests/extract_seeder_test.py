@@ -0,0 +1,110 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import unittest
+import tempfile
+import shutil
+import os
+import defaults as d
+import tableau_dr.extract_seeder as extract_seeder
+
+
+class FakeEnvManager:
+
+    def __init__(self, rescue_dir):
+        self.rescue_dir = rescue_dir
+        self.sync_full_path = os.path.join(rescue_dir, "sync")
+        self.cluster_target_mount_full_path = os.path.join(rescue_dir, "target")
+        self.copied_files = []
+
+    def replication_lock_file_paths(self, destination_path):
+        return [os.path.join(self.rescue_dir, d.RSYNC_LOCK_FILE.format(uuid="1"))]
+
+    # Copies like rsync -a --files-from, keeping the modification times
+    def copy_listed_files(self, source_dir, destination_dir, file_list_path):
+        with open(file_list_path, "r") as f:
+            relative_paths = f.read().split()
+        for relative_path in relative_paths:
+            destination_path = os.path.join(destination_dir, relative_path)
+            if not os.path.exists(os.path.dirname(destination_path)):
+                os.makedirs(os.path.dirname(destination_path))
+            shutil.copy2(os.path.join(source_dir, relative_path), destination_path)
+            self.copied_files.append(relative_path)
+
+
+class TestExtractSeeder(unittest.TestCase):
+
+    def setUp(self):
+        self.rescue_dir = tempfile.mkdtemp()
+        self.env_manager = FakeEnvManager(self.rescue_dir)
+        self.index_file_path = os.path.join(self.rescue_dir, d.PRESEED_INDEX_FILE)
+        self.seeder = extract_seeder.ExtractSeeder(self.env_manager, self.index_file_path, fence_timeout_sec=1)
+        self.source_path = os.path.join(self.env_manager.sync_full_path, d.REPLICATION_DIRS[-1])
+        self.target_path = os.path.join(self.env_manager.cluster_target_mount_full_path, d.REPLICATION_DIRS[-1])
+
+    def tearDown(self):
+        shutil.rmtree(self.rescue_dir)
+
+    def write_file(self, file_path, content, mtime=1000000000):
+        if not os.path.exists(os.path.dirname(file_path)):
+            os.makedirs(os.path.dirname(file_path))
+        with open(file_path, "w") as f:
+            f.write(content)
+        os.utime(file_path, (mtime, mtime))
+
+    def test_plan_delta(self):
+        source_state = {"same": [1, 10], "changed": [2, 20], "new": [3, 30]}
+        target_state = {"same": [1, 10], "changed": [2, 19], "extra": [4, 40]}
+        self.assertEqual(extract_seeder.plan_delta(source_state, target_state),
+                         (["changed", "new"], ["extra"], 5))
+
+    # Only the extracts that differ are copied, files only on the target are deleted
+    def test_seed(self):
+        self.write_file(os.path.join(self.source_path, "a", "same.tde"), "same")
+        self.write_file(os.path.join(self.target_path, "a", "same.tde"), "same")
+        self.write_file(os.path.join(self.source_path, "a", "changed.tde"), "new content", mtime=1000000100)
+        self.write_file(os.path.join(self.target_path, "a", "changed.tde"), "old content")
+        self.write_file(os.path.join(self.source_path, "b", "new.tde"), "new")
+        self.write_file(os.path.join(self.target_path, "b", "extra.tde"), "extra")
+
+        result = self.seeder.seed(dry_run=True)
+        self.assertEqual(result["dirs"][d.REPLICATION_DIRS[-1]]["files_to_copy"], 2)
+        self.assertEqual(result["dirs"][d.REPLICATION_DIRS[-1]]["files_to_delete"], 1)
+        self.assertEqual(self.env_manager.copied_files, [])
+        self.assertTrue(os.path.exists(os.path.join(self.target_path, "b", "extra.tde")))
+
+        self.seeder.seed()
+        self.assertEqual(sorted(self.env_manager.copied_files), [os.path.join("a", "changed.tde"),
+                                                                 os.path.join("b", "new.tde")])
+        self.assertEqual(extract_seeder.scan_tree(self.target_path), extract_seeder.scan_tree(self.source_path))
+        self.assertEqual(extract_seeder.FileStateIndex(self.index_file_path).load()[d.REPLICATION_DIRS[-1]],
+                         extract_seeder.scan_tree(self.source_path))
+
+        # Nothing differs once the target has been seeded
+        result = self.seeder.seed(trust_index=True)
+        self.assertEqual(result["dirs"][d.REPLICATION_DIRS[-1]]["files_to_copy"], 0)
+        self.assertEqual(len(self.env_manager.copied_files), 2)
+
+    def test_seed_without_target(self):
+        self.env_manager.cluster_target_mount_full_path = None
+        self.assertRaises(extract_seeder.ExtractSeederException, self.seeder.seed)
+
+
+if __name__ == '__main__':
+    unittest.main()
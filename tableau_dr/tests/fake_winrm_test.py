@@ -0,0 +1,86 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import unittest
+import time
+import winrm
+import winrm.exceptions as winrm_exc
+import tableau_dr.fake_winrm as fake_winrm
+
+
+class TestFakeWinRMServer(unittest.TestCase):
+
+    def setUp(self):
+        self.stand_in = fake_winrm.TableauStandIn(running=False, existing_paths=["C:/Program Files/Tableau"])
+        self.server = fake_winrm.FakeWinRMServer(handlers=self.stand_in.handlers(),
+                                                 username="tableau_dr@LOGON",
+                                                 password="secret")
+        self.session = winrm.Session(self.server.start(),
+                                     auth=("tableau_dr@LOGON", "secret"),
+                                     transport="plaintext",
+                                     read_timeout_sec=10,
+                                     operation_timeout_sec=5)
+
+    def tearDown(self):
+        self.server.stop()
+
+    # A command takes a round trip to open the shell, run it, receive its output, signal and close the shell
+    def test_run_cmd(self):
+        response = self.session.run_cmd("C: & cd C:/Program Files/Tableau/10.0/bin & .\\tabadmin.exe status")
+        self.assertEqual(response.status_code, 0)
+        self.assertEqual(response.std_out, "Status: STOPPED\r\n")
+        self.session.run_cmd("C: & cd C:/Program Files/Tableau/10.0/bin & .\\tabadmin.exe start")
+        self.assertTrue(self.stand_in.running)
+        self.assertEqual(self.server.stats()["requests"], 10)
+
+    # PowerShell scripts are decoded before they are handled
+    def test_run_ps(self):
+        self.assertEqual(self.session.run_ps('$PathExists = Test-Path "C:/Program Files/Tableau"').status_code, 0)
+        self.assertEqual(self.session.run_ps('$PathExists = Test-Path "D:/Missing"').status_code, 1)
+        self.assertTrue("MaxMemoryPerShellMB = 2048" in self.session.run_ps("winrm get winrm/config").std_out)
+        self.assertEqual(self.server.stats()["commands"][-1], "winrm get winrm/config")
+
+    def test_injected_failures(self):
+        self.server.inject_failure(fake_winrm.FAIL_HTTP_ERROR)
+        self.assertRaises(winrm_exc.WinRMTransportError, self.session.run_cmd, "whoami")
+        self.server.inject_failure(fake_winrm.FAIL_AUTH)
+        self.assertRaises(winrm_exc.InvalidCredentialsError, self.session.run_cmd, "whoami")
+        # Operation timeouts on receiving the output are retried by the client
+        self.server.inject_failure(fake_winrm.FAIL_OPERATION_TIMEOUT, count=2, action=fake_winrm.ACTION_RECEIVE)
+        self.server.reset_stats()
+        self.assertEqual(self.session.run_cmd("whoami").std_out, "logon\\tableau_dr\r\n")
+        self.assertEqual(self.server.stats()["actions"]["Receive"], 3)
+        self.assertEqual(self.server.stats()["failures_injected"], 2)
+
+    def test_wrong_credentials(self):
+        session = winrm.Session(self.server.address(), auth=("tableau_dr@LOGON", "wrong"), transport="plaintext")
+        self.assertRaises(winrm_exc.InvalidCredentialsError, session.run_cmd, "whoami")
+
+    # Commands running longer than the operation timeout are polled until they are done
+    def test_long_running_command(self):
+        self.stand_in.operation_duration_sec = 1.5
+        self.server.operation_timeout_sec = 0.5
+        start_time = time.time()
+        self.assertEqual(self.session.run_cmd(".\\tabadmin.exe stop").status_code, 0)
+        self.assertTrue(time.time() - start_time >= 1.5)
+        self.assertTrue(self.server.stats()["actions"]["Receive"] >= 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import tempfile
+import shutil
+import os
+import tableau_dr.mount_benchmark as mount_benchmark
+
+
+class TestMountBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.temp_dir, "extracts", "a"))
+        with open(os.path.join(self.temp_dir, "extracts", "a", "big.tde"), "wb") as f:
+            f.write("x" * 3 * 1048576)
+        with open(os.path.join(self.temp_dir, "small.txt"), "wb") as f:
+            f.write("x")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    # Every directory and file of the tree is counted
+    def test_measure_directory_walk(self):
+        walk_result = mount_benchmark.measure_directory_walk(self.temp_dir, 30)
+        self.assertEqual(walk_result["entries"], 4)
+        self.assertEqual(sorted([x[1] for x in walk_result["files"]]), [1, 3 * 1048576])
+
+    # Reading stops at the byte limit
+    def test_measure_sequential_read(self):
+        walk_result = mount_benchmark.measure_directory_walk(self.temp_dir, 30)
+        self.assertTrue(mount_benchmark.measure_sequential_read(walk_result["files"], 1048576, 30) > 0)
+        self.assertEqual(mount_benchmark.measure_sequential_read([], 1048576, 30), None)
+
+    # The profile follows whether copying data or scanning the tree takes longer
+    def test_recommend_profile(self):
+        walk_result = {"entries": 1000, "entries_per_sec": 100.0, "files": [("a", 100 * 1048576)]}
+        self.assertEqual(mount_benchmark.recommend_profile(walk_result, 50.0), "metadata-heavy")
+        self.assertEqual(mount_benchmark.recommend_profile(walk_result, 5.0), "bulk-copy")
+        self.assertEqual(mount_benchmark.recommend_profile(walk_result, None), None)
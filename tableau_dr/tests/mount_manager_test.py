@@ -0,0 +1,60 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import tempfile
+import shutil
+import time
+import tableau_dr.mount_manager as mount_manager
+
+
+class TestMountManager(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    # A command that does not finish in time is not waited for
+    def test_run_with_timeout(self):
+        start_time = time.time()
+        returncode, stdout, stderr = mount_manager.run_with_timeout(["sleep", "5"], 0.2)
+        self.assertEqual(returncode, None)
+        self.assertTrue(time.time() - start_time < 2)
+
+        returncode, stdout, stderr = mount_manager.run_with_timeout(["echo", "share"], 5)
+        self.assertEqual((returncode, stdout), (0, "share\n"))
+
+    # A directory that is not a mount point is reported as not mounted
+    def test_probe_not_mounted(self):
+        result = mount_manager.probe_mount(self.temp_dir, 5)
+        self.assertEqual(result["state"], mount_manager.MOUNT_NOT_MOUNTED)
+        self.assertEqual(result["latency_ms"], None)
+
+    # An unhealthy share is remounted until the attempts run out
+    def test_ensure_healthy_remounts(self):
+        remounted_paths = []
+        manager = mount_manager.MountManager(mounts={"source": self.temp_dir},
+                                             remount_function=lambda x: remounted_paths.append(x),
+                                             probe_timeout_sec=5,
+                                             max_remount_attempts=2)
+        self.assertRaises(mount_manager.MountManagerException, manager.ensure_healthy)
+        self.assertEqual(remounted_paths, [self.temp_dir, self.temp_dir])
+        self.assertEqual(manager.health()["source"]["state"], mount_manager.MOUNT_NOT_MOUNTED)
+        self.assertEqual(manager.latency_ms("source"), None)
@@ -0,0 +1,81 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import tempfile
+import shutil
+import os
+import tableau_dr.pg_bundle as pg_bundle
+
+BUILD_PROCEDURE = ["./configure --prefix={prefix} --with-openssl", "make", "sudo make install"]
+
+
+class TestPgBundle(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache = pg_bundle.PgBundleCache(bundle_dir=os.path.join(self.temp_dir, "pg_bundles"),
+                                             version="9.5.3",
+                                             build_procedure=BUILD_PROCEDURE)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    # Builds differing in version, flags or platform get different bundles
+    def test_bundle_key(self):
+        key = pg_bundle.bundle_key("9.5.3", BUILD_PROCEDURE, "centos-7-x86_64")
+        self.assertEqual(key, pg_bundle.bundle_key("9.5.3", list(BUILD_PROCEDURE), "centos-7-x86_64"))
+        self.assertNotEqual(key, pg_bundle.bundle_key("9.5.4", BUILD_PROCEDURE, "centos-7-x86_64"))
+        self.assertNotEqual(key, pg_bundle.bundle_key("9.5.3", BUILD_PROCEDURE[1:], "centos-7-x86_64"))
+        self.assertNotEqual(key, pg_bundle.bundle_key("9.5.3", BUILD_PROCEDURE, "ubuntu-16-x86_64"))
+
+    # A bundle is only found once it has been published
+    def test_publish_and_find(self):
+        self.assertEqual(self.cache.find(), None)
+        temp_path = self.cache.temp_path()
+        with open(temp_path, "w") as f:
+            f.write("bundle")
+        self.assertEqual(self.cache.find(), None)
+        self.cache.publish(temp_path)
+        self.assertEqual(self.cache.find(), self.cache.bundle_path)
+
+        self.cache.discard()
+        self.assertEqual(self.cache.find(), None)
+
+    # An empty package is not published
+    def test_publish_empty_bundle(self):
+        temp_path = self.cache.temp_path()
+        open(temp_path, "w").close()
+        self.assertRaises(pg_bundle.PgBundleException, self.cache.publish, temp_path)
+        self.assertEqual(self.cache.find(), None)
+
+    # Tableau Server versions are matched on major and minor version
+    def test_postgres_version_for_tableau(self):
+        version_matrix = {"10.0": "9.5.3", "10.1": "9.5.3", "10.5": "9.6.5"}
+        self.assertEqual(pg_bundle.postgres_version_for_tableau("10.1", version_matrix), "9.5.3")
+        self.assertEqual(pg_bundle.postgres_version_for_tableau("10.5.2", version_matrix), "9.6.5")
+        self.assertEqual(pg_bundle.postgres_version_for_tableau(10.0, version_matrix), "9.5.3")
+        self.assertRaises(pg_bundle.PgBundleException, pg_bundle.postgres_version_for_tableau, "9.3",
+                          version_matrix)
+
+    # The major version is the first two parts before Postgres 10 and the first part since
+    def test_postgres_major_version(self):
+        self.assertEqual(pg_bundle.postgres_major_version("9.5.3"), "9.5")
+        self.assertEqual(pg_bundle.postgres_major_version("9.6"), "9.6")
+        self.assertEqual(pg_bundle.postgres_major_version("10.4"), "10")
+        self.assertEqual(pg_bundle.postgres_major_version("9.5.3 (Debian)"), "9.5")
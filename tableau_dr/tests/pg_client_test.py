@@ -0,0 +1,53 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import tableau_dr.pg_client as pg_client
+
+
+class TestPgClient(unittest.TestCase):
+
+    # Server errors are classified by their SQLSTATE
+    def test_classify_error_by_sqlstate(self):
+        self.assertEqual(pg_client.classify_error("FATAL:  password authentication failed", "28P01"),
+                         pg_client.AUTHENTICATION_FAILED)
+        self.assertEqual(pg_client.classify_error("FATAL:  no pg_hba.conf entry", "28000"),
+                         pg_client.NO_HBA_ENTRY)
+
+    # Connection failures reported by libpq have no SQLSTATE
+    def test_classify_error_by_message(self):
+        self.assertEqual(pg_client.classify_error("could not connect to server: Connection refused"),
+                         pg_client.CONNECTION_REFUSED)
+        self.assertEqual(pg_client.classify_error("fe_sendauth: no password supplied"),
+                         pg_client.NO_PASSWORD)
+        self.assertEqual(pg_client.classify_error("FATAL:  no pg_hba.conf entry for host \"10.0.1.34\""),
+                         pg_client.NO_HBA_ENTRY)
+        self.assertEqual(pg_client.classify_error("ERROR:  division by zero", "22012"), pg_client.UNKNOWN_ERROR)
+
+    # Parameters of queries run by psql are quoted as SQL literals
+    def test_quote_literal(self):
+        self.assertEqual(pg_client.quote_literal("tableau"), "'tableau'")
+        self.assertEqual(pg_client.quote_literal("o'brien"), "'o''brien'")
+        self.assertEqual(pg_client.quote_literal(8060), "8060")
+        self.assertEqual(pg_client.quote_literal(None), "NULL")
+        self.assertEqual(pg_client.quote_literal(True), "true")
+
+    # Values are returned as text the same way psql prints them
+    def test_to_psql_text(self):
+        self.assertEqual(map(pg_client.to_psql_text, [True, False, None, 3, "16/B374D848"]),
+                         ["t", "f", "", "3", "16/B374D848"])
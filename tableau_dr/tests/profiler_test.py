@@ -0,0 +1,94 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+
+import unittest
+import tempfile
+import shutil
+import json
+import time
+import os
+import tableau_dr.profiler as profiler
+
+
+class ProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        profiler.stop(self.output_dir)
+        shutil.rmtree(self.output_dir)
+
+    def test_command_name(self):
+        self.assertEqual(profiler.command_name("sudo /usr/pgsql/bin/pg_dump -F t -f /tmp/x"), "pg_dump")
+        self.assertEqual(profiler.command_name("PGPASSWORD=secret psql -h host -c 'SELECT 1;'"), "psql")
+        self.assertEqual(profiler.command_name('cd "C:\\Tableau\\bin"; & .\\tabadmin.exe restore --password s'),
+                         "tabadmin")
+        self.assertEqual(profiler.command_name("Test-Path 'C:\\ProgramData\\Tableau'"), "Test-Path")
+        self.assertEqual(profiler.command_name(""), "unknown")
+
+    def test_span_without_profiling(self):
+        with profiler.span("noop", path="x"):
+            pass
+        self.assertEqual(os.listdir(self.output_dir), [])
+
+    def test_trace_and_stacks(self):
+        profiler.start(self.output_dir, sample_interval_sec=0.001)
+        self.assertRaises(profiler.ProfilerException, profiler.start, self.output_dir)
+        with profiler.span("execute_cmd", command="7z"):
+            time.sleep(0.05)
+        try:
+            with profiler.span("failing"):
+                raise ValueError("failed")
+        except ValueError:
+            pass
+        profiler.stop(self.output_dir)
+
+        trace_files = [x for x in os.listdir(self.output_dir) if x.startswith("trace-")]
+        stacks_files = [x for x in os.listdir(self.output_dir) if x.startswith("profile-")]
+        self.assertEqual(len(trace_files), 1)
+        self.assertEqual(len(stacks_files), 1)
+
+        with open(os.path.join(self.output_dir, trace_files[0])) as f:
+            trace = json.load(f)
+        spans = [x for x in trace["traceEvents"] if x["ph"] == "X"]
+        self.assertEqual([x["name"] for x in spans], ["execute_cmd", "failing"])
+        self.assertEqual(spans[0]["args"], {"command": "7z"})
+        self.assertGreaterEqual(spans[0]["dur"], 50000)
+        self.assertEqual(len([x for x in trace["traceEvents"] if x["ph"] == "M"]), 1)
+
+        with open(os.path.join(self.output_dir, stacks_files[0])) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(len(lines) > 0)
+        stack, count = lines[0].rsplit(" ", 1)
+        self.assertTrue(stack.startswith("MainThread;"))
+        self.assertTrue(int(count) > 0)
+        self.assertTrue(any(["profiler_test.py:test_trace_and_stacks" in x for x in lines]))
+
+    def test_max_trace_events(self):
+        test_profiler = profiler.Profiler(max_trace_events=2)
+        for i in range(5):
+            test_profiler.add_span("span", time.time(), time.time())
+        self.assertEqual(len(test_profiler.trace()["traceEvents"]), 2 + 1)
+        self.assertEqual(test_profiler.dropped_events, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
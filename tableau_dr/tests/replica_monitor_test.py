@@ -0,0 +1,63 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import unittest
+import tempfile
+import shutil
+import os
+import tableau_dr.replica_monitor as replica_monitor
+
+
+class TestReplicaMonitor(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    # Test that WAL locations are converted to byte positions
+    def test_wal_location_to_bytes(self):
+        self.assertEqual(replica_monitor.wal_location_to_bytes("0/3000060"), 0x3000060)
+        self.assertEqual(replica_monitor.wal_location_to_bytes("16/B374D848"), (0x16 << 32) + 0xB374D848)
+        self.assertIsNone(replica_monitor.wal_location_to_bytes(None))
+
+    # Test that lag is computed in bytes and seconds, and an idle primary does not count as lag
+    def test_replication_lag(self):
+        lag = replica_monitor.replication_lag(primary_location="1/100",
+                                              receive_location="1/80",
+                                              replay_location="1/40",
+                                              replay_age_sec=12.5)
+        self.assertEqual(lag, {"receive_lag_bytes": 0x80,
+                               "replay_lag_bytes": 0xC0,
+                               "replay_lag_sec": 12.5})
+        lag = replica_monitor.replication_lag(primary_location="1/100",
+                                              receive_location="1/100",
+                                              replay_location="1/100",
+                                              replay_age_sec=3600)
+        self.assertEqual(lag["replay_lag_sec"], 0.0)
+
+    # Test that the history keeps at most the configured number of samples
+    def test_history_trimming(self):
+        history = replica_monitor.LagHistory(os.path.join(self.temp_dir, "replica_lag.jsonl"), max_samples=10)
+        for i in range(25):
+            history.append({"timestamp": i})
+        samples = history.samples()
+        self.assertLessEqual(len(samples), 11)
+        self.assertEqual(history.latest(), {"timestamp": 24})
@@ -0,0 +1,86 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import unittest
+import datetime
+import tableau_dr.replication_scheduler as replication_scheduler
+
+
+class TestReplicationScheduler(unittest.TestCase):
+
+    throttle_windows = [{"days": ["mon", "tue", "wed", "thu", "fri"],
+                         "from_min": 8 * 60,
+                         "to_min": 18 * 60,
+                         "bandwidth_limit_kbps": {"source_sync": 10000}},
+                        {"days": ["fri"],
+                         "from_min": 22 * 60,
+                         "to_min": 2 * 60,
+                         "bandwidth_limit_kbps": {"source_sync": 5000}}]
+
+    # Test that the budget follows the time windows, including windows spanning midnight
+    def test_window_budget(self):
+        monday_noon = datetime.datetime(2017, 1, 2, 12, 0)
+        monday_evening = datetime.datetime(2017, 1, 2, 19, 0)
+        saturday_early = datetime.datetime(2017, 1, 7, 1, 0)
+        self.assertEqual(replication_scheduler.window_budget_kbps(self.throttle_windows, "source_sync", monday_noon),
+                         10000)
+        self.assertEqual(replication_scheduler.window_budget_kbps(self.throttle_windows, "sync_target", monday_noon),
+                         0)
+        self.assertEqual(replication_scheduler.window_budget_kbps(self.throttle_windows, "source_sync",
+                                                                  monday_evening), 0)
+        self.assertEqual(replication_scheduler.window_budget_kbps(self.throttle_windows, "source_sync",
+                                                                  saturday_early), 5000)
+
+    # Test that the limit is halved while the source is slow and replication is running
+    def test_back_off_on_latency(self):
+        self.assertEqual(replication_scheduler.next_bandwidth_limit_kbps(current_kbps=10000,
+                                                                         budget_kbps=10000,
+                                                                         observed_kbps=9000,
+                                                                         latency_ms=500,
+                                                                         max_latency_ms=200), 4500)
+        self.assertEqual(replication_scheduler.next_bandwidth_limit_kbps(current_kbps=0,
+                                                                         budget_kbps=0,
+                                                                         observed_kbps=40000,
+                                                                         latency_ms=500,
+                                                                         max_latency_ms=200), 20000)
+        # Idle replication is not the cause of the latency
+        self.assertEqual(replication_scheduler.next_bandwidth_limit_kbps(current_kbps=8000,
+                                                                         budget_kbps=10000,
+                                                                         observed_kbps=0,
+                                                                         latency_ms=500,
+                                                                         max_latency_ms=200), 8000)
+
+    # Test that the limit recovers step by step up to the budget when the source is fast again
+    def test_recover_to_budget(self):
+        self.assertEqual(replication_scheduler.next_bandwidth_limit_kbps(current_kbps=4000,
+                                                                         budget_kbps=10000,
+                                                                         observed_kbps=4000,
+                                                                         latency_ms=20,
+                                                                         max_latency_ms=200), 5000)
+        self.assertEqual(replication_scheduler.next_bandwidth_limit_kbps(current_kbps=9000,
+                                                                         budget_kbps=10000,
+                                                                         observed_kbps=9000,
+                                                                         latency_ms=20,
+                                                                         max_latency_ms=200), 10000)
+        # Without a budget the limit is removed once it does not hold replication back
+        self.assertEqual(replication_scheduler.next_bandwidth_limit_kbps(current_kbps=4000,
+                                                                         budget_kbps=0,
+                                                                         observed_kbps=1000,
+                                                                         latency_ms=20,
+                                                                         max_latency_ms=200), 0)
@@ -0,0 +1,112 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+
+import threading
+import unittest
+import rescue_service
+from rescue_group import RescueGroup
+
+
+class FakeEnvManager:
+
+    def __init__(self, name):
+        self.rescue_dir = "/tmp/%s" % name
+        self.pg_port = None
+        self.cluster_source_pg_data_dir = None
+        self.cluster_target_pg_data_dir = None
+        self.sync_full_path = "/tmp/%s/sync" % name
+        self.backups_dir = "/tmp/%s/backups" % name
+        self.backup_staging_dir = "/tmp/%s/staging" % name
+
+
+class FakeMountManager:
+
+    def ensure_healthy(self, names=None):
+        pass
+
+
+class FakeExtractSeeder:
+
+    def __init__(self):
+        self.calls = []
+
+    def seed(self, dry_run=False, trust_index=False):
+        self.calls.append({"dry_run": dry_run, "trust_index": trust_index})
+        return {"duration_sec": 0.0}
+
+
+# Rescue group running its real operations on fake components
+class FakeRescueGroup(RescueGroup):
+
+    def __init__(self, name, config_file_path):
+        self.name = name
+        self.lock = threading.RLock()
+        self.last_operation = None
+        self.last_error = None
+        self.env_manager = FakeEnvManager(name)
+        self.target_server = object()
+        self.mount_manager = FakeMountManager()
+        self.extract_seeder = FakeExtractSeeder()
+
+    def status(self):
+        return {"rescue_group": self.name, "last_operation": self.last_operation, "last_error": self.last_error}
+
+
+class RescueServiceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.original_rescue_group = rescue_service.RescueGroup
+        self.original_parse_config_file = rescue_service.utils.parse_config_file
+        rescue_service.RescueGroup = FakeRescueGroup
+        rescue_service.utils.parse_config_file = lambda config_file_path: {"group1": {}, "group2": {}}
+        self.service = rescue_service.RescueService(config_file_path="config.yml", max_parallel_operations=1)
+
+    def tearDown(self):
+        rescue_service.RescueGroup = self.original_rescue_group
+        rescue_service.utils.parse_config_file = self.original_parse_config_file
+
+    def test_preseed(self):
+        status = self.service.handle_request({"command": "preseed",
+                                              "rescue_group": "group1",
+                                              "arguments": {"dry_run": True, "trust_index": False}})
+        self.assertEqual(status["last_operation"], "preseed")
+        self.assertIsNone(status["last_error"])
+        self.assertEqual(self.service.rescue_groups["group1"].extract_seeder.calls,
+                         [{"dry_run": True, "trust_index": False}])
+        self.assertEqual(self.service.rescue_groups["group2"].extract_seeder.calls, [])
+
+    def test_unknown_command(self):
+        self.assertRaises(rescue_service.RescueServiceException,
+                          self.service.handle_request, {"command": "unknown", "rescue_group": "group1"})
+
+    def test_shared_storage_dirs(self):
+        env_manager1 = self.service.rescue_groups["group1"].env_manager
+        env_manager2 = self.service.rescue_groups["group2"].env_manager
+        for attribute in ["sync_full_path", "backups_dir", "backup_staging_dir"]:
+            original_value = getattr(env_manager2, attribute)
+            setattr(env_manager2, attribute, getattr(env_manager1, attribute))
+            self.assertRaises(rescue_service.RescueServiceException,
+                              self.service._RescueService__validate_group_isolation)
+            setattr(env_manager2, attribute, original_value)
+        self.service._RescueService__validate_group_isolation()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import unittest
+import tempfile
+import shutil
+import os
+import tableau_dr.snapshot as snapshot
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.sync_dir = os.path.join(self.temp_dir, "sync", "dataengine")
+        os.makedirs(os.path.join(self.sync_dir, "extract", "a"))
+        with open(os.path.join(self.sync_dir, "extract", "a", "1.tde"), "w") as f:
+            f.write("old")
+        os.symlink("a", os.path.join(self.sync_dir, "extract", "b"))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    # Hardlinked files share their inode, replacing a file in the sync tree leaves the snapshot unchanged
+    def test_hardlink_snapshot(self):
+        snapshot_dir = os.path.join(self.temp_dir, "staging", "dataengine")
+        self.assertEqual(snapshot.snapshot_tree(self.sync_dir, snapshot_dir, method="hardlink"), "hardlink")
+        source_file = os.path.join(self.sync_dir, "extract", "a", "1.tde")
+        snapshot_file = os.path.join(snapshot_dir, "extract", "a", "1.tde")
+        self.assertEqual(os.stat(source_file).st_ino, os.stat(snapshot_file).st_ino)
+        self.assertEqual(os.readlink(os.path.join(snapshot_dir, "extract", "b")), "a")
+
+        # rsync writes a temporary file and renames it over the old one
+        with open(source_file + ".tmp", "w") as f:
+            f.write("new")
+        os.rename(source_file + ".tmp", source_file)
+        with open(snapshot_file) as f:
+            self.assertEqual(f.read(), "old")
+
+    # A copy does not share inodes
+    def test_copy_snapshot(self):
+        snapshot_dir = os.path.join(self.temp_dir, "dataengine")
+        self.assertEqual(snapshot.snapshot_tree(self.sync_dir, snapshot_dir, method="copy"), "copy")
+        self.assertNotEqual(os.stat(os.path.join(self.sync_dir, "extract", "a", "1.tde")).st_ino,
+                            os.stat(os.path.join(snapshot_dir, "extract", "a", "1.tde")).st_ino)
+
+    # On the same filesystem auto never copies the data
+    def test_auto_snapshot(self):
+        snapshot_dir = os.path.join(self.temp_dir, "dataengine")
+        self.assertTrue(snapshot.same_filesystem(self.sync_dir, snapshot_dir))
+        self.assertTrue(snapshot.snapshot_tree(self.sync_dir, snapshot_dir) in ["reflink", "hardlink"])
+        self.assertTrue(os.path.exists(os.path.join(snapshot_dir, "extract", "a", "1.tde")))
+
+    # A missing source gives an empty directory, an existing destination is not overwritten
+    def test_snapshot_edge_cases(self):
+        snapshot_dir = os.path.join(self.temp_dir, "webdataconnectors")
+        self.assertEqual(snapshot.snapshot_tree(os.path.join(self.temp_dir, "missing"), snapshot_dir), None)
+        self.assertEqual(os.listdir(snapshot_dir), [])
+        self.assertRaises(snapshot.SnapshotException, snapshot.snapshot_tree, self.sync_dir, snapshot_dir)
+        self.assertRaises(snapshot.SnapshotException, snapshot.snapshot_tree, self.sync_dir,
+                          os.path.join(self.temp_dir, "x"), "rsync")
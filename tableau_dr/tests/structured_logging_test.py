@@ -0,0 +1,142 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+
+import unittest
+import tempfile
+import logging
+import shutil
+import json
+import os
+import defaults as d
+import tableau_dr.structured_logging as structured_logging
+
+
+class ListHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class StructuredLoggingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.logger = logging.getLogger("structured_logging_test")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+
+    def tearDown(self):
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+            handler.close()
+        shutil.rmtree(self.log_dir)
+
+    def add_async_handler(self, handlers, queue_size=d.LOG_QUEUE_SIZE):
+        async_handler = structured_logging.AsyncHandler(handlers, queue_size=queue_size)
+        async_handler.addFilter(structured_logging.OperationFilter())
+        self.logger.addHandler(async_handler)
+        return async_handler
+
+    def test_truncate(self):
+        self.assertEqual(structured_logging.truncate("short", 10), "short")
+        truncated = structured_logging.truncate("a" * 50 + "b" * 50, 20)
+        self.assertTrue(truncated.startswith("a" * 10))
+        self.assertTrue(truncated.endswith("b" * 10))
+        self.assertIn("[80 characters truncated]", truncated)
+
+    def test_json_records_with_operation(self):
+        list_handler = ListHandler()
+        async_handler = self.add_async_handler([list_handler])
+        with structured_logging.operation("backup", rescue_group="group1") as outer:
+            self.logger.info("Dump output: %s", "x" * (d.LOG_MAX_MESSAGE_CHARS * 2))
+            with structured_logging.operation("verify_backup") as inner:
+                self.logger.debug("Verifying...")
+        self.logger.warning("Outside")
+        async_handler.flush()
+
+        entries = [json.loads(structured_logging.JsonFormatter().format(x)) for x in list_handler.records]
+        self.assertEqual(entries[0]["operation"], "backup")
+        self.assertEqual(entries[0]["operation_id"], outer["operation_id"])
+        self.assertEqual(entries[0]["rescue_group"], "group1")
+        self.assertLess(len(entries[0]["message"]), d.LOG_MAX_MESSAGE_CHARS + 100)
+        self.assertEqual(entries[1]["operation_id"], inner["operation_id"])
+        self.assertEqual(entries[1]["parent_operation_id"], outer["operation_id"])
+        self.assertEqual(entries[1]["level"], "DEBUG")
+        self.assertNotIn("operation_id", entries[-1])
+        self.assertEqual(entries[-1]["message"], "Outside")
+
+    def test_operation_logs_duration_and_failure(self):
+        root_logger = logging.getLogger()
+        list_handler = ListHandler()
+        root_logger.addHandler(list_handler)
+        try:
+            with self.assertRaises(ValueError):
+                with structured_logging.operation("resync"):
+                    raise ValueError("no replica")
+        finally:
+            root_logger.removeHandler(list_handler)
+        self.assertEqual(list_handler.records[-1].levelno, logging.ERROR)
+        self.assertIn("resync has failed", list_handler.records[-1].getMessage())
+        self.assertTrue(list_handler.records[-1].duration_sec >= 0)
+        self.assertIsNone(structured_logging.current_operation())
+
+    def test_full_queue_drops_records(self):
+        list_handler = ListHandler()
+        list_handler.acquire()  # Blocks the logging thread
+        async_handler = self.add_async_handler([list_handler], queue_size=2)
+        try:
+            for i in range(10):
+                self.logger.info("Record %d", i)
+        finally:
+            list_handler.release()
+        async_handler.close()
+        self.assertTrue(async_handler.dropped_records >= 7)
+        # The drops are reported before the next queued record and on close, possibly in several reports
+        reported_drops = [int(x.getMessage().split()[0]) for x in list_handler.records
+                          if x.getMessage().endswith("log records have been dropped, the log queue was full!")]
+        self.assertTrue(len(reported_drops) > 0)
+        self.assertEqual(sum(reported_drops), async_handler.dropped_records)
+
+    def test_exception_is_formatted(self):
+        list_handler = ListHandler()
+        async_handler = self.add_async_handler([list_handler])
+        try:
+            raise RuntimeError("broken")
+        except RuntimeError:
+            self.logger.exception("Failed")
+        async_handler.flush()
+        entry = json.loads(structured_logging.JsonFormatter().format(list_handler.records[0]))
+        self.assertIn("RuntimeError: broken", entry["exception"])
+
+    def test_invalid_syslog_address(self):
+        self.assertRaises(structured_logging.StructuredLoggingException,
+                          structured_logging.create_syslog_handler, os.path.join(self.log_dir, "missing.sock"))
+        self.assertRaises(structured_logging.StructuredLoggingException,
+                          structured_logging.create_syslog_handler, "localhost:syslog")
+        syslog_handler = structured_logging.create_syslog_handler("localhost:5514")
+        syslog_handler.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
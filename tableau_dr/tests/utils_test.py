@@ -46,4 +46,28 @@ class TestUtils(unittest.TestCase):
                                                        "/home/brilliant/clusters/prod/tableau_data/data/tabsvc/httpd/htdocs/webdataconnectors/",
                                                        "/home/brilliant/clusters/prod_sync/tableau_data/data/tabsvc/httpd/htdocs/webdataconnectors")
         self.assertEqual(switched_job,
-                         "* * * * * rsync -a -v --delete /home/brilliant/clusters/prod_sync/tableau_data/data/tabsvc/httpd/htdocs/webdataconnectors/ /home/brilliant/clusters/prod/tableau_data/data/tabsvc/httpd/htdocs/webdataconnectors")
\ No newline at end of file
+                         "* * * * * rsync -a -v --delete /home/brilliant/clusters/prod_sync/tableau_data/data/tabsvc/httpd/htdocs/webdataconnectors/ /home/brilliant/clusters/prod/tableau_data/data/tabsvc/httpd/htdocs/webdataconnectors")
+
+    # Test that file counts and sizes are parsed from rsync statistics
+    def test_parse_rsync_stats(self):
+        rsync_output = "Number of files: 1,204 (reg: 1,150, dir: 54)\n" \
+                       "Number of created files: 2\n" \
+                       "Number of regular files transferred: 17\n" \
+                       "Total file size: 1,048,576,000 bytes\n" \
+                       "Total transferred file size: 9,437,184 bytes\n"
+        self.assertEqual(utils.parse_rsync_stats(rsync_output), {"files": 1204,
+                                                                  "transferred_files": 17,
+                                                                  "total_bytes": 1048576000,
+                                                                  "transferred_bytes": 9437184})
+
+    # Test that transferred and total sizes are parsed from pg_basebackup progress lines
+    def test_parse_basebackup_progress(self):
+        self.assertEqual(utils.parse_basebackup_progress("20480/81920 kB (25%), 0/1 tablespace"),
+                         (20971520, 83886080))
+        self.assertEqual(utils.parse_basebackup_progress("NOTICE:  pg_stop_backup complete"), None)
+
+    # Test that the estimated time left is derived from the average rate
+    def test_format_progress(self):
+        self.assertEqual(utils.format_progress(10485760, 41943040, 10),
+                         "10.0 of 40.0 MB (25%), 1.0 MB/s, ETA 00:00:30")
+        self.assertEqual(utils.format_progress(0, 41943040, 0), "0.0 of 40.0 MB (0%), 0.0 MB/s")
@@ -0,0 +1,86 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import tempfile
+import shutil
+import os
+from tableau_dr.validation_cache import ValidationCache
+
+
+class TestValidationCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_file_path = os.path.join(self.temp_dir, "validation_cache.json")
+        self.fingerprints = {"config": "a"}
+        self.executed_checks = []
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def __get_cache(self, ttl_sec=600):
+        return ValidationCache(cache_file_path=self.cache_file_path,
+                               ttl_sec_by_check={"check": ttl_sec},
+                               default_ttl_sec=600,
+                               trigger_functions={"config": lambda: self.fingerprints["config"]})
+
+    def __check(self):
+        self.executed_checks.append("check")
+
+    def __failing_check(self):
+        self.executed_checks.append("failing_check")
+        raise Exception("Check failed!")
+
+    # Test that a successful check is skipped within its TTL, even by a new cache object
+    def test_skip_within_ttl(self):
+        self.__get_cache().run_check("check", self.__check, triggers=["config"])
+        self.__get_cache().run_check("check", self.__check, triggers=["config"])
+        self.assertEqual(self.executed_checks, ["check"])
+
+    # Test that a check is rerun when its inputs change
+    def test_rerun_on_trigger_change(self):
+        cache = self.__get_cache()
+        cache.run_check("check", self.__check, triggers=["config"])
+        self.fingerprints["config"] = "b"
+        cache.run_check("check", self.__check, triggers=["config"])
+        self.assertEqual(self.executed_checks, ["check", "check"])
+
+    # Test that a check is rerun after its TTL has expired
+    def test_rerun_after_ttl(self):
+        cache = self.__get_cache(ttl_sec=0)
+        cache.run_check("check", self.__check)
+        cache.run_check("check", self.__check)
+        self.assertEqual(self.executed_checks, ["check", "check"])
+
+    # Test that failed checks are not cached
+    def test_failure_not_cached(self):
+        cache = self.__get_cache()
+        for i in range(2):
+            with self.assertRaises(Exception):
+                cache.run_check("check", self.__failing_check)
+        self.assertEqual(self.executed_checks, ["failing_check", "failing_check"])
+
+    # Test that forcing and invalidating makes the check run again
+    def test_force_and_invalidate(self):
+        cache = self.__get_cache()
+        cache.run_check("check", self.__check)
+        cache.run_check("check", self.__check, force=True)
+        cache.invalidate()
+        cache.run_check("check", self.__check)
+        self.assertEqual(self.executed_checks, ["check", "check", "check"])
@@ -0,0 +1,110 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import unittest
+import tempfile
+import tarfile
+import shutil
+import json
+import time
+import os
+import tableau_dr.wal_archive as wal_archive
+
+
+class TestWalArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.archive = wal_archive.WalArchive(env_manager=None,
+                                              source_host="10.0.1.1",
+                                              archive_root_dir=self.temp_dir,
+                                              retention_sec=3600,
+                                              base_backup_interval_sec=600)
+        os.makedirs(self.archive.wal_dir)
+        os.makedirs(self.archive.base_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def __add_base_backup(self, name, finish_time, start_segment):
+        base_backup_dir = os.path.join(self.archive.base_dir, name)
+        os.makedirs(base_backup_dir)
+        with open(os.path.join(base_backup_dir, "backup_info.json"), "w") as f:
+            json.dump({"name": name,
+                       "start_time": finish_time - 60,
+                       "finish_time": finish_time,
+                       "start_segment": start_segment}, f)
+
+    # Test that the newest base backup before the retention window is kept
+    def test_expired_base_backups(self):
+        base_backups = [{"name": "a", "finish_time": 100},
+                        {"name": "b", "finish_time": 200},
+                        {"name": "c", "finish_time": 300}]
+        self.assertEqual(wal_archive.expired_base_backups(base_backups, 250), [{"name": "a", "finish_time": 100}])
+        self.assertEqual(wal_archive.expired_base_backups(base_backups, 50), [])
+
+    # Test that retention deletes base backups and the WAL only they needed
+    def test_apply_retention(self):
+        now = time.time()
+        self.__add_base_backup("old", now - 7200, "000000010000000000000002")
+        self.__add_base_backup("before_window", now - 5400, "000000010000000000000004")
+        self.__add_base_backup("in_window", now - 600, "000000010000000000000006")
+        for segment in ["000000010000000000000001", "000000010000000000000003", "000000010000000000000005",
+                        "000000010000000000000007.partial", "00000002.history"]:
+            open(os.path.join(self.archive.wal_dir, segment), "w").close()
+
+        self.archive.apply_retention()
+
+        self.assertEqual(map(lambda x: x["name"], self.archive.base_backups()), ["before_window", "in_window"])
+        self.assertEqual(sorted(os.listdir(self.archive.wal_dir)), ["000000010000000000000005",
+                                                                   "000000010000000000000007.partial",
+                                                                   "00000002.history"])
+
+    # Test that a recovery starts from the newest base backup finished before the requested time
+    def test_base_backup_for(self):
+        now = time.time()
+        self.__add_base_backup("first", now - 3000, "000000010000000000000002")
+        self.__add_base_backup("second", now - 1000, "000000010000000000000004")
+        self.assertEqual(self.archive.base_backup_for(now - 2000)["name"], "first")
+        self.assertEqual(self.archive.base_backup_for(now)["name"], "second")
+        with self.assertRaises(wal_archive.WalArchiveException):
+            self.archive.base_backup_for(now - 4000)
+
+    # Test that a base backup is not started while another one is in progress
+    def test_take_base_backup_in_progress(self):
+        nested_results = []
+
+        class FakeEnvManager:
+            def archive_base_backup(env_manager, source_host, base_backup_dir, pgpass_file_path):
+                nested_results.append(self.archive.take_base_backup())
+                os.makedirs(base_backup_dir)
+                backup_label = "START WAL LOCATION: 0/2000028 (file 000000010000000000000002)\n"
+                label_path = os.path.join(self.temp_dir, "backup_label")
+                with open(label_path, "w") as f:
+                    f.write(backup_label)
+                with tarfile.open(os.path.join(base_backup_dir, "base.tar.gz"), "w:gz") as base_backup_tar:
+                    base_backup_tar.add(label_path, arcname="backup_label")
+
+        self.archive.env_manager = FakeEnvManager()
+        self.assertTrue(self.archive.is_base_backup_due())
+        backup_info = self.archive.take_base_backup()
+
+        self.assertEqual(nested_results, [None])
+        self.assertEqual(backup_info["start_segment"], "000000010000000000000002")
+        self.assertFalse(self.archive.is_base_backup_due())
@@ -18,6 +18,9 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
 import yaml
+import socket
+import time
+import re
 
 # Clean string (remove excess spaces)
 def clean_str(str_to_clean):
@@ -61,4 +64,83 @@ def parse_config_file(config_file_path):
             config_data = yaml.load(f)
             return config_data
         except yaml.YAMLError, exc:
-            raise Exception("Error in configuration file: %s" % exc)
\ No newline at end of file
+            raise Exception("Error in configuration file: %s" % exc)
+
+
+# Function to parse the file counts and sizes from the output of rsync --stats
+def parse_rsync_stats(rsync_output):
+    stats_patterns = {"files": r"^Number of files: ([\d,]+)",
+                      "transferred_files": r"^Number of (?:regular )?files transferred: ([\d,]+)",
+                      "total_bytes": r"^Total file size: ([\d,]+) bytes",
+                      "transferred_bytes": r"^Total transferred file size: ([\d,]+) bytes"}
+    stats = {}
+    for stat_name, stat_pattern in stats_patterns.items():
+        match = re.search(stat_pattern, rsync_output, re.MULTILINE)
+        stats[stat_name] = int(match.group(1).replace(",", "")) if match is not None else None
+    return stats
+
+
+# Function to find a free TCP port on the local machine
+def get_free_port():
+    free_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        free_socket.bind(("localhost", 0))
+        return free_socket.getsockname()[1]
+    finally:
+        free_socket.close()
+
+
+# Function to parse the transferred and total kilobytes from a progress line of pg_basebackup --progress
+def parse_basebackup_progress(progress_line):
+    match = re.search(r"(\d+)/(\d+) kB", progress_line)
+    if match is None:
+        return None
+    return int(match.group(1)) * 1024, int(match.group(2)) * 1024
+
+
+# Function to describe the progress of a transfer with its rate and estimated time left
+def format_progress(done_bytes, total_bytes, elapsed_sec):
+    rate_bps = done_bytes / elapsed_sec if elapsed_sec > 0 else 0
+    progress_str = "%.1f of %.1f MB" % (done_bytes / 1048576.0, total_bytes / 1048576.0)
+    if total_bytes > 0:
+        progress_str += " (%d%%)" % min(100, done_bytes * 100 / total_bytes)
+    progress_str += ", %.1f MB/s" % (rate_bps / 1048576.0)
+    if rate_bps > 0 and total_bytes >= done_bytes:
+        progress_str += ", ETA %s" % time.strftime("%H:%M:%S", time.gmtime((total_bytes - done_bytes) / rate_bps))
+    return progress_str
+
+
+# Logs the progress of a long running transfer at most once per interval
+class ProgressReporter:
+
+    # Constructor
+    def __init__(self, transfer_name, log_interval_sec=10):
+        self.transfer_name = transfer_name
+        self.log_interval_sec = log_interval_sec
+        self.start_time = time.time()
+        self.last_log_time = self.start_time
+        self.done_bytes = 0
+        self.total_bytes = 0
+
+    def update(self, done_bytes, total_bytes):
+        self.done_bytes = done_bytes
+        self.total_bytes = total_bytes
+        now = time.time()
+        if now - self.last_log_time >= self.log_interval_sec:
+            self.last_log_time = now
+            logging.info("%s: %s" % (self.transfer_name, format_progress(done_bytes,
+                                                                          total_bytes,
+                                                                          now - self.start_time)))
+
+    def update_from_basebackup(self, progress_line):
+        progress = parse_basebackup_progress(progress_line)
+        if progress is None:
+            logging.debug(progress_line)  # Not a progress line, e.g. a notice about WAL archiving
+            return
+        self.update(*progress)
+
+    def finish(self):
+        elapsed_sec = time.time() - self.start_time
+        logging.info("%s has finished: %.1f MB in %d seconds" % (self.transfer_name,
+                                                                 self.done_bytes / 1048576.0,
+                                                                 elapsed_sec))
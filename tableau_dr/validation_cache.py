@@ -0,0 +1,127 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import hashlib
+import json
+import time
+import os
+import threading
+import psutil
+from crontab import CronTab
+
+
+# Fingerprint of the configuration file's content
+def config_file_fingerprint(config_file_path):
+    with open(config_file_path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+# Fingerprint of the mount table entries for the given paths
+def mounts_fingerprint(mount_paths):
+    relevant_partitions = sorted(["%s %s %s %s" % (item.device, item.mountpoint, item.fstype, item.opts)
+                                  for item in psutil.disk_partitions(all=True)
+                                  if item.mountpoint in mount_paths])
+    return hashlib.sha1("\n".join(relevant_partitions)).hexdigest()
+
+
+# Fingerprint of a user's crontab
+def crontab_fingerprint(user):
+    return hashlib.sha1(CronTab(user=user).render()).hexdigest()
+
+
+# Persisted results of validation checks, used to skip checks that have recently succeeded
+class ValidationCache:
+
+    # Constructor
+    def __init__(self, cache_file_path, ttl_sec_by_check, default_ttl_sec, trigger_functions):
+        logging.debug("Validation cache is being initialized at %s!" % cache_file_path)
+        self.cache_file_path = cache_file_path
+        self.ttl_sec_by_check = ttl_sec_by_check
+        self.default_ttl_sec = default_ttl_sec
+        self.trigger_functions = trigger_functions  # Name of invalidation trigger -> function returning fingerprint
+        self.__lock = threading.Lock()  # Checks may run in parallel
+        self.__entries = self.__load()
+
+    # Run a check unless it has succeeded within its TTL with the same inputs
+    def run_check(self, check_name, check_function, triggers=(), force=False):
+        fingerprint = self.__fingerprint(triggers)
+        entry = self.__entries.get(check_name)
+        ttl_sec = self.ttl_sec_by_check.get(check_name, self.default_ttl_sec)
+        if not force and entry is not None and entry.get("result") == "ok" \
+                and entry.get("fingerprint") == fingerprint:
+            check_age_sec = time.time() - entry.get("timestamp", 0)
+            if 0 <= check_age_sec <= ttl_sec:
+                logging.info("Check %s has succeeded %d seconds ago, skipping it." % (check_name, check_age_sec))
+                return False
+
+        try:
+            check_function()
+        except Exception:
+            self.__record(check_name, "failed", fingerprint)
+            raise
+        self.__record(check_name, "ok", fingerprint)
+        return True
+
+    # Forget the results of a single check or of every check
+    def invalidate(self, check_name=None):
+        with self.__lock:
+            if check_name is None:
+                logging.debug("Invalidating every cached validation result...")
+                self.__entries = {}
+            else:
+                logging.debug("Invalidating the cached result of check %s..." % check_name)
+                self.__entries.pop(check_name, None)
+            self.__save()
+
+    def __fingerprint(self, triggers):
+        fingerprints = []
+        for trigger in sorted(triggers):
+            try:
+                fingerprints.append("%s=%s" % (trigger, self.trigger_functions[trigger]()))
+            except Exception, e:
+                # Without a fingerprint, the check must always run
+                logging.debug("Was not able to determine fingerprint for %s: %s" % (trigger, e))
+                fingerprints.append("%s=%s" % (trigger, time.time()))
+        return hashlib.sha1("\n".join(fingerprints)).hexdigest()
+
+    def __record(self, check_name, result, fingerprint):
+        with self.__lock:
+            self.__entries[check_name] = {"result": result,
+                                          "fingerprint": fingerprint,
+                                          "timestamp": time.time()}
+            self.__save()
+
+    def __load(self):
+        if not os.path.exists(self.cache_file_path):
+            return {}
+        try:
+            with open(self.cache_file_path, "r") as f:
+                return json.load(f)
+        except (IOError, ValueError), e:
+            logging.debug("Was not able to read validation cache %s, ignoring it: %s" % (self.cache_file_path, e))
+            return {}
+
+    def __save(self):
+        temp_file_path = self.cache_file_path + ".tmp"
+        try:
+            with open(temp_file_path, "w") as f:
+                json.dump(self.__entries, f)
+            os.rename(temp_file_path, self.cache_file_path)
+        except (IOError, OSError), e:
+            logging.debug("Was not able to write validation cache %s: %s" % (self.cache_file_path, e))
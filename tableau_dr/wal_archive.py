@@ -0,0 +1,232 @@
+"""
+tableau-dr
+Copyright (C) 2016 brilliant-data.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import threading
+import tarfile
+import shutil
+import fcntl
+import json
+import time
+import re
+import os
+import defaults as d
+
+WAL_SEGMENT_PATTERN = re.compile(r"^[0-9A-F]{24}(\.partial)?$")
+BACKUP_LABEL_START_PATTERN = re.compile(r"^START WAL LOCATION: .* \(file ([0-9A-F]{24})\)$", re.MULTILINE)
+
+
+# Custom exception
+class WalArchiveException(Exception):
+    pass
+
+
+# Base backups to delete: everything older than the retention window,
+# except the newest one before the window, which is needed to recover to the start of the window
+def expired_base_backups(base_backups, retention_start_time):
+    old_base_backups = filter(lambda x: x["finish_time"] < retention_start_time, base_backups)
+    return sorted(old_base_backups, key=lambda x: x["finish_time"])[:-1]
+
+
+# WAL segments to delete: everything before the first segment of the oldest remaining base backup
+def expired_wal_segments(wal_segments, oldest_needed_segment):
+    return filter(lambda x: x[:24] < oldest_needed_segment, wal_segments)
+
+
+# Archive of the source Tableau Server's Postgres on the rescue box: WAL streamed by pg_receivexlog
+# and periodic base backups, kept for a retention window
+class WalArchive:
+
+    # Constructor
+    def __init__(self, env_manager, source_host, archive_root_dir, retention_sec, base_backup_interval_sec):
+        logging.debug("WAL archive for %s is being initialized!" % source_host)
+        self.env_manager = env_manager
+        self.source_host = source_host
+        self.archive_dir = os.path.join(archive_root_dir, source_host)
+        self.wal_dir = os.path.join(self.archive_dir, "wal")
+        self.base_dir = os.path.join(self.archive_dir, "base")
+        self.pgpass_file_path = os.path.join(self.archive_dir, ".pgpass")
+        self.retention_sec = retention_sec
+        self.base_backup_interval_sec = base_backup_interval_sec
+        self.__base_backup_lock = threading.Lock()
+
+    # Create the archive, start receiving WAL and let the replica catch up from the archive
+    def enable(self):
+        logging.info("Enabling the WAL archive for %s..." % self.source_host)
+        for dir_path in [self.archive_dir, self.wal_dir, self.base_dir]:
+            if not os.path.exists(dir_path):
+                os.makedirs(dir_path)
+            os.chmod(dir_path, 0755)  # Postgres reads the archive when restoring WAL
+
+        with open(self.pgpass_file_path, "w") as f:
+            f.write(d.PGPASS_FILE_CONTENT.format(host=self.source_host,
+                                                 port=d.REMOTE_PG_PORT,
+                                                 database="replication",
+                                                 user=d.REMOTE_PG_USER,
+                                                 pwd=self.env_manager.pg_password) + "\n")
+        os.chmod(self.pgpass_file_path, 0600)
+
+        self.env_manager.schedule_wal_receiver(source_host=self.source_host,
+                                               archive_dir=self.archive_dir,
+                                               wal_dir=self.wal_dir)
+        self.env_manager.enable_replica_wal_restore(wal_dir=self.wal_dir)
+        logging.info("WAL archive has been enabled in %s!" % self.archive_dir)
+
+    def disable(self):
+        logging.info("Disabling the WAL archive...")
+        self.env_manager.remove_wal_receiver_jobs()
+
+    # Take a base backup when the last one is too old and delete what has fallen out of the retention window
+    def maintain(self):
+        if self.is_base_backup_due():
+            self.take_base_backup()
+        self.apply_retention()
+
+    def is_base_backup_due(self):
+        base_backups = self.base_backups()
+        return len(base_backups) == 0 or time.time() - base_backups[-1]["finish_time"] >= self.base_backup_interval_sec
+
+    # Only one base backup is taken at a time, returns None if another one is in progress
+    def take_base_backup(self):
+        if not self.__base_backup_lock.acquire(False):
+            logging.info("A base backup of %s is already in progress." % self.source_host)
+            return None
+        try:
+            return self.__take_base_backup()
+        finally:
+            self.__base_backup_lock.release()
+
+    def __take_base_backup(self):
+        base_backup_name = time.strftime("%Y%m%d%H%M%S", time.gmtime())
+        base_backup_dir = os.path.join(self.base_dir, base_backup_name)
+        logging.info("Creating base backup %s of %s for the WAL archive..." % (base_backup_name, self.source_host))
+        start_time = time.time()
+        try:
+            self.env_manager.archive_base_backup(source_host=self.source_host,
+                                                 base_backup_dir=base_backup_dir,
+                                                 pgpass_file_path=self.pgpass_file_path)
+            start_segment = self.__read_start_segment(os.path.join(base_backup_dir, "base.tar.gz"))
+        except Exception:
+            shutil.rmtree(base_backup_dir, ignore_errors=True)
+            raise
+
+        backup_info = {"name": base_backup_name,
+                       "start_time": start_time,
+                       "finish_time": time.time(),
+                       "start_segment": start_segment}
+        with open(os.path.join(base_backup_dir, "backup_info.json"), "w") as f:
+            json.dump(backup_info, f)
+        logging.info("Base backup %s has been created in %.1f seconds!" % (base_backup_name,
+                                                                          backup_info["finish_time"] - start_time))
+        return backup_info
+
+    # Completed base backups ordered by age
+    def base_backups(self):
+        base_backups = []
+        if not os.path.exists(self.base_dir):
+            return base_backups
+        for base_backup_name in os.listdir(self.base_dir):
+            backup_info_path = os.path.join(self.base_dir, base_backup_name, "backup_info.json")
+            if not os.path.exists(backup_info_path):
+                continue  # The base backup is in progress or has failed
+            with open(backup_info_path, "r") as f:
+                backup_info = json.load(f)
+            backup_info["file_path"] = os.path.join(self.base_dir, base_backup_name, "base.tar.gz")
+            base_backups.append(backup_info)
+        return sorted(base_backups, key=lambda x: x["finish_time"])
+
+    def wal_segments(self):
+        if not os.path.exists(self.wal_dir):
+            return []
+        return sorted(filter(lambda x: WAL_SEGMENT_PATTERN.match(x), os.listdir(self.wal_dir)))
+
+    def apply_retention(self):
+        retention_start_time = time.time() - self.retention_sec
+        base_backups = self.base_backups()
+        for base_backup in expired_base_backups(base_backups, retention_start_time):
+            logging.info("Deleting base backup %s, it is out of the retention window..." % base_backup["name"])
+            shutil.rmtree(os.path.join(self.base_dir, base_backup["name"]))
+            base_backups.remove(base_backup)
+
+        if len(base_backups) == 0:
+            return  # Without a base backup every WAL segment may still be needed
+        expired_segments = expired_wal_segments(self.wal_segments(), base_backups[0]["start_segment"])
+        logging.debug("Deleting %s WAL segments that are out of the retention window..." % len(expired_segments))
+        for wal_segment in expired_segments:
+            os.remove(os.path.join(self.wal_dir, wal_segment))
+
+    # Time range a backup can be recovered to
+    def recovery_window(self):
+        base_backups = self.base_backups()
+        if len(base_backups) == 0:
+            return None
+        return base_backups[0]["finish_time"], time.time()
+
+    # Newest base backup that a recovery to the given time can start from
+    def base_backup_for(self, point_in_time):
+        base_backups = filter(lambda x: x["finish_time"] <= point_in_time, self.base_backups())
+        if len(base_backups) == 0:
+            recovery_window = self.recovery_window()
+            raise WalArchiveException("%s is not within the recovery window of the WAL archive (%s)!"
+                                      % (time.strftime(d.PITR_TIME_FORMAT, time.localtime(point_in_time)),
+                                         "%s - now" % time.strftime(d.PITR_TIME_FORMAT,
+                                                                    time.localtime(recovery_window[0]))
+                                         if recovery_window is not None else "no base backups"))
+        return base_backups[-1]
+
+    # Ensure that WAL is being received and a base backup exists
+    def check(self):
+        if self.__is_receiver_running():
+            logging.debug("WAL receiver is running.")
+        else:
+            raise WalArchiveException("The WAL receiver of %s is not running! Cron restarts it within a minute, "
+                                      "check %s if it keeps failing." % (self.source_host, self.wal_dir))
+
+        wal_files = filter(lambda x: WAL_SEGMENT_PATTERN.match(x), os.listdir(self.wal_dir))
+        if len(wal_files) == 0:
+            raise WalArchiveException("The WAL archive of %s does not contain any WAL!" % self.source_host)
+        last_write_age_sec = time.time() - max([os.path.getmtime(os.path.join(self.wal_dir, x)) for x in wal_files])
+        if last_write_age_sec > d.WAL_ARCHIVE_MAX_RECEIVER_DELAY_SEC:
+            logging.warning("No WAL has been received from %s for %d seconds." % (self.source_host,
+                                                                                  last_write_age_sec))
+
+        if len(self.base_backups()) == 0:
+            logging.warning("The WAL archive of %s does not contain a base backup yet, "
+                            "point in time recovery is not possible." % self.source_host)
+        logging.info("WAL archive is OK!")
+
+    def __is_receiver_running(self):
+        lock_file_path = os.path.join(self.archive_dir, "receiver.lock")
+        if not os.path.exists(lock_file_path):
+            return False
+        with open(lock_file_path, "r") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                return True  # The receiver holds the lock
+            fcntl.flock(f, fcntl.LOCK_UN)
+            return False
+
+    def __read_start_segment(self, base_backup_file_path):
+        with tarfile.open(base_backup_file_path, "r:gz") as base_backup_tar:
+            backup_label = base_backup_tar.extractfile("backup_label").read()
+        match = BACKUP_LABEL_START_PATTERN.search(backup_label)
+        if match is None:
+            raise WalArchiveException("Was not able to find the starting WAL segment in the backup label of %s!"
+                                      % base_backup_file_path)
+        return match.group(1)
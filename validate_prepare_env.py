@@ -17,9 +17,7 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import logging
-import threading
-import Queue
-import sys
+from tableau_dr.concurrency import run_concurrently
 
 def prepare_remote_server(remote_server, pg_pass, dr_ip, start_afterwards=False):
     logging.info("Preparing Tableau Server on %s..." % remote_server.host)
@@ -53,33 +51,62 @@ def prepare_dr_unix(env_manager, source_server, target_server):
         env_manager.install_build_postgres(source_server=source_server)
 
 
-def validate_tableau_dr(env_manager, source_server, target_server):
+def validate_tableau_dr(env_manager, source_server, target_server, validation_cache=None, force=False,
+                        replica_monitor=None):
     logging.info("Validating environment is in progress...")
-    env_manager.validate_os()
-    env_manager.validate_user()
-    env_manager.validate_rescue_dir()
-    env_manager.validate_paths()
-    env_manager.validate_mountdir()
 
     if env_manager.tdfs_enabled:
-        env_manager.check_filestore()
+        check_replication = env_manager.check_filestore
     else:
-        env_manager.check_rsync()
-
-    env_manager.check_postgres(source_server=source_server,
-                               target_server=target_server)
-    source_server.validate_exec_policy()
-    source_server.validate_tableau_paths()
-    source_server.validate_winrm_config()
+        check_replication = env_manager.check_rsync
+
+    def run_checks(checks):
+        # Each check comes with the inputs whose change invalidates its cached result
+        for check_name, check_function, triggers in checks:
+            if validation_cache is None:
+                check_function()
+            else:
+                validation_cache.run_check(check_name=check_name,
+                                           check_function=check_function,
+                                           triggers=triggers,
+                                           force=force)
+
+    local_checks = [("os", env_manager.validate_os, []),
+                    ("user", env_manager.validate_user, ["config"]),
+                    ("rescue_dir", env_manager.validate_rescue_dir, ["config"]),
+                    ("paths", env_manager.validate_paths, ["config", "mounts"]),
+                    ("mountdir", env_manager.validate_mountdir, ["config", "mounts"]),
+                    ("replication", check_replication, ["config", "crontab"])]
+
+    # Local checks and the checks of each Windows server are independent, run them in parallel
+    parallel_checks = [("local_checks", lambda: run_checks(local_checks)),
+                       ("source_server_checks",
+                        lambda: run_checks([("source_server", lambda: validate_remote_server(source_server),
+                                             ["config"])]))]
     if target_server is not None:
-        target_server.validate_exec_policy()
-        target_server.validate_tableau_paths()
-        target_server.validate_winrm_config()
+        parallel_checks.append(("target_server_checks",
+                                lambda: run_checks([("target_server", lambda: validate_remote_server(target_server),
+                                                     ["config"])])))
+    run_concurrently(parallel_checks)
+
+    # Postgres check may reconfigure the Windows servers, therefore it runs on its own
+    run_checks([("postgres", lambda: env_manager.check_postgres(source_server=source_server,
+                                                                target_server=target_server), ["config"])])
+
+    # Replication lag changes all the time, it is never taken from the cache
+    if replica_monitor is not None:
+        replica_monitor.check()
 
     logging.info("Environment has been successfully validated!")
 
 
-def prepare_tableau_dr(env_manager, source_server, target_server, dr_ip):
+def validate_remote_server(remote_server):
+    remote_server.validate_exec_policy()
+    remote_server.validate_tableau_paths()
+    remote_server.validate_winrm_config()
+
+
+def prepare_tableau_dr(env_manager, source_server, target_server, dr_ip, incremental_resync=False):
     logging.info("Preparing environment is in progress...")
 
     # Validate that failover user is running me
@@ -91,30 +118,32 @@ def prepare_tableau_dr(env_manager, source_server, target_server, dr_ip):
     logging.info("Ensuring appropriate access control settings on the Windows machine...")
     servers = [source_server, target_server]
     servers = filter(lambda x: x is not None, servers)
-    for server in servers:
-        server.validate_exec_policy()
-        server.validate_tableau_paths()
-        server.validate_winrm_config()
+
+    def prepare_access_control(server):
+        validate_remote_server(server)
         server.net_share_tab_data()
         server.ensure_app_data_permissions()
 
+    run_concurrently([(server.host, lambda server=server: prepare_access_control(server)) for server in servers])
+
     prepare_dr_unix(env_manager,
                     source_server,
                     target_server)
 
-    # Preparing source Tableau Server
-    prepare_remote_server(source_server,
-                          env_manager.pg_password,
-                          dr_ip,
-                          True)
-
+    # Preparing source and target Tableau Servers in parallel
+    remote_server_tasks = [(source_server.host, lambda: prepare_remote_server(source_server,
+                                                                              env_manager.pg_password,
+                                                                              dr_ip,
+                                                                              True))]
     if target_server is not None:
-        prepare_remote_server(target_server,
-                              env_manager.pg_password,
-                              dr_ip)
+        remote_server_tasks.append((target_server.host, lambda: prepare_remote_server(target_server,
+                                                                                      env_manager.pg_password,
+                                                                                      dr_ip)))
+    run_concurrently(remote_server_tasks)
 
     logging.info("Creating a basebackup for the source Tableau Server and starting it afterwards...")
-    env_manager.basebackup_start_source_postgres(source_server=source_server)
+    env_manager.basebackup_start_source_postgres(source_server=source_server,
+                                                 incremental=incremental_resync)
     logging.info("Environment has been successfully prepared!")
 
 